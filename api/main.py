@@ -1,13 +1,15 @@
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from api.routes import auth, config, providers, bot, conversations, wizard, faqs, permissions
+from api.routes import auth, config, providers, bot, conversations, wizard, faqs, permissions, metrics, backup
 import db
+from utils import tokens
 
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    await tokens.load_encoding()
     await db.init_db()
     await db.sync_env_to_db()
     yield
@@ -36,6 +38,8 @@ def create_app() -> FastAPI:
     app.include_router(wizard.router, prefix="/api/wizard", tags=["wizard"])
     app.include_router(faqs.router, prefix="/api/faqs", tags=["faqs"])
     app.include_router(permissions.router, prefix="/api/permissions", tags=["permissions"])
+    app.include_router(metrics.router, prefix="/api/metrics", tags=["metrics"])
+    app.include_router(backup.router, prefix="/api/backup", tags=["backup"])
 
     @app.get("/api/health")
     async def health():
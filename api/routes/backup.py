@@ -0,0 +1,43 @@
+import datetime
+import zlib
+from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile
+from fastapi.responses import StreamingResponse
+from api.deps import get_current_user
+from storage import EXPORT_TABLES
+from utils import backup
+
+router = APIRouter()
+
+
+@router.get("/export")
+async def export_backup(
+    tables: list[str] | None = Query(None),
+    user: dict = Depends(get_current_user),
+):
+    """Stream conversations, FAQs and per-guild settings as gzip NDJSON."""
+    unknown = set(tables or ()) - set(EXPORT_TABLES)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown tables: {', '.join(sorted(unknown))}")
+
+    filename = f"sparksage-{datetime.datetime.now(datetime.timezone.utc):%Y%m%d-%H%M%S}.ndjson.gz"
+    return StreamingResponse(
+        backup.export_gzip(tables),
+        media_type="application/gzip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@router.post("/import")
+async def import_backup(
+    file: UploadFile = File(...),
+    user: dict = Depends(get_current_user),
+):
+    """Load an export (gzip or plain NDJSON). Safe to repeat: rows already imported are skipped."""
+    async def chunks():
+        while chunk := await file.read(backup.CHUNK_BYTES):
+            yield chunk
+
+    try:
+        return await backup.import_lines(backup.read_lines(chunks()))
+    except (ValueError, KeyError, TypeError, zlib.error) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid export: {e}")
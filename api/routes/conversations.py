@@ -1,4 +1,7 @@
-from fastapi import APIRouter, Depends
+import json
+from typing import Literal
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from api.deps import get_current_user
 import db
 
@@ -11,10 +14,91 @@ async def list_conversations(user: dict = Depends(get_current_user)):
     return {"channels": channels}
 
 
+# Declared before /{channel_id} so "search" isn't taken for a channel ID
+@router.get("/search")
+async def search_conversations(
+    q: str = Query(..., min_length=1),
+    channel_id: str | None = None,
+    guild_id: str | None = None,
+    provider: str | None = None,
+    type: str | None = None,
+    since: str | None = None,
+    until: str | None = None,
+    sort: Literal["rank", "recent"] = "rank",
+    cursor: str | None = None,
+    limit: int = Query(20, ge=1, le=100),
+    user: dict = Depends(get_current_user),
+):
+    """Full-text search. Pass next_cursor back as cursor for the next page."""
+    after_score = after_id = None
+    if cursor:
+        try:
+            if sort == "rank":
+                score, _, last_id = cursor.partition(":")
+                after_score, after_id = float(score), int(last_id)
+            else:
+                after_id = int(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    results = await db.search_messages(
+        q, channel_id=channel_id, guild_id=guild_id, provider=provider, type=type,
+        since=since, until=until, sort=sort, after_score=after_score, after_id=after_id, limit=limit,
+    )
+    next_cursor = None
+    if len(results) == limit:
+        last = results[-1]
+        next_cursor = f"{last['score']!r}:{last['id']}" if sort == "rank" else str(last["id"])
+    return {"results": results, "next_cursor": next_cursor}
+
+
 @router.get("/{channel_id}")
-async def get_conversation(channel_id: str, user: dict = Depends(get_current_user)):
-    messages = await db.get_messages(channel_id, limit=100)
-    return {"channel_id": channel_id, "messages": messages}
+async def get_conversation(
+    channel_id: str,
+    before_id: int | None = None,
+    after_id: int | None = None,
+    limit: int = Query(100, ge=1, le=500),
+    user: dict = Depends(get_current_user),
+):
+    # Fetch one extra row to know whether another page follows
+    messages = await db.get_messages(channel_id, limit=limit + 1, before_id=before_id, after_id=after_id)
+    forward = after_id is not None and before_id is None
+    has_more = len(messages) > limit
+    if has_more:
+        messages = messages[:limit] if forward else messages[1:]
+    return {
+        "channel_id": channel_id,
+        "messages": messages,
+        "has_more": has_more,
+        "next_before_id": messages[0]["id"] if has_more and not forward else None,
+        "next_after_id": messages[-1]["id"] if has_more and forward else None,
+    }
+
+
+@router.get("/{channel_id}/export")
+async def export_conversation(
+    channel_id: str,
+    after_id: int = 0,
+    user: dict = Depends(get_current_user),
+):
+    """Stream a channel's whole (hot) history as NDJSON, oldest first."""
+    async def lines():
+        async for message in db.iter_messages(channel_id, after_id=after_id):
+            yield json.dumps(message, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@router.get("/{channel_id}/archive")
+async def get_archived_conversation(
+    channel_id: str,
+    before_id: int | None = None,
+    limit: int = Query(100, ge=1, le=500),
+    user: dict = Depends(get_current_user),
+):
+    messages = await db.get_archived_messages(channel_id, before_id=before_id, limit=limit)
+    next_before_id = messages[0]["id"] if len(messages) == limit else None
+    return {"channel_id": channel_id, "messages": messages, "next_before_id": next_before_id}
 
 
 @router.delete("/{channel_id}")
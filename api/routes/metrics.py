@@ -0,0 +1,23 @@
+from fastapi import APIRouter, Depends
+from api.deps import get_current_user
+import db
+import providers
+from utils.moderation import batcher as moderation_batcher, queue as moderation_queue, verdicts as moderation_verdicts
+from utils.prefilter import prefilter as moderation_prefilter
+
+router = APIRouter()
+
+
+@router.get("")
+async def get_metrics(user: dict = Depends(get_current_user)):
+    return {
+        "response_cache": providers.get_cache_stats(),
+        "scheduler": providers.get_scheduler_stats(),
+        "singleflight": providers.get_singleflight_stats(),
+        "moderation": moderation_batcher.snapshot(),
+        "moderation_prefilter": moderation_prefilter.snapshot(),
+        "moderation_queue": moderation_queue.snapshot(),
+        "moderation_verdict_cache": moderation_verdicts.snapshot(),
+        "db_writes": db.get_write_stats(),
+        "settings_cache": db.get_settings_cache_stats(),
+    }
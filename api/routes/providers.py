@@ -17,6 +17,7 @@ class SetPrimaryRequest(BaseModel):
 @router.get("")
 async def list_providers(user: dict = Depends(get_current_user)):
     available = providers.get_available_providers()
+    health = providers.get_health()
     result = []
     for name, info in config.PROVIDERS.items():
         result.append({
@@ -26,8 +27,13 @@ async def list_providers(user: dict = Depends(get_current_user)):
             "free": info["free"],
             "configured": name in available,
             "is_primary": name == config.AI_PROVIDER,
+            "health": health.get(name),
         })
-    return {"providers": result, "fallback_order": providers.FALLBACK_ORDER}
+    return {
+        "providers": result,
+        "fallback_order": providers.get_live_order(),
+        "configured_order": providers.FALLBACK_ORDER,
+    }
 
 
 class TestProviderRequest(BaseModel):
@@ -36,7 +42,7 @@ class TestProviderRequest(BaseModel):
 
 @router.post("/test")
 async def test_provider(body: TestProviderRequest, user: dict = Depends(get_current_user)):
-    result = providers.test_provider(body.provider)
+    result = await providers.test_provider(body.provider)
     return result
 
 
@@ -0,0 +1,114 @@
+"""Local OpenAI-compatible stub server for offline benchmarks.
+
+Each provider gets its own path prefix (``http://127.0.0.1:<port>/<provider>/v1``)
+and its own behaviour profile: a log-normal latency distribution plus rates of
+500 errors and 429 rate limits. Both plain and ``stream=True`` chat completions
+are supported.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import random
+import time
+from dataclasses import dataclass, field
+
+from aiohttp import web
+
+
+@dataclass
+class Profile:
+    """Behaviour of one stubbed provider."""
+
+    median_ms: float = 500
+    jitter: float = 0.4  # sigma of the log-normal latency distribution
+    error_rate: float = 0.0  # fraction of requests answered with HTTP 500
+    rate_limit_rate: float = 0.0  # fraction of requests answered with HTTP 429
+    tokens: int = 60  # words in each reply
+    stats: dict = field(default_factory=lambda: {"requests": 0, "ok": 0, "errors": 0, "rate_limited": 0})
+
+    def latency(self) -> float:
+        return random.lognormvariate(0, self.jitter) * self.median_ms / 1000
+
+
+def _completion(model: str, content: str) -> dict:
+    return {
+        "id": f"chatcmpl-{random.getrandbits(48):x}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+def _chunk(model: str, content: str | None, finish_reason: str | None = None) -> bytes:
+    delta = {"content": content} if content is not None else {}
+    payload = {
+        "id": "chatcmpl-stream",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(payload)}\n\n".encode()
+
+
+def create_app(profiles: dict[str, Profile]) -> web.Application:
+    async def completions(request: web.Request) -> web.StreamResponse:
+        profile = profiles.get(request.match_info["provider"])
+        if profile is None:
+            return web.json_response({"error": {"message": "unknown provider"}}, status=404)
+
+        body = await request.json()
+        profile.stats["requests"] += 1
+        latency = profile.latency()
+        roll = random.random()
+        if roll < profile.rate_limit_rate:
+            profile.stats["rate_limited"] += 1
+            await asyncio.sleep(min(latency, 0.05))
+            return web.json_response({"error": {"message": "rate limited", "type": "rate_limit"}}, status=429)
+        if roll < profile.rate_limit_rate + profile.error_rate:
+            profile.stats["errors"] += 1
+            await asyncio.sleep(latency)
+            return web.json_response({"error": {"message": "upstream error", "type": "server_error"}}, status=500)
+
+        words = [f"word{i}" for i in range(profile.tokens)]
+        model = body.get("model", "stub")
+        if not body.get("stream"):
+            await asyncio.sleep(latency)
+            profile.stats["ok"] += 1
+            return web.json_response(_completion(model, " ".join(words)))
+
+        # Streams spend ~30% of the latency before the first token, the rest spread over tokens
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await asyncio.sleep(latency * 0.3)
+        per_token = latency * 0.7 / max(1, len(words))
+        for word in words:
+            await response.write(_chunk(model, word + " "))
+            await asyncio.sleep(per_token)
+        await response.write(_chunk(model, None, "stop"))
+        await response.write(b"data: [DONE]\n\n")
+        profile.stats["ok"] += 1
+        return response
+
+    async def root(request: web.Request) -> web.Response:
+        return web.Response(text="ok")
+
+    app = web.Application()
+    app.router.add_post("/{provider}/v1/chat/completions", completions)
+    app.router.add_route("*", "/{provider}/v1", root)
+    app.router.add_route("*", "/{provider}/v1/", root)
+    return app
+
+
+async def start(profiles: dict[str, Profile], host: str = "127.0.0.1", port: int = 0) -> tuple[web.AppRunner, str]:
+    """Start the stub server; returns (runner, base URL). Port 0 picks a free port."""
+    runner = web.AppRunner(create_app(profiles), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{bound_port}"
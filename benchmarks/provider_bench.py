@@ -0,0 +1,187 @@
+"""Offline benchmark for providers.py and SparkSageBot.ask_ai.
+
+Starts the stub server from benchmarks/mock_openai.py, points config.PROVIDERS
+at it and drives N concurrent simulated channels, each sending requests back to
+back. Reports throughput, latency percentiles and which providers answered, so
+fallback, hedging and scheduling behaviour can be compared between changes
+without spending real quota.
+
+    python -m benchmarks.provider_bench --channels 20 --requests 10
+    python -m benchmarks.provider_bench --stream --provider gemini:2000:0.1:0.2
+    python -m benchmarks.provider_bench --ask-ai   # full path incl. SQLite history
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+import config
+import providers
+from benchmarks import mock_openai
+
+DEFAULT_PROFILES = [
+    "gemini:800:0.02:0.05",
+    "groq:300:0.01:0.02",
+    "openrouter:1200:0.05:0",
+]
+
+
+def _parse_profile(spec: str) -> tuple[str, mock_openai.Profile]:
+    """Parse NAME:MEDIAN_MS[:ERROR_RATE[:RATE_LIMIT_RATE]]."""
+    name, *values = spec.split(":")
+    numbers = [float(v) for v in values]
+    profile = mock_openai.Profile(median_ms=numbers[0] if numbers else 500)
+    if len(numbers) > 1:
+        profile.error_rate = numbers[1]
+    if len(numbers) > 2:
+        profile.rate_limit_rate = numbers[2]
+    return name, profile
+
+
+def _percentile(ordered: list[float], p: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def _point_providers_at(base_url: str, names: list[str], keep_limits: bool):
+    """Redirect the configured providers to the stub and make them the fallback chain."""
+    for name in names:
+        provider = config.PROVIDERS[name]
+        provider["base_url"] = f"{base_url}/{name}/v1"
+        provider["api_key"] = "bench"
+        if not keep_limits:
+            provider["rpm"] = 0
+            provider["tpm"] = 0
+    for name in set(config.PROVIDERS) - set(names):
+        config.PROVIDERS[name]["api_key"] = None
+    config.AI_PROVIDER = names[0]
+    config.FREE_FALLBACK_CHAIN = names[1:]
+    providers.reload_clients()
+
+
+class _BenchBot:
+    """Builds a SparkSageBot that can run ask_ai without logging in to Discord."""
+
+    @staticmethod
+    def create():
+        import discord
+        from bot import SparkSageBot
+
+        class BenchBot(SparkSageBot):
+            @property
+            def user(self):
+                return SimpleNamespace(display_name="SparkSage", id=0)
+
+        return BenchBot(command_prefix="!", intents=discord.Intents.default())
+
+
+async def _channel(channel: int, args, bot, latencies: list[float], served: Counter, failures: list[str]):
+    for i in range(args.requests):
+        prompt = f"channel {channel} message {i}: how do I benchmark things?"
+        start = time.perf_counter()
+        try:
+            if bot is not None:
+                response, provider_name = await bot.ask_ai(channel, f"user{channel}", prompt)
+                if provider_name == "none":
+                    raise RuntimeError(response)
+            elif args.stream:
+                provider_name = "none"
+                async for _, provider_name in providers.chat_stream(
+                    [{"role": "user", "content": prompt}], config.SYSTEM_PROMPT, request_type=args.request_type
+                ):
+                    pass
+            else:
+                _, provider_name = await providers.chat(
+                    [{"role": "user", "content": prompt}], config.SYSTEM_PROMPT, request_type=args.request_type
+                )
+            served[provider_name] += 1
+            latencies.append(time.perf_counter() - start)
+        except Exception as e:
+            failures.append(str(e).splitlines()[-1])
+
+
+async def run(args) -> dict:
+    profiles = dict(_parse_profile(spec) for spec in (args.provider or DEFAULT_PROFILES))
+    runner, base_url = await mock_openai.start(profiles)
+    _point_providers_at(base_url, list(profiles), args.keep_limits)
+    config.CACHE_ENABLED = not args.no_cache
+
+    bot = None
+    if args.ask_ai:
+        import db
+
+        db.DATABASE_PATH = os.path.join(tempfile.mkdtemp(prefix="sparksage-bench-"), "bench.db")
+        await db.init_db()
+        bot = _BenchBot.create()
+
+    latencies: list[float] = []
+    served: Counter = Counter()
+    failures: list[str] = []
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(
+            *(_channel(channel, args, bot, latencies, served, failures) for channel in range(1, args.channels + 1))
+        )
+    finally:
+        elapsed = time.perf_counter() - started
+        if bot is not None:
+            import db
+
+            await db.close_db()
+        await runner.cleanup()
+
+    ordered = sorted(latencies)
+    return {
+        "mode": "ask_ai" if args.ask_ai else ("stream" if args.stream else "chat"),
+        "request_type": args.request_type,
+        "channels": args.channels,
+        "requests": args.channels * args.requests,
+        "succeeded": len(latencies),
+        "failed": len(failures),
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(len(latencies) / elapsed, 2) if elapsed else 0,
+        "latency_ms": {
+            "p50": round(_percentile(ordered, 50) * 1000, 1),
+            "p95": round(_percentile(ordered, 95) * 1000, 1),
+            "p99": round(_percentile(ordered, 99) * 1000, 1),
+            "max": round((ordered[-1] if ordered else 0) * 1000, 1),
+        },
+        "served_by": dict(served),
+        "stub": {name: profile.stats for name, profile in profiles.items()},
+        "failure_samples": Counter(failures).most_common(3),
+        "health": providers.get_health(),
+        "scheduler": providers.get_scheduler_stats(),
+        "singleflight": providers.get_singleflight_stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--channels", type=int, default=10, help="concurrent simulated channels")
+    parser.add_argument("--requests", type=int, default=10, help="requests sent by each channel, back to back")
+    parser.add_argument(
+        "--provider",
+        action="append",
+        metavar="NAME:MEDIAN_MS[:ERROR_RATE[:RATE_LIMIT_RATE]]",
+        help="stub profile; repeat for each provider, first one is primary (default: %s)" % " ".join(DEFAULT_PROFILES),
+    )
+    parser.add_argument("--stream", action="store_true", help="use providers.chat_stream()")
+    parser.add_argument("--ask-ai", action="store_true", help="go through SparkSageBot.ask_ai with a temporary database")
+    parser.add_argument("--request-type", default="chat", help="request type for priority/hedging/caching (default: chat)")
+    parser.add_argument("--keep-limits", action="store_true", help="keep the configured per-provider RPM/TPM limits")
+    parser.add_argument("--no-cache", action="store_true", help="disable the response cache")
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
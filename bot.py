@@ -1,11 +1,17 @@
 from __future__ import annotations
 
+import time
+
 import discord
 from discord.ext import commands
 
 import config
 import providers
 import db as database
+from utils.context import build_context
+from utils.streaming import StreamingReply
+from utils import tokens
+from utils.tokens import count_tokens
 
 intents = discord.Intents.default()
 intents.message_content = True
@@ -14,19 +20,35 @@ intents.members = True
 class SparkSageBot(commands.Bot):
     def __init__(self, command_prefix, intents):
         super().__init__(command_prefix=command_prefix, intents=intents)
-        self.MAX_HISTORY = 20
 
-    async def get_history(self, channel_id: int) -> list[dict]:
-        """Get conversation history for a channel from the database."""
-        messages = await database.get_messages(str(channel_id), limit=self.MAX_HISTORY)
-        return [{"role": m["role"], "content": m["content"]} for m in messages]
+    async def get_history(self, channel_id: int, system_prompt: str | None = None, provider_name: str | None = None) -> list[dict]:
+        """Get the conversation history for a channel that fits the token budget.
 
-    async def ask_ai(self, channel_id: int, user_name: str, message: str, system_prompt: str = None, message_type: str = None) -> tuple[str, str]:
-        """Send a message to AI and return (response, provider_name)."""
-        # Store user message in DB
-        await database.add_message(str(channel_id), "user", user_name, message, type=message_type)
+        Considers the last CONTEXT_MAX_MESSAGES rows; see utils.context.build_context().
+        """
+        rows = await database.get_messages(str(channel_id), limit=config.CONTEXT_MAX_MESSAGES)
+        history, computed_counts = build_context(rows, system_prompt or config.SYSTEM_PROMPT, provider_name or config.AI_PROVIDER)
+        await database.set_token_counts(computed_counts)
+        return history
+
+    async def ask_ai(self, channel_id: int, user_name: str, message: str, system_prompt: str = None, message_type: str = None, stream: StreamingReply | None = None, request_type: str | None = None) -> tuple[str, str]:
+        """Send a message to AI and return (response, provider_name).
+
+        request_type selects per-type provider behaviour such as hedging; it
+        defaults to message_type, or "chat" for plain /ask and mention traffic.
 
-        history = await self.get_history(channel_id)
+        If a StreamingReply is given, the response is streamed into it as it is
+        generated; the caller is responsible for calling its finish().
+
+        Every call stores its own message first, so concurrent identical calls
+        are not coalesced by providers.chat(); use ask_once for requests that
+        should be.
+        """
+        channel = self.get_channel(int(channel_id))
+        guild_id = str(channel.guild.id) if getattr(channel, "guild", None) else None
+
+        # Store user message in DB
+        await database.add_message(str(channel_id), "user", user_name, message, type=message_type, guild_id=guild_id)
 
         # Get channel-specific system prompt if available
         channel_system_prompt = await database.get_channel_prompt(str(channel_id))
@@ -35,15 +57,69 @@ class SparkSageBot(commands.Bot):
         # Get channel-specific provider if available
         channel_provider_override = await database.get_channel_provider(str(channel_id))
 
+        history = await self.get_history(channel_id, final_system_prompt, channel_provider_override)
+
+        request_type = request_type or message_type or "chat"
+
         try:
-            response, provider_name = providers.chat(history, final_system_prompt, primary_provider=channel_provider_override)
+            if stream is not None:
+                provider_name = "none"
+                async for delta, provider_name in providers.chat_stream(history, final_system_prompt, primary_provider=channel_provider_override, request_type=request_type):
+                    await stream.push(delta)
+                response = stream.content
+            else:
+                response, provider_name = await providers.chat(history, final_system_prompt, primary_provider=channel_provider_override, request_type=request_type)
             # Store assistant response in DB
-            await database.add_message(str(channel_id), "assistant", self.user.display_name, response, provider=provider_name, type=message_type)
+            await database.add_message(str(channel_id), "assistant", self.user.display_name, response, provider=provider_name, type=message_type, guild_id=guild_id)
             return response, provider_name
         except RuntimeError as e:
-            return f"Sorry, all AI providers failed:\n{e}", "none"
+            error_text = f"Sorry, all AI providers failed:\n{e}"
+            if stream is not None:
+                await stream.push(f"\n\n{error_text}" if stream.content else error_text)
+            return error_text, "none"
+
+    async def ask_once(self, message: str, system_prompt: str, request_type: str, channel_id: int | None = None, user_name: str | None = None, stream: StreamingReply | None = None) -> tuple[str, str]:
+        """Send a single stateless request to AI and return (response, provider_name).
+
+        Unlike ask_ai, no conversation history is read or written: the provider
+        sees only the system prompt and this message. channel_id is used only for
+        the channel's provider override. With AI_AUDIT_LOG on, one row per call
+        (no message content) is written to ai_audit_log.
+        """
+        provider_override = await database.get_channel_provider(str(channel_id)) if channel_id else None
+        messages = [{"role": "user", "content": message}]
+
+        started = time.monotonic()
+        try:
+            if stream is not None:
+                provider_name = "none"
+                async for delta, provider_name in providers.chat_stream(messages, system_prompt, primary_provider=provider_override, request_type=request_type):
+                    await stream.push(delta)
+                response = stream.content
+            else:
+                response, provider_name = await providers.chat(messages, system_prompt, primary_provider=provider_override, request_type=request_type)
+        except RuntimeError as e:
+            response, provider_name = f"Sorry, all AI providers failed:\n{e}", "none"
+            if stream is not None:
+                await stream.push(f"\n\n{response}" if stream.content else response)
+
+        if config.AI_AUDIT_LOG:
+            try:
+                await database.add_audit_log(
+                    request_type=request_type,
+                    channel_id=str(channel_id) if channel_id else None,
+                    user_name=user_name,
+                    provider=provider_name,
+                    input_tokens=count_tokens(system_prompt) + count_tokens(message),
+                    output_tokens=count_tokens(response),
+                    latency_ms=int((time.monotonic() - started) * 1000),
+                )
+            except Exception as e:
+                print(f"Failed to write AI audit log: {e}")
+        return response, provider_name
 
     async def setup_hook(self):
+        await tokens.load_encoding()
         # Load cogs here
         await self.load_extension("cogs.general")
         await self.load_extension("cogs.summarize")
@@ -56,6 +132,13 @@ class SparkSageBot(commands.Bot):
         await self.load_extension("cogs.translate")
         await self.load_extension("cogs.channel_prompts")
         await self.load_extension("cogs.channel_providers")
+        await self.load_extension("cogs.retention")
+
+    async def close(self):
+        # Cogs unload first (the moderation workers may still log), then
+        # commit whatever is left in the write-behind buffer
+        await super().close()
+        await database.close_db()
 
 
 bot = SparkSageBot(command_prefix=config.BOT_PREFIX, intents=intents)
@@ -82,6 +165,7 @@ async def on_ready():
     # Initialize database when bot is ready
     await database.init_db()
     await database.sync_env_to_db()
+    await providers.warm_up()
 
     available = providers.get_available_providers()
     primary = config.AI_PROVIDER
@@ -103,9 +187,10 @@ async def on_message(message: discord.Message):
     if message.author == bot.user:
         return
 
+    # Moderation runs in background workers; don't hold up replies for it
     moderation_cog = bot.get_cog("Moderation")
     if moderation_cog:
-        await moderation_cog.check_message_for_moderation(message)
+        moderation_cog.enqueue_message(message)
     
     # Respond when mentioned
     if bot.user in message.mentions:
@@ -113,14 +198,22 @@ async def on_message(message: discord.Message):
         if not clean_content:
             clean_content = "Hello!"
 
-        async with message.channel.typing():
-            response, provider_name = await bot.ask_ai( # Use bot.ask_ai
-                message.channel.id, message.author.display_name, clean_content
-            )
-
-        # Split long responses (Discord 2000 char limit)
-        for i in range(0, len(response), 2000):
-            await message.reply(response[i : i + 2000])
+        if config.STREAM_RESPONSES:
+            reply = StreamingReply(message.reply)
+            async with message.channel.typing():
+                await bot.ask_ai(
+                    message.channel.id, message.author.display_name, clean_content, stream=reply
+                )
+            await reply.finish()
+        else:
+            async with message.channel.typing():
+                response, provider_name = await bot.ask_ai( # Use bot.ask_ai
+                    message.channel.id, message.author.display_name, clean_content
+                )
+
+            # Split long responses (Discord 2000 char limit)
+            for i in range(0, len(response), 2000):
+                await message.reply(response[i : i + 2000])
 
     await bot.process_commands(message)
 
@@ -3,8 +3,8 @@ from discord.ext import commands
 from discord import app_commands
 import discord
 import config
-import providers # This import is not strictly needed here as ask_ai uses providers internally, but good for clarity
 from utils.checks import has_permissions
+from utils.streaming import StreamingReply
 
 class CodeReview(commands.Cog):
     def __init__(self, bot):
@@ -28,17 +28,27 @@ class CodeReview(commands.Cog):
         Respond with markdown formatting using code blocks."""
 
         user_message = f"""Please review the following code snippet. The language is {language or 'auto-detected'}:
-```{"\n" + language if language else ""}{code}
+```{language or ''}
+{code}
 ```"""
 
-        response, provider_name = await self.bot.ask_ai(
-            interaction.channel_id,
-            interaction.user.display_name,
+        # Reviews are long; stream them so the reply doesn't look dead while generating
+        reply = StreamingReply(interaction.followup.send) if config.STREAM_RESPONSES else None
+        # Reviews are self-contained, so skip the channel history entirely
+        response, provider_name = await self.bot.ask_once(
             user_message,
             system_prompt=system_prompt, # Pass specialized system prompt
-            message_type="code_review" # Tag this as a code review
+            request_type="code_review",
+            channel_id=interaction.channel_id,
+            user_name=interaction.user.display_name,
+            stream=reply,
         )
-        await interaction.followup.send(response)
+        if reply is not None:
+            await reply.finish()
+            return
+
+        for i in range(0, len(response), 2000):
+            await interaction.followup.send(response[i : i + 2000])
 
 async def setup(bot):
     await bot.add_cog(CodeReview(bot))
\ No newline at end of file
@@ -6,6 +6,7 @@ import config
 import providers
 import db as database
 from utils.checks import has_permissions
+from utils.streaming import StreamingReply
 
 class General(commands.Cog):
     def __init__(self, bot):
@@ -16,6 +17,15 @@ class General(commands.Cog):
     @has_permissions()
     async def ask(self, interaction: discord.Interaction, question: str):
         await interaction.response.defer()
+        if config.STREAM_RESPONSES:
+            reply = StreamingReply(interaction.followup.send)
+            response, provider_name = await self.bot.ask_ai(
+                interaction.channel_id, interaction.user.display_name, question, stream=reply
+            )
+            provider_label = config.PROVIDERS.get(provider_name, {}).get("name", provider_name)
+            await reply.finish(f"\n-# Powered by {provider_label}")
+            return
+
         response, provider_name = await self.bot.ask_ai(
             interaction.channel_id, interaction.user.display_name, question
         )
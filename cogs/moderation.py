@@ -1,51 +1,73 @@
 import discord
 from discord.ext import commands
+from discord import app_commands
 import json
+import re
 import config
 import db as database
 import datetime
+from utils import moderation
+from utils.prefilter import prefilter
+from utils.singleflight import make_key as make_flight_key, singleflight
 
 class Moderation(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        moderation.batcher.classify = self.classify_batch
 
-    async def check_message_for_moderation(self, message: discord.Message):
+    async def cog_load(self):
+        moderation.queue.start(
+            self.check_message_for_moderation,
+            local_handler=lambda message: self.check_message_for_moderation(message, local_only=True),
+        )
+
+    async def cog_unload(self):
+        await moderation.queue.stop()
+
+    def enqueue_message(self, message: discord.Message):
+        """Hand a message to the background moderation workers without waiting."""
+        if not config.MODERATION_ENABLED or message.author.bot:
+            return
+
+        # On overflow the queue may run the local pre-filter alone; see ModerationQueue
+        moderation.queue.offer(message)
+
+    blocklist_group = app_commands.Group(name="blocklist", description="Manage this server's moderation blocklist")
+
+    async def check_message_for_moderation(self, message: discord.Message, local_only: bool = False):
         if not config.MODERATION_ENABLED:
             return
 
         if message.author.bot:
             return
 
-        # Prepare the moderation prompt
-        moderation_prompt = (
-            "Rate the following message for toxicity, spam, and rule violations. "
-            "Respond with JSON: {\"flagged\": bool, \"reason\": \"str\", \"severity\": \"low\"|\"medium\"|\"high\"}\n\n"
-            f"Message: \"{message.content}\""
-        )
-
         try:
-            # Call AI for moderation review
-            # We use a placeholder channel ID and bot's own name for logging purposes,
-            # as this isn't directly tied to a user conversation history.
-            ai_response, _ = await self.bot.ask_ai(
-                channel_id=0,  # A dummy channel ID for moderation logs
-                user_name="ModerationSystem",
-                message=moderation_prompt,
-                system_prompt="You are a moderation AI. Analyze messages for problematic content and respond only with JSON.",
-                message_type="moderation_check"
+            # Local first pass: clearly clean messages stop here, clearly bad ones
+            # are flagged without an AI call; only the ambiguous band goes on.
+            local = await prefilter.check(
+                message.content,
+                guild_id=str(message.guild.id) if message.guild else None,
+                mentions=len(message.mentions) + len(message.role_mentions),
+                mention_everyone=message.mention_everyone,
             )
-            
-            # Preprocess AI response to remove markdown code blocks if present
-            if ai_response.startswith("```json") and ai_response.endswith("```"):
-                clean_response = ai_response[7:-3].strip() # Remove ```json\n and \n```
+            if local.decision == "clean" or (local_only and local.decision == "escalate"):
+                return
+            if local.decision == "flag":
+                moderation_result = {
+                    "flagged": True,
+                    "reason": "Local filter: " + ", ".join(local.reasons),
+                    "severity": "high" if local.score >= 0.95 else "medium",
+                }
             else:
-                clean_response = ai_response.strip()
+                moderation_result = await self.classify_message(message.content)
+            if moderation_result is None:
+                print(f"Moderation AI returned no verdict for message {message.id}")
+                return
 
-            # Attempt to parse the JSON response
-            moderation_result = json.loads(clean_response)
             flagged = moderation_result.get("flagged", False)
-            reason = moderation_result.get("reason", "No reason provided.")
-            severity = moderation_result.get("severity", "low")
+            # The model may send explicit nulls; moderation_logs requires both
+            reason = moderation_result.get("reason") or "No reason provided."
+            severity = moderation_result.get("severity") or "low"
 
             if flagged:
                 await self.flag_message_for_review(message, reason, severity)
@@ -59,11 +81,41 @@ class Moderation(commands.Cog):
                     severity=severity
                 )
 
-        except json.JSONDecodeError:
-            print(f"Moderation AI returned invalid JSON: {ai_response}")
+        except (json.JSONDecodeError, ValueError) as e:
+            print(f"Moderation AI returned invalid JSON: {e}")
         except Exception as e:
             print(f"Error during moderation check: {e}")
 
+    async def classify_message(self, content: str) -> dict | None:
+        """Get the AI verdict for a message, reusing it for repeats of the same content."""
+        key = moderation.content_key(content)
+        verdict = moderation.verdicts.get(key)
+        if verdict is not None:
+            return verdict
+
+        async def classify():
+            # Messages are classified in micro-batches; see utils/moderation.py
+            result = await moderation.batcher.submit(content)
+            if result is not None:
+                moderation.verdicts.set(key, result)
+            return result
+
+        # Identical messages arriving together (e.g. a raid) share one classification
+        return await singleflight.do(make_flight_key("moderation", key), classify)
+
+    async def classify_batch(self, contents: list[str]) -> list[dict | None]:
+        """Classify a batch of message contents with one AI call."""
+        # Stateless: each batch stands alone, with no conversation history
+        ai_response, provider_name = await self.bot.ask_once(
+            message=moderation.build_prompt(contents),
+            system_prompt=moderation.SYSTEM_PROMPT,
+            request_type="moderation_check",
+            user_name="ModerationSystem",
+        )
+        if provider_name == "none":
+            raise RuntimeError(ai_response)
+        return moderation.parse_verdicts(ai_response, len(contents))
+
     async def flag_message_for_review(self, message: discord.Message, reason: str, severity: str):
         mod_log_channel_id = config.MOD_LOG_CHANNEL_ID
         if not mod_log_channel_id:
@@ -93,6 +145,63 @@ class Moderation(commands.Cog):
         
         await mod_log_channel.send(embed=embed)
 
+    @blocklist_group.command(name="add", description="Flag messages containing a term without asking the AI")
+    @app_commands.describe(
+        term="Word or phrase to block (matched case-insensitively).",
+        regex="Treat the term as a regular expression."
+    )
+    @app_commands.default_permissions(manage_guild=True)
+    async def blocklist_add(self, interaction: discord.Interaction, term: str, regex: bool = False):
+        if not interaction.guild:
+            await interaction.response.send_message("This command can only be used in a server.", ephemeral=True)
+            return
+
+        if regex:
+            try:
+                re.compile(term)
+            except re.error as e:
+                await interaction.response.send_message(f"Invalid regular expression: {e}", ephemeral=True)
+                return
+
+        guild_id = str(interaction.guild.id)
+        added = await database.add_blocklist_term(guild_id, term, regex, interaction.user.name)
+        prefilter.invalidate(guild_id)
+        if added:
+            await interaction.response.send_message(f"Added `{term}` to the blocklist.", ephemeral=True)
+        else:
+            await interaction.response.send_message(f"`{term}` is already on the blocklist.", ephemeral=True)
+
+    @blocklist_group.command(name="remove", description="Remove a term from the moderation blocklist")
+    @app_commands.describe(term="The exact term to remove.")
+    @app_commands.default_permissions(manage_guild=True)
+    async def blocklist_remove(self, interaction: discord.Interaction, term: str):
+        if not interaction.guild:
+            await interaction.response.send_message("This command can only be used in a server.", ephemeral=True)
+            return
+
+        guild_id = str(interaction.guild.id)
+        removed = await database.remove_blocklist_term(guild_id, term)
+        prefilter.invalidate(guild_id)
+        if removed:
+            await interaction.response.send_message(f"Removed `{term}` from the blocklist.", ephemeral=True)
+        else:
+            await interaction.response.send_message(f"`{term}` is not on the blocklist.", ephemeral=True)
+
+    @blocklist_group.command(name="list", description="Show this server's moderation blocklist")
+    @app_commands.default_permissions(manage_guild=True)
+    async def blocklist_list(self, interaction: discord.Interaction):
+        if not interaction.guild:
+            await interaction.response.send_message("This command can only be used in a server.", ephemeral=True)
+            return
+
+        entries = await database.get_blocklist(str(interaction.guild.id))
+        if not entries:
+            await interaction.response.send_message("The blocklist is empty.", ephemeral=True)
+            return
+
+        lines = [f"`{e['term']}`" + (" (regex)" if e["is_regex"] else "") for e in entries]
+        await interaction.response.send_message("\n".join(lines)[:2000], ephemeral=True)
+
 
 async def setup(bot):
     await bot.add_cog(Moderation(bot))
\ No newline at end of file
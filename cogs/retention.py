@@ -0,0 +1,126 @@
+import asyncio
+from typing import Literal
+
+import discord
+from discord import app_commands
+from discord.ext import commands, tasks
+
+import config
+import db as database
+
+
+class Retention(commands.Cog):
+    """Moves conversation history past its retention limits into the archive table.
+
+    Limits come from the channel's policy, else its server's policy, else
+    RETENTION_DAYS / RETENTION_MAX_MESSAGES. Archived history can still be
+    paged from the dashboard.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.archive_old_messages.change_interval(minutes=max(1, config.RETENTION_INTERVAL_MINUTES))
+        self.archive_old_messages.start()
+
+    def cog_unload(self):
+        self.archive_old_messages.cancel()
+
+    def _guild_id(self, channel_id: str) -> str | None:
+        channel = self.bot.get_channel(int(channel_id)) if channel_id.isdigit() else None
+        guild = getattr(channel, "guild", None)
+        return str(guild.id) if guild else None
+
+    @tasks.loop(minutes=60)
+    async def archive_old_messages(self):
+        policies = {(p["scope"], p["target_id"]): p for p in await database.get_retention_policies()}
+        default = {"max_age_days": config.RETENTION_DAYS, "max_messages": config.RETENTION_MAX_MESSAGES}
+        archived = 0
+
+        for channel in await database.list_channels():
+            channel_id = channel["channel_id"]
+            policy = (
+                policies.get(("channel", channel_id))
+                or policies.get(("guild", self._guild_id(channel_id)))
+                or default
+            )
+            if policy["max_age_days"] <= 0 and policy["max_messages"] <= 0:
+                continue
+
+            try:
+                cutoff = await database.get_archive_cutoff_id(channel_id, policy["max_age_days"], policy["max_messages"])
+                if cutoff is None:
+                    continue
+                # Small batches, each its own short transaction, with a pause in
+                # between so bot and dashboard writes aren't held up
+                while moved := await database.archive_messages(channel_id, cutoff, config.RETENTION_BATCH_SIZE):
+                    archived += moved
+                    await asyncio.sleep(config.RETENTION_BATCH_PAUSE_MS / 1000)
+            except Exception as e:
+                print(f"Retention: failed to archive channel {channel_id}: {e}")
+
+        if archived:
+            print(f"Retention: archived {archived} message(s)")
+
+    @archive_old_messages.before_loop
+    async def before_archive(self):
+        await self.bot.wait_until_ready()
+
+    retention_group = app_commands.Group(name="retention", description="Manage how long conversation history is kept")
+
+    @retention_group.command(name="set", description="Archive history older than N days or beyond N messages")
+    @app_commands.describe(
+        scope="Apply to this channel or the whole server.",
+        days="Archive messages older than this many days (0 = no age limit).",
+        messages="Keep at most this many recent messages per channel (0 = no limit)."
+    )
+    @app_commands.default_permissions(manage_guild=True)
+    async def retention_set(self, interaction: discord.Interaction, scope: Literal["channel", "server"], days: app_commands.Range[int, 0], messages: app_commands.Range[int, 0]):
+        if not interaction.guild:
+            await interaction.response.send_message("This command can only be used in a server.", ephemeral=True)
+            return
+
+        target_id = str(interaction.channel_id) if scope == "channel" else str(interaction.guild.id)
+        await database.set_retention_policy("channel" if scope == "channel" else "guild", target_id, days, messages)
+        await interaction.response.send_message(
+            f"Retention for this {scope}: {days or 'no'} day limit, {messages or 'no'} message limit.",
+            ephemeral=True
+        )
+
+    @retention_group.command(name="clear", description="Remove a retention policy so the default applies")
+    @app_commands.describe(scope="Remove the policy for this channel or the whole server.")
+    @app_commands.default_permissions(manage_guild=True)
+    async def retention_clear(self, interaction: discord.Interaction, scope: Literal["channel", "server"]):
+        if not interaction.guild:
+            await interaction.response.send_message("This command can only be used in a server.", ephemeral=True)
+            return
+
+        target_id = str(interaction.channel_id) if scope == "channel" else str(interaction.guild.id)
+        removed = await database.delete_retention_policy("channel" if scope == "channel" else "guild", target_id)
+        if removed:
+            await interaction.response.send_message(f"Retention policy for this {scope} removed.", ephemeral=True)
+        else:
+            await interaction.response.send_message(f"This {scope} has no retention policy.", ephemeral=True)
+
+    @retention_group.command(name="show", description="Show the retention policy that applies to this channel")
+    @app_commands.default_permissions(manage_guild=True)
+    async def retention_show(self, interaction: discord.Interaction):
+        if not interaction.guild:
+            await interaction.response.send_message("This command can only be used in a server.", ephemeral=True)
+            return
+
+        policies = {(p["scope"], p["target_id"]): p for p in await database.get_retention_policies()}
+        policy, source = policies.get(("channel", str(interaction.channel_id))), "channel"
+        if policy is None:
+            policy, source = policies.get(("guild", str(interaction.guild.id))), "server"
+        if policy is None:
+            policy, source = {"max_age_days": config.RETENTION_DAYS, "max_messages": config.RETENTION_MAX_MESSAGES}, "default"
+
+        await interaction.response.send_message(
+            f"Retention ({source} policy): {policy['max_age_days'] or 'no'} day limit, "
+            f"{policy['max_messages'] or 'no'} message limit.",
+            ephemeral=True
+        )
+
+
+async def setup(bot):
+    await bot.add_cog(Retention(bot))
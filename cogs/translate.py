@@ -19,12 +19,12 @@ Text to translate: "{text}"
 """
 
         try:
-            translated_text, _ = await self.bot.ask_ai(
-                channel_id=interaction.channel_id,
-                user_name=interaction.user.display_name,
+            translated_text, _ = await self.bot.ask_once(
                 message=translation_prompt,
                 system_prompt="You are a helpful translation assistant. Provide only the translation.",
-                message_type="translation"
+                request_type="translation",
+                channel_id=interaction.channel_id,
+                user_name=interaction.user.display_name,
             )
             await interaction.followup.send(f"""**Original ({text}) translated to {target_language}:**
 {translated_text}""")
@@ -18,6 +18,11 @@ export default function ConversationDetailPage() {
   const { data: session } = useSession();
   const [messages, setMessages] = useState<MessageItem[]>([]);
   const [loading, setLoading] = useState(true);
+  // Cursor for older live messages; null once the start of the live table is reached
+  const [olderCursor, setOlderCursor] = useState<number | null>(null);
+  // Older history moved out by retention; undefined = not requested yet, null = no more
+  const [archiveCursor, setArchiveCursor] = useState<number | null | undefined>(undefined);
+  const [loadingOlder, setLoadingOlder] = useState(false);
 
   const token = (session as { accessToken?: string })?.accessToken;
 
@@ -25,11 +30,41 @@ export default function ConversationDetailPage() {
     if (!token || !channelId) return;
     api
       .getConversation(token, channelId)
-      .then((result) => setMessages(result.messages))
+      .then((result) => {
+        setMessages(result.messages);
+        setOlderCursor(result.next_before_id);
+      })
       .catch(() => toast.error("Failed to load messages"))
       .finally(() => setLoading(false));
   }, [token, channelId]);
 
+  function loadOlder() {
+    if (!token) return;
+    setLoadingOlder(true);
+    if (olderCursor !== null) {
+      api
+        .getConversation(token, channelId, olderCursor)
+        .then((result) => {
+          setMessages((current) => [...result.messages, ...current]);
+          setOlderCursor(result.next_before_id);
+        })
+        .catch(() => toast.error("Failed to load older messages"))
+        .finally(() => setLoadingOlder(false));
+      return;
+    }
+
+    const beforeId = archiveCursor ?? messages.find((m) => m.id !== undefined)?.id;
+    api
+      .getArchivedConversation(token, channelId, beforeId)
+      .then((result) => {
+        setMessages((current) => [...result.messages, ...current]);
+        setArchiveCursor(result.next_before_id);
+        if (result.messages.length === 0) toast.info("No archived messages");
+      })
+      .catch(() => toast.error("Failed to load archived messages"))
+      .finally(() => setLoadingOlder(false));
+  }
+
   return (
     <div className="space-y-6">
       <div className="flex items-center gap-3">
@@ -53,7 +88,17 @@ export default function ConversationDetailPage() {
               <Loader2 className="h-6 w-6 animate-spin text-muted-foreground" />
             </div>
           ) : (
-            <MessageList messages={messages} />
+            <>
+              {(olderCursor !== null || archiveCursor !== null) && (
+                <div className="mb-4 flex justify-center">
+                  <Button variant="outline" size="sm" onClick={loadOlder} disabled={loadingOlder}>
+                    {loadingOlder && <Loader2 className="mr-1 h-4 w-4 animate-spin" />}
+                    {olderCursor !== null ? "Load older messages" : "Load archived history"}
+                  </Button>
+                </div>
+              )}
+              <MessageList messages={messages} />
+            </>
           )}
         </CardContent>
       </Card>
@@ -68,7 +68,8 @@ export default function ProvidersPage() {
               providers={data.providers}
             />
             <p className="mt-2 text-xs text-muted-foreground">
-              When the primary provider fails, requests automatically fall through to the next available provider.
+              Live routing order. Providers are reordered by recent latency and error rate; a provider whose
+              circuit breaker has tripped is skipped until its cooldown expires.
             </p>
           </CardContent>
         </Card>
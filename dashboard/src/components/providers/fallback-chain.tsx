@@ -19,10 +19,21 @@ export function FallbackChain({ fallbackOrder, providers }: FallbackChainProps)
             <div className="flex items-center gap-1.5 rounded-lg border px-3 py-1.5">
               <div
                 className={`h-2 w-2 rounded-full ${
-                  prov?.configured ? "bg-green-500" : "bg-gray-300"
+                  !prov?.configured
+                    ? "bg-gray-300"
+                    : prov.health?.state === "open"
+                      ? "bg-red-500"
+                      : prov.health?.state === "half_open"
+                        ? "bg-yellow-500"
+                        : "bg-green-500"
                 }`}
               />
               <span className="text-sm">{prov?.display_name || name}</span>
+              {prov?.health?.p50_ms != null && (
+                <span className="text-xs text-muted-foreground">
+                  p50 {prov.health.p50_ms}ms · p95 {prov.health.p95_ms}ms
+                </span>
+              )}
               {prov?.is_primary && (
                 <Badge variant="secondary" className="ml-1 text-xs">
                   Primary
@@ -35,6 +35,19 @@ async function apiFetch<T>(path: string, options: FetchOptions = {}): Promise<T>
 }
 
 // Response types matching backend
+export interface ProviderHealth {
+  state: "closed" | "open" | "half_open";
+  success_rate: number | null;
+  requests: number;
+  p50_ms: number | null;
+  p95_ms: number | null;
+  recent_errors: number;
+  consecutive_failures: number;
+  cooldown_remaining_s: number | null;
+  score: number | null;
+  last_error: string | null;
+}
+
 export interface ProviderItem {
   name: string;
   display_name: string;
@@ -42,20 +55,25 @@ export interface ProviderItem {
   free: boolean;
   configured: boolean;
   is_primary: boolean;
+  health: ProviderHealth | null;
 }
 
 export interface ProvidersResponse {
   providers: ProviderItem[];
   fallback_order: string[];
+  configured_order: string[];
 }
 
 export interface ChannelItem {
   channel_id: string;
   message_count: number;
   last_active: string;
+  providers: Record<string, number>;
+  types: Record<string, number>;
 }
 
 export interface MessageItem {
+  id?: number;
   role: string;
   content: string;
   provider: string | null;
@@ -63,6 +81,19 @@ export interface MessageItem {
   created_at: string;
 }
 
+export interface SearchResultItem {
+  id: number;
+  channel_id: string;
+  guild_id: string | null;
+  role: string;
+  author_name: string | null;
+  provider: string | null;
+  type: string | null;
+  created_at: string;
+  snippet: string;
+  score: number;
+}
+
 export interface GuildItem {
   id: string;
   name: string;
@@ -171,9 +202,27 @@ export const api = {
   getConversations: (token: string) =>
     apiFetch<{ channels: ChannelItem[] }>("/api/conversations", { token }),
 
-  getConversation: (token: string, channelId: string) =>
-    apiFetch<{ channel_id: string; messages: MessageItem[] }>(
-      `/api/conversations/${channelId}`,
+  getConversation: (token: string, channelId: string, beforeId?: number) =>
+    apiFetch<{
+      channel_id: string;
+      messages: MessageItem[];
+      has_more: boolean;
+      next_before_id: number | null;
+      next_after_id: number | null;
+    }>(
+      `/api/conversations/${channelId}${beforeId !== undefined ? `?before_id=${beforeId}` : ""}`,
+      { token }
+    ),
+
+  searchConversations: (token: string, query: string, filters: Record<string, string> = {}, cursor?: string) =>
+    apiFetch<{ results: SearchResultItem[]; next_cursor: string | null }>(
+      `/api/conversations/search?${new URLSearchParams({ q: query, ...filters, ...(cursor ? { cursor } : {}) })}`,
+      { token }
+    ),
+
+  getArchivedConversation: (token: string, channelId: string, beforeId?: number) =>
+    apiFetch<{ channel_id: string; messages: MessageItem[]; next_before_id: number | null }>(
+      `/api/conversations/${channelId}/archive${beforeId !== undefined ? `?before_id=${beforeId}` : ""}`,
       { token }
     ),
 
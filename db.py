@@ -2,27 +2,166 @@ from __future__ import annotations
 
 import os
 import json
+import asyncio
+import logging
+import pathlib
+import sqlite3
+import time
+import zlib
+import threading
+import concurrent.futures
 import aiosqlite
+from collections.abc import AsyncIterator
+from itertools import groupby
+from storage import EXPORT_TABLES
+from utils.tokens import count_tokens
 
 DATABASE_PATH = os.getenv("DATABASE_PATH", "sparksage.db")
-
-_db: aiosqlite.Connection | None = None
+# A postgresql:// URL switches every storage helper to db_postgres (see the end of this file)
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+BACKEND = "postgres" if DATABASE_URL.startswith(("postgres://", "postgresql://")) else "sqlite"
+
+# Write-behind: buffered inserts are committed together once DB_WRITE_BATCH_SIZE
+# rows are waiting or DB_WRITE_FLUSH_MS after the first one, whichever is sooner
+WRITE_BATCH_SIZE = int(os.getenv("DB_WRITE_BATCH_SIZE", "100"))
+WRITE_FLUSH_MS = int(os.getenv("DB_WRITE_FLUSH_MS", "50"))
+# A failed flush is retried after WRITE_FLUSH_MS, doubling up to this cap
+WRITE_RETRY_MAX_MS = int(os.getenv("DB_WRITE_RETRY_MAX_MS", "30000"))
+
+# Connections are bound to the event loop that opened them: each loop (bot, API
+# thread, one-off asyncio.run calls) gets one writer, one connection reserved
+# for write-behind flushes, and up to DB_READERS read-only WAL readers, so
+# dashboard reads never queue behind bot writes.
+READER_COUNT = int(os.getenv("DB_READERS", "4"))
+BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+
+# Small, rarely changed settings tables are served from memory. Writes through
+# the helpers below update the cached copy for both loops immediately; the TTL
+# only bounds staleness from writes made by another process (0 disables caching).
+SETTINGS_CACHE_TTL_SECONDS = int(os.getenv("DB_SETTINGS_CACHE_TTL_SECONDS", "300"))
+
+# Imports commit every batch in its own short transaction and pause in
+# between, so bot writes never wait on an import for long
+IMPORT_PAUSE_MS = int(os.getenv("DB_IMPORT_PAUSE_MS", "5"))
+
+logger = logging.getLogger(__name__)
+
+
+class _Pool:
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.writer: aiosqlite.Connection | None = None
+        self.flusher: aiosqlite.Connection | None = None
+        self.readers: list[aiosqlite.Connection] = []
+        self.next_reader = 0
+
+
+_pools: dict[asyncio.AbstractEventLoop, _Pool] = {}
+_pools_lock = threading.Lock()
+
+# Shared by the bot and API event loops, so guarded by a thread lock
+_write_lock = threading.Lock()
+_write_buffer: list[tuple[str, tuple, str | None]] = []  # (sql, params, channel_id)
+_write_inflight: concurrent.futures.Future | None = None
+_write_inflight_channels: set[str] = set()
+_write_timer: asyncio.TimerHandle | None = None
+_write_timer_loop: asyncio.AbstractEventLoop | None = None
+_write_tasks: set[asyncio.Task] = set()
+_write_retry_ms = 0
+_write_stats = {"rows": 0, "flushes": 0, "errors": 0, "dropped": 0}
+
+# Errors that retrying a row can never fix (constraint violations, bad
+# parameters). Anything else, e.g. a locked or full database, is transient.
+_PERMANENT_WRITE_ERRORS = (sqlite3.IntegrityError, sqlite3.ProgrammingError, sqlite3.InterfaceError, sqlite3.DataError)
+
+_SETTINGS_QUERIES = {
+    "config": "SELECT key, value FROM config",
+    "channel_prompts": "SELECT channel_id, system_prompt FROM channel_prompts",
+    "channel_providers": "SELECT channel_id, provider_name FROM channel_providers",
+    "command_permissions": "SELECT command_name, guild_id, role_id FROM command_permissions",
+}
+_settings_lock = threading.Lock()
+_settings: dict[str, tuple[float, dict]] = {}  # table -> (loaded_at, data)
+_settings_generation = dict.fromkeys(_SETTINGS_QUERIES, 0)
+_settings_stats = {table: {"hits": 0, "misses": 0, "invalidations": 0} for table in _SETTINGS_QUERIES}
+
+
+def _pool() -> _Pool:
+    loop = asyncio.get_running_loop()
+    with _pools_lock:
+        for stale in [l for l in _pools if l.is_closed()]:
+            del _pools[stale]
+        if loop not in _pools:
+            _pools[loop] = _Pool()
+        return _pools[loop]
+
+
+async def _connect(read_only: bool = False) -> aiosqlite.Connection:
+    if read_only:
+        uri = pathlib.Path(DATABASE_PATH).resolve().as_uri() + "?mode=ro"
+        conn = await aiosqlite.connect(uri, uri=True)
+        await conn.execute("PRAGMA query_only=ON")
+    else:
+        conn = await aiosqlite.connect(DATABASE_PATH)
+        await conn.execute("PRAGMA journal_mode=WAL")
+        await conn.execute("PRAGMA foreign_keys=ON")
+    conn.row_factory = aiosqlite.Row
+    await conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    return conn
 
 
 async def get_db() -> aiosqlite.Connection:
-    """Return the shared database connection, creating it if needed."""
-    global _db
-    if _db is None:
-        _db = await aiosqlite.connect(DATABASE_PATH)
-        _db.row_factory = aiosqlite.Row
-        await _db.execute("PRAGMA journal_mode=WAL")
-        await _db.execute("PRAGMA foreign_keys=ON")
-    return _db
+    """Return this event loop's writer connection, creating it if needed."""
+    pool = _pool()
+    if pool.writer is None:
+        async with pool.lock:
+            if pool.writer is None:
+                pool.writer = await _connect()
+    return pool.writer
+
+
+async def _get_flush_db() -> aiosqlite.Connection:
+    """Return this event loop's write-behind connection, creating it if needed.
+
+    Only flush_writes() uses it, so no other helper's commit or rollback can
+    land in the middle of a group commit (and vice versa).
+    """
+    pool = _pool()
+    if pool.flusher is None:
+        # The writer creates the file and switches it to WAL first
+        await get_db()
+        async with pool.lock:
+            if pool.flusher is None:
+                pool.flusher = await _connect()
+    return pool.flusher
+
+
+async def get_read_db() -> aiosqlite.Connection:
+    """Return one of this event loop's read-only connections (round-robin, opened lazily).
+
+    Readers only see committed data. Falls back to the writer when DB_READERS is 0.
+    """
+    if READER_COUNT <= 0:
+        return await get_db()
+    pool = _pool()
+    if len(pool.readers) < READER_COUNT:
+        # The writer creates the file and switches it to WAL before any reader opens it
+        await get_db()
+        async with pool.lock:
+            if len(pool.readers) < READER_COUNT:
+                pool.readers.append(await _connect(read_only=True))
+                return pool.readers[-1]
+    pool.next_reader = (pool.next_reader + 1) % len(pool.readers)
+    return pool.readers[pool.next_reader]
 
 
 async def init_db():
     """Create tables if they don't exist."""
     db = await get_db()
+    with _settings_lock:
+        _settings.clear()
+    cursor = await db.execute("SELECT 1 FROM sqlite_master WHERE name = 'conversations_fts'")
+    had_search_index = await cursor.fetchone() is not None
     await db.executescript(
         """
         CREATE TABLE IF NOT EXISTS config (
@@ -38,9 +177,13 @@ async def init_db():
             content    TEXT    NOT NULL,
             provider   TEXT,
             type       TEXT,
+            token_count INTEGER,
             created_at TEXT    NOT NULL DEFAULT (datetime('now'))
         );
         CREATE INDEX IF NOT EXISTS idx_conv_channel ON conversations(channel_id);
+        -- idx_conv_channel is (channel_id, rowid), so it also serves ORDER BY id;
+        -- this one serves created_at ranges and is covering for list_channels
+        CREATE INDEX IF NOT EXISTS idx_conv_channel_created ON conversations(channel_id, created_at);
         
         -- Add 'author_name' column if it doesn't exist (for existing databases)
         PRAGMA table_info(conversations); -- Get table info to check for column existence
@@ -101,6 +244,144 @@ async def init_db():
             guild_id TEXT NOT NULL,
             provider_name TEXT NOT NULL
         );
+
+        CREATE TABLE IF NOT EXISTS response_cache (
+            key        TEXT PRIMARY KEY,  -- sha256 of provider, model, prompt, messages, max_tokens
+            provider   TEXT NOT NULL,
+            response   TEXT NOT NULL,
+            created_at TEXT NOT NULL DEFAULT (datetime('now')),
+            expires_at TEXT NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS moderation_blocklist (
+            id         INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id   TEXT NOT NULL,
+            term       TEXT NOT NULL,
+            is_regex   INTEGER NOT NULL DEFAULT 0,
+            created_by TEXT,
+            created_at TEXT NOT NULL DEFAULT (datetime('now')),
+            UNIQUE(guild_id, term)
+        );
+
+        CREATE TABLE IF NOT EXISTS ai_audit_log (
+            id            INTEGER PRIMARY KEY AUTOINCREMENT,
+            request_type  TEXT NOT NULL,
+            channel_id    TEXT,
+            user_name     TEXT,
+            provider      TEXT,
+            input_tokens  INTEGER,
+            output_tokens INTEGER,
+            latency_ms    INTEGER,
+            created_at    TEXT NOT NULL DEFAULT (datetime('now'))
+        );
+
+        CREATE TABLE IF NOT EXISTS retention_policies (
+            scope        TEXT NOT NULL,  -- 'guild' or 'channel'
+            target_id    TEXT NOT NULL,
+            max_age_days INTEGER NOT NULL DEFAULT 0,  -- 0 = no age limit
+            max_messages INTEGER NOT NULL DEFAULT 0,  -- 0 = no count limit
+            PRIMARY KEY (scope, target_id)
+        );
+
+        -- Conversation rows moved out of the hot table, zlib-compressed JSON per batch
+        CREATE TABLE IF NOT EXISTS conversation_archive (
+            id            INTEGER PRIMARY KEY AUTOINCREMENT,
+            channel_id    TEXT    NOT NULL,
+            first_id      INTEGER NOT NULL,
+            last_id       INTEGER NOT NULL,
+            first_at      TEXT    NOT NULL,
+            last_at       TEXT    NOT NULL,
+            message_count INTEGER NOT NULL,
+            data          BLOB    NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_archive_channel_last ON conversation_archive(channel_id, last_id);
+
+        -- Per-channel summaries kept current by triggers, so listing channels
+        -- doesn't aggregate the whole conversations table
+        CREATE TABLE IF NOT EXISTS channel_stats (
+            channel_id    TEXT PRIMARY KEY,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            last_active   TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_channel_stats_last_active ON channel_stats(last_active);
+
+        CREATE TABLE IF NOT EXISTS channel_stat_breakdown (
+            channel_id TEXT    NOT NULL,
+            kind       TEXT    NOT NULL,  -- 'provider' or 'type'
+            value      TEXT    NOT NULL,
+            count      INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (channel_id, kind, value)
+        );
+
+        CREATE TRIGGER IF NOT EXISTS trg_conversations_stats_insert AFTER INSERT ON conversations
+        BEGIN
+            INSERT INTO channel_stats (channel_id, message_count, last_active)
+            VALUES (NEW.channel_id, 1, NEW.created_at)
+            ON CONFLICT(channel_id) DO UPDATE SET
+                message_count = message_count + 1,
+                last_active = MAX(COALESCE(last_active, ''), excluded.last_active);
+            INSERT INTO channel_stat_breakdown (channel_id, kind, value, count)
+            SELECT NEW.channel_id, 'provider', NEW.provider, 1 WHERE NEW.provider IS NOT NULL
+            ON CONFLICT(channel_id, kind, value) DO UPDATE SET count = count + 1;
+            INSERT INTO channel_stat_breakdown (channel_id, kind, value, count)
+            SELECT NEW.channel_id, 'type', NEW.type, 1 WHERE NEW.type IS NOT NULL
+            ON CONFLICT(channel_id, kind, value) DO UPDATE SET count = count + 1;
+        END;
+
+        -- Deletes come from /clear and retention, which remove a channel's oldest
+        -- rows (or all of them), so last_active only needs resetting when empty
+        CREATE TRIGGER IF NOT EXISTS trg_conversations_stats_delete AFTER DELETE ON conversations
+        BEGIN
+            UPDATE channel_stats SET message_count = message_count - 1 WHERE channel_id = OLD.channel_id;
+            DELETE FROM channel_stats WHERE channel_id = OLD.channel_id AND message_count <= 0;
+            UPDATE channel_stat_breakdown SET count = count - 1
+            WHERE channel_id = OLD.channel_id AND kind = 'provider' AND value = OLD.provider;
+            UPDATE channel_stat_breakdown SET count = count - 1
+            WHERE channel_id = OLD.channel_id AND kind = 'type' AND value = OLD.type;
+            DELETE FROM channel_stat_breakdown WHERE channel_id = OLD.channel_id AND count <= 0;
+        END;
+
+        -- Full-text index over message text and author; external content, so
+        -- only the index is stored and rows are read back from conversations
+        CREATE VIRTUAL TABLE IF NOT EXISTS conversations_fts USING fts5(
+            content, author_name,
+            content='conversations', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        );
+
+        CREATE TRIGGER IF NOT EXISTS trg_conversations_fts_insert AFTER INSERT ON conversations
+        BEGIN
+            INSERT INTO conversations_fts (rowid, content, author_name) VALUES (NEW.id, NEW.content, NEW.author_name);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_conversations_fts_delete AFTER DELETE ON conversations
+        BEGIN
+            INSERT INTO conversations_fts (conversations_fts, rowid, content, author_name)
+            VALUES ('delete', OLD.id, OLD.content, OLD.author_name);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_conversations_fts_update AFTER UPDATE OF content, author_name ON conversations
+        BEGIN
+            INSERT INTO conversations_fts (conversations_fts, rowid, content, author_name)
+            VALUES ('delete', OLD.id, OLD.content, OLD.author_name);
+            INSERT INTO conversations_fts (rowid, content, author_name) VALUES (NEW.id, NEW.content, NEW.author_name);
+        END;
+
+        -- Which exported rows an import has already loaded, and their new ids
+        CREATE TABLE IF NOT EXISTS import_id_map (
+            source     TEXT    NOT NULL,  -- export_id from the export's header
+            table_name TEXT    NOT NULL,
+            old_id     INTEGER NOT NULL,
+            new_id     INTEGER NOT NULL,
+            PRIMARY KEY (source, table_name, old_id)
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_faqs_guild ON faqs(guild_id);
+        CREATE INDEX IF NOT EXISTS idx_cmd_perms_guild ON command_permissions(guild_id);
+        CREATE INDEX IF NOT EXISTS idx_modlogs_guild_created ON moderation_logs(guild_id, created_at);
+        CREATE INDEX IF NOT EXISTS idx_channel_prompts_guild ON channel_prompts(guild_id);
+        CREATE INDEX IF NOT EXISTS idx_channel_providers_guild ON channel_providers(guild_id);
+        CREATE INDEX IF NOT EXISTS idx_response_cache_expires ON response_cache(expires_at);
         """
     )
     cursor = await db.execute("PRAGMA table_info(conversations)")
@@ -109,8 +390,219 @@ async def init_db():
         await db.execute("ALTER TABLE conversations ADD COLUMN type TEXT")
     if "author_name" not in columns:
         await db.execute("ALTER TABLE conversations ADD COLUMN author_name TEXT")
+    if "token_count" not in columns:
+        await db.execute("ALTER TABLE conversations ADD COLUMN token_count INTEGER")
+    if "guild_id" not in columns:
+        # NULL for rows stored before this column existed
+        await db.execute("ALTER TABLE conversations ADD COLUMN guild_id TEXT")
+
+    # Databases from before channel_stats existed need a one-time backfill
+    cursor = await db.execute("SELECT EXISTS(SELECT 1 FROM conversations) AND NOT EXISTS(SELECT 1 FROM channel_stats)")
+    if (await cursor.fetchone())[0]:
+        await rebuild_channel_stats()
+    # ...and so do databases from before the search index existed
+    if not had_search_index:
+        await rebuild_search_index()
 
     await db.commit()
+    for table in _SETTINGS_QUERIES:
+        await _settings_table(table)
+
+
+# --- Write-behind helpers ---
+
+
+def _buffer_write(sql: str, params: tuple, channel_id: str | None = None):
+    """Queue a write for the next group commit instead of committing it now."""
+    global _write_timer, _write_timer_loop
+    with _write_lock:
+        _write_buffer.append((sql, params, channel_id))
+        full = len(_write_buffer) >= WRITE_BATCH_SIZE
+        if not full and _write_timer is None:
+            _write_timer_loop = asyncio.get_running_loop()
+            _write_timer = _write_timer_loop.call_later(WRITE_FLUSH_MS / 1000, _start_flush)
+    if full:
+        _start_flush()
+
+
+def _schedule_flush(delay_ms: int):
+    """(Re)arm the flush timer to fire after delay_ms on the running loop."""
+    global _write_timer, _write_timer_loop
+    with _write_lock:
+        if _write_timer is not None:
+            _write_timer.cancel()
+        _write_timer_loop = asyncio.get_running_loop()
+        _write_timer = _write_timer_loop.call_later(delay_ms / 1000, _start_flush)
+
+
+def _start_flush():
+    global _write_timer
+    with _write_lock:
+        if _write_timer is not None:
+            _write_timer.cancel()
+            _write_timer = None
+    task = asyncio.ensure_future(flush_writes())
+    _write_tasks.add(task)
+    task.add_done_callback(_write_tasks.discard)
+
+
+async def flush_writes():
+    """Commit every buffered write in one transaction.
+
+    If another flush is in progress (possibly on the other event loop), wait
+    for it first, so returning means everything buffered before the call is
+    committed. Rows that can never be written are logged and dropped; on any
+    other error the batch goes back in the buffer and a retry is scheduled
+    with exponential backoff.
+    """
+    global _write_inflight, _write_inflight_channels, _write_retry_ms
+    while True:
+        with _write_lock:
+            waiting = _write_inflight
+            if waiting is None:
+                if not _write_buffer:
+                    return
+                batch = _write_buffer[:]
+                _write_buffer.clear()
+                _write_inflight = concurrent.futures.Future()
+                _write_inflight_channels = {channel_id for _, _, channel_id in batch if channel_id}
+        if waiting is not None:
+            await asyncio.wrap_future(waiting)
+            continue
+
+        db = None
+        dropped = 0
+        try:
+            db = await _get_flush_db()
+            try:
+                i = 0
+                while i < len(batch):
+                    # Run consecutive writes of the same statement as one executemany
+                    j = i
+                    while j < len(batch) and batch[j][0] == batch[i][0]:
+                        j += 1
+                    await db.executemany(batch[i][0], [params for _, params, _ in batch[i:j]])
+                    i = j
+            except _PERMANENT_WRITE_ERRORS:
+                # One bad row fails its whole executemany: start over row by
+                # row, dropping only the rows that can never succeed
+                await db.rollback()
+                for sql, params, _ in batch:
+                    try:
+                        await db.execute(sql, params)
+                    except _PERMANENT_WRITE_ERRORS as e:
+                        dropped += 1
+                        logger.error("Write-behind dropped a row for %s: %s", sql.split("(")[0].strip(), e)
+            await db.commit()
+            _write_stats["rows"] += len(batch) - dropped
+            _write_stats["dropped"] += dropped
+            _write_stats["flushes"] += 1
+            _write_retry_ms = 0
+        except Exception as e:
+            _write_stats["errors"] += 1
+            if db is not None:
+                try:
+                    # Nothing from the failed batch may ride along with the next commit
+                    await db.rollback()
+                except Exception:
+                    pass
+            _write_retry_ms = min(max(_write_retry_ms * 2, WRITE_FLUSH_MS, 1), WRITE_RETRY_MAX_MS)
+            logger.warning("Write-behind flush of %d rows failed, retrying in %d ms: %s", len(batch), _write_retry_ms, e)
+            with _write_lock:
+                _write_buffer[:0] = batch
+            _schedule_flush(_write_retry_ms)
+        finally:
+            with _write_lock:
+                done, _write_inflight = _write_inflight, None
+                _write_inflight_channels = set()
+            done.set_result(None)
+        return
+
+
+async def _flush_channel_writes(channel_id: str):
+    """Flush first if writes for this channel are buffered or being committed."""
+    with _write_lock:
+        pending = channel_id in _write_inflight_channels or any(c == channel_id for _, _, c in _write_buffer)
+    if pending:
+        await flush_writes()
+
+
+def get_write_stats() -> dict:
+    with _write_lock:
+        pending = len(_write_buffer)
+    return {
+        **_write_stats,
+        "pending": pending,
+        "avg_batch": round(_write_stats["rows"] / _write_stats["flushes"], 1) if _write_stats["flushes"] else None,
+        "batch_size": WRITE_BATCH_SIZE,
+        "flush_ms": WRITE_FLUSH_MS,
+    }
+
+
+# --- Settings cache helpers ---
+
+
+async def _settings_table(table: str) -> dict:
+    """Return the cached contents of a settings table, (re)loading it when missing or expired.
+
+    command_permissions is keyed by (command_name, guild_id) with a list of
+    role IDs; the others map their key column to the value. Callers must not
+    mutate the result.
+    """
+    with _settings_lock:
+        entry = _settings.get(table)
+        if entry is not None and time.monotonic() - entry[0] < SETTINGS_CACHE_TTL_SECONDS:
+            _settings_stats[table]["hits"] += 1
+            return entry[1]
+        _settings_stats[table]["misses"] += 1
+        generation = _settings_generation[table]
+
+    db = await get_read_db()
+    cursor = await db.execute(_SETTINGS_QUERIES[table])
+    rows = await cursor.fetchall()
+    if table == "command_permissions":
+        data: dict = {}
+        for command_name, guild_id, role_id in rows:
+            data.setdefault((command_name, guild_id), []).append(role_id)
+    else:
+        data = {key: value for key, value in rows}
+
+    with _settings_lock:
+        # A write that landed while we were reading makes this copy stale
+        if _settings_generation[table] == generation:
+            _settings[table] = (time.monotonic(), data)
+    return data
+
+
+def _settings_changed(table: str, update=None):
+    """Apply a committed write to the cached copy of a settings table.
+
+    `update` edits a copy of the cached dict in place; without it the table
+    is dropped and reloaded on next use. The cache is shared by every thread,
+    so this takes effect for the bot and API loops alike.
+    """
+    with _settings_lock:
+        _settings_generation[table] += 1
+        _settings_stats[table]["invalidations"] += 1
+        entry = _settings.pop(table, None)
+        if entry is not None and update is not None:
+            data = dict(entry[1])
+            update(data)
+            _settings[table] = (entry[0], data)
+
+
+def get_settings_cache_stats() -> dict:
+    with _settings_lock:
+        stats = {}
+        for table, counts in _settings_stats.items():
+            lookups = counts["hits"] + counts["misses"]
+            entry = _settings.get(table)
+            stats[table] = {
+                **counts,
+                "hit_rate": round(counts["hits"] / lookups, 3) if lookups else None,
+                "items": len(entry[1]) if entry else None,
+            }
+    return {**stats, "ttl_seconds": SETTINGS_CACHE_TTL_SECONDS}
 
 
 # --- Config helpers ---
@@ -118,18 +610,12 @@ async def init_db():
 
 async def get_config(key: str, default: str | None = None) -> str | None:
     """Get a config value from the database."""
-    db = await get_db()
-    cursor = await db.execute("SELECT value FROM config WHERE key = ?", (key,))
-    row = await cursor.fetchone()
-    return row["value"] if row else default
+    return (await _settings_table("config")).get(key, default)
 
 
 async def get_all_config() -> dict[str, str]:
     """Return all config key-value pairs."""
-    db = await get_db()
-    cursor = await db.execute("SELECT key, value FROM config")
-    rows = await cursor.fetchall()
-    return {row["key"]: row["value"] for row in rows}
+    return dict(await _settings_table("config"))
 
 
 async def set_config(key: str, value: str):
@@ -140,6 +626,7 @@ async def set_config(key: str, value: str):
         (key, value),
     )
     await db.commit()
+    _settings_changed("config", lambda data: data.update({key: value}))
 
 
 async def set_config_bulk(data: dict[str, str]):
@@ -150,6 +637,7 @@ async def set_config_bulk(data: dict[str, str]):
         list(data.items()),
     )
     await db.commit()
+    _settings_changed("config", lambda cached: cached.update(data))
 
 
 async def sync_env_to_db():
@@ -181,6 +669,7 @@ async def sync_env_to_db():
             (key, value),
         )
     await db.commit()
+    _settings_changed("config")
 
 
 async def sync_db_to_env():
@@ -197,30 +686,62 @@ async def sync_db_to_env():
 # --- Conversation helpers ---
 
 
-async def add_message(channel_id: str, role: str, author_name: str | None, content: str, provider: str | None = None, type: str | None = None):
-    """Add a message to conversation history."""
-    db = await get_db()
-    await db.execute(
-        "INSERT INTO conversations (channel_id, role, author_name, content, provider, type) VALUES (?, ?, ?, ?, ?, ?)",
-        (channel_id, role, author_name, content, provider, type),
+async def add_message(channel_id: str, role: str, author_name: str | None, content: str, provider: str | None = None, type: str | None = None, guild_id: str | None = None):
+    """Add a message to conversation history (committed by the next write-behind flush)."""
+    _buffer_write(
+        "INSERT INTO conversations (channel_id, guild_id, role, author_name, content, provider, type, token_count) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (channel_id, guild_id, role, author_name, content, provider, type, count_tokens(content)),
+        channel_id,
     )
-    await db.commit()
 
 
-async def get_messages(channel_id: str, limit: int = 20) -> list[dict]:
-    """Get recent messages for a channel."""
-    db = await get_db()
+async def get_messages(channel_id: str, limit: int = 20, before_id: int | None = None, after_id: int | None = None) -> list[dict]:
+    """Get a page of a channel's messages, oldest first.
+
+    Keyset pagination on (channel_id, id): by default the newest `limit`
+    messages (older than before_id, if given). With only after_id, the
+    `limit` messages directly after it instead.
+    """
+    await _flush_channel_writes(channel_id)
+    db = await get_read_db()
+    newest_first = after_id is None or before_id is not None
     cursor = await db.execute(
-        "SELECT role, content, provider, created_at FROM conversations WHERE channel_id = ? ORDER BY id DESC LIMIT ?",
-        (channel_id, limit),
+        "SELECT id, role, author_name, content, provider, type, token_count, created_at FROM conversations "
+        "WHERE channel_id = ? AND id > ? AND id < ? "
+        f"ORDER BY id {'DESC' if newest_first else 'ASC'} LIMIT ?",
+        (channel_id, after_id if after_id is not None else -1, before_id if before_id is not None else 2**63 - 1, limit),
     )
-    rows = await cursor.fetchall()
-    return [dict(row) for row in reversed(rows)]
+    rows = [dict(row) for row in await cursor.fetchall()]
+    return rows[::-1] if newest_first else rows
+
+
+async def iter_messages(channel_id: str, after_id: int = 0, batch_size: int = 1000) -> AsyncIterator[dict]:
+    """Yield every message in a channel after after_id, oldest first, one keyset page at a time."""
+    while True:
+        page = await get_messages(channel_id, limit=batch_size, after_id=after_id)
+        for message in page:
+            yield message
+        if len(page) < batch_size:
+            return
+        after_id = page[-1]["id"]
+
+
+async def set_token_counts(counts: list[tuple[int, int]]):
+    """Cache token counts for existing conversation rows, as (id, token_count) pairs."""
+    if not counts:
+        return
+    db = await get_db()
+    await db.executemany(
+        "UPDATE conversations SET token_count = ? WHERE id = ?",
+        [(count, message_id) for message_id, count in counts],
+    )
+    await db.commit()
 
 
 async def get_messages_since(channel_id: str, since_datetime: datetime.datetime) -> list[dict]:
     """Get messages for a channel since a specific datetime."""
-    db = await get_db()
+    await _flush_channel_writes(channel_id)
+    db = await get_read_db()
     cursor = await db.execute(
         "SELECT role, author_name, content, provider, created_at FROM conversations WHERE channel_id = ? AND created_at >= ? ORDER BY created_at ASC",
         (channel_id, since_datetime.isoformat()),
@@ -231,25 +752,136 @@ async def get_messages_since(channel_id: str, since_datetime: datetime.datetime)
 
 
 async def clear_messages(channel_id: str):
-    """Delete all messages for a channel."""
+    """Delete all messages for a channel, including archived ones."""
+    await _flush_channel_writes(channel_id)
     db = await get_db()
     await db.execute("DELETE FROM conversations WHERE channel_id = ?", (channel_id,))
+    await db.execute("DELETE FROM conversation_archive WHERE channel_id = ?", (channel_id,))
     await db.commit()
 
 
 async def list_channels() -> list[dict]:
-    """List all channels with message counts."""
+    """List all channels with message counts and per-provider / per-type breakdowns."""
+    await flush_writes()
+    db = await get_read_db()
+    cursor = await db.execute(
+        "SELECT channel_id, message_count, last_active FROM channel_stats ORDER BY last_active DESC"
+    )
+    channels = {row["channel_id"]: {**dict(row), "providers": {}, "types": {}} for row in await cursor.fetchall()}
+    cursor = await db.execute("SELECT channel_id, kind, value, count FROM channel_stat_breakdown")
+    for row in await cursor.fetchall():
+        channel = channels.get(row["channel_id"])
+        if channel is not None:
+            channel["providers" if row["kind"] == "provider" else "types"][row["value"]] = row["count"]
+    return list(channels.values())
+
+
+async def rebuild_channel_stats() -> int:
+    """Recompute channel_stats and channel_stat_breakdown from conversations. Returns the channel count."""
     db = await get_db()
+    await db.execute("DELETE FROM channel_stats")
+    await db.execute("DELETE FROM channel_stat_breakdown")
+    await db.execute(
+        "INSERT INTO channel_stats (channel_id, message_count, last_active) "
+        "SELECT channel_id, COUNT(*), MAX(created_at) FROM conversations GROUP BY channel_id"
+    )
+    for kind in ("provider", "type"):
+        await db.execute(
+            f"INSERT INTO channel_stat_breakdown (channel_id, kind, value, count) "
+            f"SELECT channel_id, '{kind}', {kind}, COUNT(*) FROM conversations "
+            f"GROUP BY channel_id, {kind} HAVING {kind} IS NOT NULL"
+        )
+    await db.commit()
+    cursor = await db.execute("SELECT COUNT(*) FROM channel_stats")
+    return (await cursor.fetchone())[0]
+
+
+# --- Search helpers ---
+
+
+def _match_expression(query: str) -> str:
+    """Turn free text into an FTS5 query: every word must match, a trailing * matches a prefix.
+
+    Words are quoted, so FTS5 operators and punctuation in user input are
+    searched for literally instead of raising syntax errors.
+    """
+    terms = []
+    for word in query.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*")
+        if word:
+            terms.append('"' + word.replace('"', '""') + '"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+
+async def search_messages(
+    query: str,
+    channel_id: str | None = None,
+    guild_id: str | None = None,
+    provider: str | None = None,
+    type: str | None = None,
+    since: str | None = None,
+    until: str | None = None,
+    sort: str = "rank",
+    after_score: float | None = None,
+    after_id: int | None = None,
+    limit: int = 20,
+) -> list[dict]:
+    """Full-text search over conversation history (archived messages are not indexed).
+
+    sort="rank" orders by bm25 relevance, best first, then newest; pass the
+    last row's score and id as after_score / after_id for the next page.
+    sort="recent" orders newest first and only needs after_id; it stops after
+    `limit` matches instead of ranking all of them, so it stays cheap for
+    very common terms. since / until bound created_at ("YYYY-MM-DD HH:MM:SS").
+    """
+    expression = _match_expression(query)
+    if not expression:
+        return []
+    await flush_writes()
+
+    where = ["conversations_fts MATCH ?"]
+    params: list = [expression]
+    for column, value in (("channel_id", channel_id), ("guild_id", guild_id), ("provider", provider), ("type", type)):
+        if value is not None:
+            where.append(f"c.{column} = ?")
+            params.append(value)
+    if since is not None:
+        where.append("c.created_at >= ?")
+        params.append(since)
+    if until is not None:
+        where.append("c.created_at < ?")
+        params.append(until)
+
+    if sort == "recent":
+        if after_id is not None:
+            where.append("conversations_fts.rowid < ?")
+            params.append(after_id)
+        order = "conversations_fts.rowid DESC"
+    else:
+        if after_score is not None and after_id is not None:
+            where.append(
+                "(bm25(conversations_fts) > ? OR (bm25(conversations_fts) = ? AND conversations_fts.rowid < ?))"
+            )
+            params += [after_score, after_score, after_id]
+        order = "score, conversations_fts.rowid DESC"
+
+    db = await get_read_db()
     cursor = await db.execute(
-        """
-        SELECT channel_id, COUNT(*) as message_count, MAX(created_at) as last_active
-        FROM conversations
-        GROUP BY channel_id
-        ORDER BY last_active DESC
-        """
+        "SELECT c.id, c.channel_id, c.guild_id, c.role, c.author_name, c.provider, c.type, c.created_at, "
+        "snippet(conversations_fts, -1, '[', ']', '…', 16) AS snippet, bm25(conversations_fts) AS score "
+        "FROM conversations_fts JOIN conversations c ON c.id = conversations_fts.rowid "
+        f"WHERE {' AND '.join(where)} ORDER BY {order} LIMIT ?",
+        (*params, limit),
     )
-    rows = await cursor.fetchall()
-    return [dict(row) for row in rows]
+    return [dict(row) for row in await cursor.fetchall()]
+
+
+async def rebuild_search_index():
+    """Rebuild conversations_fts from the conversations table."""
+    db = await get_db()
+    await db.execute("INSERT INTO conversations_fts (conversations_fts) VALUES ('rebuild')")
+    await db.commit()
 
 
 # --- Wizard helpers ---
@@ -257,7 +889,7 @@ async def list_channels() -> list[dict]:
 
 async def get_wizard_state() -> dict:
     """Get the wizard state."""
-    db = await get_db()
+    db = await get_read_db()
     cursor = await db.execute("SELECT completed, current_step, data FROM wizard_state WHERE id = 1")
     row = await cursor.fetchone()
     return {
@@ -301,7 +933,7 @@ async def create_session(token: str, user_id: str, expires_at: str):
 
 async def validate_session(token: str) -> dict | None:
     """Validate a session token, return session data or None."""
-    db = await get_db()
+    db = await get_read_db()
     cursor = await db.execute(
         "SELECT user_id, expires_at FROM sessions WHERE token = ? AND expires_at > datetime('now')",
         (token,),
@@ -329,7 +961,7 @@ async def add_faq(guild_id: str, question: str, answer: str, match_keywords: str
     return cursor.lastrowid
 
 async def get_faqs(guild_id: str | None = None) -> list[dict]:
-    db = await get_db()
+    db = await get_read_db()
     if guild_id:
         cursor = await db.execute(
             "SELECT id, guild_id, question, answer, match_keywords, times_used, created_by, created_at FROM faqs WHERE guild_id = ?",
@@ -343,7 +975,7 @@ async def get_faqs(guild_id: str | None = None) -> list[dict]:
     return [dict(row) for row in rows]
 
 async def get_faq_by_id(faq_id: int) -> dict | None:
-    db = await get_db()
+    db = await get_read_db()
     cursor = await db.execute(
         "SELECT id, guild_id, question, answer, match_keywords, times_used, created_by, created_at FROM faqs WHERE id = ?",
         (faq_id,),
@@ -357,9 +989,7 @@ async def delete_faq(faq_id: int):
     await db.commit()
 
 async def increment_faq_usage(faq_id: int):
-    db = await get_db()
-    await db.execute("UPDATE faqs SET times_used = times_used + 1 WHERE id = ?", (faq_id,))
-    await db.commit()
+    _buffer_write("UPDATE faqs SET times_used = times_used + 1 WHERE id = ?", (faq_id,))
 
 
 # --- Command Permissions helpers ---
@@ -372,6 +1002,12 @@ async def add_command_permission(command_name: str, guild_id: str, role_id: str)
     )
     await db.commit()
 
+    def update(data):
+        role_ids = data.get((command_name, guild_id), [])
+        if role_id not in role_ids:
+            data[(command_name, guild_id)] = role_ids + [role_id]
+    _settings_changed("command_permissions", update)
+
 async def remove_command_permission(command_name: str, guild_id: str, role_id: str):
     db = await get_db()
     await db.execute(
@@ -380,17 +1016,19 @@ async def remove_command_permission(command_name: str, guild_id: str, role_id: s
     )
     await db.commit()
 
+    def update(data):
+        role_ids = [r for r in data.get((command_name, guild_id), []) if r != role_id]
+        if role_ids:
+            data[(command_name, guild_id)] = role_ids
+        else:
+            data.pop((command_name, guild_id), None)
+    _settings_changed("command_permissions", update)
+
 async def get_command_permissions(command_name: str, guild_id: str) -> list[str]:
-    db = await get_db()
-    cursor = await db.execute(
-        "SELECT role_id FROM command_permissions WHERE command_name = ? AND guild_id = ?",
-        (command_name, guild_id),
-    )
-    rows = await cursor.fetchall()
-    return [row["role_id"] for row in rows]
+    return list((await _settings_table("command_permissions")).get((command_name, guild_id), []))
 
 async def get_all_command_permissions(guild_id: str | None = None) -> list[dict]:
-    db = await get_db()
+    db = await get_read_db()
     if guild_id:
         cursor = await db.execute(
             "SELECT command_name, guild_id, role_id FROM command_permissions WHERE guild_id = ?",
@@ -407,12 +1045,52 @@ async def get_all_command_permissions(guild_id: str | None = None) -> list[dict]
 # --- Moderation helpers ---
 
 async def add_moderation_log(guild_id: str, channel_id: str, message_id: str, author_id: str, reason: str, severity: str):
-    """Add an entry to the moderation log."""
-    db = await get_db()
-    await db.execute(
+    """Add an entry to the moderation log (committed by the next write-behind flush)."""
+    _buffer_write(
         "INSERT INTO moderation_logs (guild_id, channel_id, message_id, author_id, reason, severity) VALUES (?, ?, ?, ?, ?, ?)",
         (guild_id, channel_id, message_id, author_id, reason, severity),
     )
+
+async def add_blocklist_term(guild_id: str, term: str, is_regex: bool = False, created_by: str | None = None) -> bool:
+    """Add a term (or regex) to a guild's moderation blocklist. Returns False if it already exists."""
+    db = await get_db()
+    cursor = await db.execute(
+        "INSERT OR IGNORE INTO moderation_blocklist (guild_id, term, is_regex, created_by) VALUES (?, ?, ?, ?)",
+        (guild_id, term, int(is_regex), created_by),
+    )
+    await db.commit()
+    return cursor.rowcount > 0
+
+async def remove_blocklist_term(guild_id: str, term: str) -> bool:
+    """Remove a term from a guild's moderation blocklist. Returns False if it wasn't there."""
+    db = await get_db()
+    cursor = await db.execute(
+        "DELETE FROM moderation_blocklist WHERE guild_id = ? AND term = ?",
+        (guild_id, term),
+    )
+    await db.commit()
+    return cursor.rowcount > 0
+
+async def get_blocklist(guild_id: str) -> list[dict]:
+    """Return a guild's moderation blocklist entries."""
+    db = await get_read_db()
+    cursor = await db.execute(
+        "SELECT term, is_regex, created_by, created_at FROM moderation_blocklist WHERE guild_id = ? ORDER BY term",
+        (guild_id,),
+    )
+    rows = await cursor.fetchall()
+    return [dict(row) for row in rows]
+
+
+# --- AI audit log helpers ---
+
+async def add_audit_log(request_type: str, channel_id: str | None, user_name: str | None, provider: str | None, input_tokens: int, output_tokens: int, latency_ms: int):
+    """Record one stateless AI call (metadata only, no message content)."""
+    db = await get_db()
+    await db.execute(
+        "INSERT INTO ai_audit_log (request_type, channel_id, user_name, provider, input_tokens, output_tokens, latency_ms) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (request_type, channel_id, user_name, provider, input_tokens, output_tokens, latency_ms),
+    )
     await db.commit()
 
 
@@ -426,23 +1104,22 @@ async def set_channel_prompt(channel_id: str, guild_id: str, system_prompt: str)
         (channel_id, guild_id, system_prompt),
     )
     await db.commit()
+    _settings_changed("channel_prompts", lambda data: data.update({channel_id: system_prompt}))
 
 async def get_channel_prompt(channel_id: str) -> str | None:
     """Get the custom system prompt for a channel."""
-    db = await get_db()
-    cursor = await db.execute("SELECT system_prompt FROM channel_prompts WHERE channel_id = ?", (channel_id,))
-    row = await cursor.fetchone()
-    return row["system_prompt"] if row else None
+    return (await _settings_table("channel_prompts")).get(channel_id)
 
 async def delete_channel_prompt(channel_id: str):
     """Delete the custom system prompt for a channel."""
     db = await get_db()
     await db.execute("DELETE FROM channel_prompts WHERE channel_id = ?", (channel_id,))
     await db.commit()
+    _settings_changed("channel_prompts", lambda data: data.pop(channel_id, None))
 
 async def get_all_channel_prompts(guild_id: str | None = None) -> list[dict]:
     """Get all custom system prompts for a guild, or all prompts if guild_id is None."""
-    db = await get_db()
+    db = await get_read_db()
     if guild_id:
         cursor = await db.execute(
             "SELECT channel_id, guild_id, system_prompt FROM channel_prompts WHERE guild_id = ?",
@@ -464,23 +1141,22 @@ async def set_channel_provider(channel_id: str, guild_id: str, provider_name: st
         (channel_id, guild_id, provider_name),
     )
     await db.commit()
+    _settings_changed("channel_providers", lambda data: data.update({channel_id: provider_name}))
 
 async def get_channel_provider(channel_id: str) -> str | None:
     """Get the custom AI provider for a channel."""
-    db = await get_db()
-    cursor = await db.execute("SELECT provider_name FROM channel_providers WHERE channel_id = ?", (channel_id,))
-    row = await cursor.fetchone()
-    return row["provider_name"] if row else None
+    return (await _settings_table("channel_providers")).get(channel_id)
 
 async def delete_channel_provider(channel_id: str):
     """Delete the custom AI provider for a channel."""
     db = await get_db()
     await db.execute("DELETE FROM channel_providers WHERE channel_id = ?", (channel_id,))
     await db.commit()
+    _settings_changed("channel_providers", lambda data: data.pop(channel_id, None))
 
 async def get_all_channel_providers(guild_id: str | None = None) -> list[dict]:
     """Get all custom AI providers for a guild, or all providers if guild_id is None."""
-    db = await get_db()
+    db = await get_read_db()
     if guild_id:
         cursor = await db.execute(
             "SELECT channel_id, guild_id, provider_name FROM channel_providers WHERE guild_id = ?",
@@ -492,9 +1168,273 @@ async def get_all_channel_providers(guild_id: str | None = None) -> list[dict]:
     return [dict(row) for row in rows]
 
 
+# --- Retention / archive helpers ---
+
+async def set_retention_policy(scope: str, target_id: str, max_age_days: int, max_messages: int):
+    """Set the retention policy for a guild or channel (0 = no limit)."""
+    db = await get_db()
+    await db.execute(
+        "INSERT INTO retention_policies (scope, target_id, max_age_days, max_messages) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(scope, target_id) DO UPDATE SET max_age_days = excluded.max_age_days, max_messages = excluded.max_messages",
+        (scope, target_id, max_age_days, max_messages),
+    )
+    await db.commit()
+
+async def delete_retention_policy(scope: str, target_id: str) -> bool:
+    """Remove a guild or channel retention policy. Returns False if there was none."""
+    db = await get_db()
+    cursor = await db.execute(
+        "DELETE FROM retention_policies WHERE scope = ? AND target_id = ?",
+        (scope, target_id),
+    )
+    await db.commit()
+    return cursor.rowcount > 0
+
+async def get_retention_policies() -> list[dict]:
+    """Return all guild and channel retention policies."""
+    db = await get_read_db()
+    cursor = await db.execute("SELECT scope, target_id, max_age_days, max_messages FROM retention_policies")
+    rows = await cursor.fetchall()
+    return [dict(row) for row in rows]
+
+async def get_archive_cutoff_id(channel_id: str, max_age_days: int = 0, max_messages: int = 0) -> int | None:
+    """Return the highest conversation id in a channel that falls outside retention, or None."""
+    await _flush_channel_writes(channel_id)
+    db = await get_read_db()
+    cutoff = None
+    if max_messages > 0:
+        cursor = await db.execute(
+            "SELECT id FROM conversations WHERE channel_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?",
+            (channel_id, max_messages),
+        )
+        row = await cursor.fetchone()
+        cutoff = row["id"] if row else None
+    if max_age_days > 0:
+        cursor = await db.execute(
+            "SELECT MAX(id) AS id FROM conversations WHERE channel_id = ? AND created_at < datetime('now', ?)",
+            (channel_id, f"-{int(max_age_days)} days"),
+        )
+        row = await cursor.fetchone()
+        if row and row["id"] is not None:
+            cutoff = max(cutoff or 0, row["id"])
+    return cutoff
+
+async def archive_messages(channel_id: str, up_to_id: int, batch_size: int = 500) -> int:
+    """Move the oldest batch of a channel's messages with id <= up_to_id into the archive.
+
+    One short transaction per call; returns the number of rows moved (0 when done).
+    """
+    db = await get_db()
+    cursor = await db.execute(
+        "SELECT id, role, author_name, content, provider, type, token_count, created_at FROM conversations "
+        "WHERE channel_id = ? AND id <= ? ORDER BY id LIMIT ?",
+        (channel_id, up_to_id, batch_size),
+    )
+    rows = [dict(row) for row in await cursor.fetchall()]
+    if not rows:
+        return 0
+
+    data = zlib.compress(json.dumps(rows, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+    first, last = rows[0], rows[-1]
+    await db.execute(
+        "INSERT INTO conversation_archive (channel_id, first_id, last_id, first_at, last_at, message_count, data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (channel_id, first["id"], last["id"], first["created_at"], last["created_at"], len(rows), data),
+    )
+    await db.execute(
+        "DELETE FROM conversations WHERE channel_id = ? AND id BETWEEN ? AND ?",
+        (channel_id, first["id"], last["id"]),
+    )
+    await db.commit()
+    return len(rows)
+
+async def get_archived_messages(channel_id: str, before_id: int | None = None, limit: int = 100) -> list[dict]:
+    """Return up to `limit` archived messages older than before_id, oldest first."""
+    db = await get_read_db()
+    cursor = await db.execute(
+        "SELECT data FROM conversation_archive WHERE channel_id = ? AND first_id < ? ORDER BY last_id DESC",
+        (channel_id, before_id if before_id is not None else 2**63 - 1),
+    )
+    messages: list[dict] = []
+    while len(messages) < limit:
+        row = await cursor.fetchone()
+        if row is None:
+            break
+        batch = json.loads(zlib.decompress(row["data"]))
+        if before_id is not None:
+            batch = [m for m in batch if m["id"] < before_id]
+        messages[:0] = batch
+    await cursor.close()
+    return messages[-limit:] if limit > 0 else []
+
+
+# --- Response cache helpers ---
+
+async def get_cached_response(key: str) -> dict | None:
+    """Get an unexpired cached AI response by key."""
+    db = await get_read_db()
+    cursor = await db.execute(
+        "SELECT provider, response FROM response_cache WHERE key = ? AND expires_at > datetime('now')",
+        (key,),
+    )
+    row = await cursor.fetchone()
+    return dict(row) if row else None
+
+async def set_cached_response(key: str, provider: str, response: str, ttl_seconds: int):
+    """Store an AI response in the cache for ttl_seconds."""
+    db = await get_db()
+    await db.execute(
+        "INSERT INTO response_cache (key, provider, response, expires_at) VALUES (?, ?, ?, datetime('now', ?)) "
+        "ON CONFLICT(key) DO UPDATE SET provider = excluded.provider, response = excluded.response, "
+        "created_at = excluded.created_at, expires_at = excluded.expires_at",
+        (key, provider, response, f"+{int(ttl_seconds)} seconds"),
+    )
+    await db.commit()
+
+async def purge_expired_responses() -> int:
+    """Delete expired cache entries. Returns the number of rows removed."""
+    db = await get_db()
+    cursor = await db.execute("DELETE FROM response_cache WHERE expires_at <= datetime('now')")
+    await db.commit()
+    return cursor.rowcount
+
+
+# --- Export / import helpers ---
+
+
+async def iter_table_rows(table: str, batch_size: int = 1000) -> AsyncIterator[dict]:
+    """Yield every row of an EXPORT_TABLES table in key order, one keyset page at a time."""
+    key, columns = EXPORT_TABLES[table]
+    await flush_writes()
+    db = await get_read_db()
+    after = None
+    while True:
+        where = f"WHERE ({', '.join(key)}) > ({', '.join('?' * len(key))}) " if after else ""
+        cursor = await db.execute(
+            f"SELECT {', '.join(columns)} FROM {table} {where}ORDER BY {', '.join(key)} LIMIT ?",
+            (*(after or ()), batch_size),
+        )
+        rows = [dict(row) for row in await cursor.fetchall()]
+        for row in rows:
+            yield row
+        if len(rows) < batch_size:
+            return
+        after = tuple(rows[-1][column] for column in key)
+
+
+async def _import_batch(conn: aiosqlite.Connection, source: str, batch: list[tuple[str, dict]], counts: dict):
+    await conn.execute("BEGIN IMMEDIATE")
+    try:
+        cursor = await conn.execute("SELECT name, seq FROM sqlite_sequence")
+        sequences = {name: seq for name, seq in await cursor.fetchall()}
+        for table, group in groupby(batch, key=lambda record: record[0]):
+            key, columns = EXPORT_TABLES[table]
+            rows = [row for _, row in group]
+            stats = counts.setdefault(table, {"imported": 0, "skipped": 0})
+
+            if key == ("id",):
+                cursor = await conn.execute(
+                    f"SELECT old_id FROM import_id_map WHERE source = ? AND table_name = ? AND old_id IN ({', '.join('?' * len(rows))})",
+                    (source, table, *(row["id"] for row in rows)),
+                )
+                loaded = {old_id for (old_id,) in await cursor.fetchall()}
+                fresh = []
+                for row in rows:
+                    if row["id"] not in loaded:
+                        loaded.add(row["id"])
+                        fresh.append(row)
+                stats["skipped"] += len(rows) - len(fresh)
+                if not fresh:
+                    continue
+
+                # New ids continue past both the largest id and the AUTOINCREMENT
+                # high-water mark, so ids of deleted rows are never reused
+                cursor = await conn.execute(f"SELECT MAX(id) FROM {table}")
+                next_id = max((await cursor.fetchone())[0] or 0, sequences.get(table, 0)) + 1
+                new_ids = range(next_id, next_id + len(fresh))
+                sequences[table] = new_ids[-1]
+                await conn.executemany(
+                    f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                    [(new_id, *(row.get(column) for column in columns[1:])) for new_id, row in zip(new_ids, fresh)],
+                )
+                await conn.executemany(
+                    "INSERT INTO import_id_map (source, table_name, old_id, new_id) VALUES (?, ?, ?, ?)",
+                    [(source, table, row["id"], new_id) for new_id, row in zip(new_ids, fresh)],
+                )
+                stats["imported"] += len(fresh)
+            else:
+                values = [column for column in columns if column not in key]
+                action = f"UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in values)}" if values else "NOTHING"
+                await conn.executemany(
+                    f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+                    f"ON CONFLICT({', '.join(key)}) DO {action}",
+                    [tuple(row.get(column) for column in columns) for row in rows],
+                )
+                stats["imported"] += len(rows)
+        await conn.commit()
+    except Exception:
+        await conn.rollback()
+        raise
+
+
+async def import_records(source: str, records: AsyncIterator[tuple[str, dict]], batch_size: int = 500) -> dict[str, dict[str, int]]:
+    """Load exported (table, row) records, batch_size rows per transaction.
+
+    Rows keyed by "id" are inserted under new ids and recorded in import_id_map
+    against `source` (the export's id), so importing the same export again
+    skips them; other tables are upserted. Returns imported / skipped counts
+    per table.
+    """
+    await flush_writes()
+    # A private connection, so no other helper's statements land inside a batch
+    conn = await _connect()
+    counts: dict[str, dict[str, int]] = {}
+    try:
+        batch: list[tuple[str, dict]] = []
+        async for table, row in records:
+            if table not in EXPORT_TABLES:
+                raise ValueError(f"unknown table in import: {table}")
+            batch.append((table, row))
+            if len(batch) >= batch_size:
+                await _import_batch(conn, source, batch, counts)
+                batch = []
+                await asyncio.sleep(IMPORT_PAUSE_MS / 1000)
+        if batch:
+            await _import_batch(conn, source, batch, counts)
+    finally:
+        await conn.close()
+        for table in counts:
+            if table in _SETTINGS_QUERIES:
+                _settings_changed(table)
+    return counts
+
+
 async def close_db():
-    """Close the database connection."""
-    global _db
-    if _db:
-        await _db.close()
-        _db = None
+    """Flush buffered writes and close this event loop's connections."""
+    global _write_timer
+    await flush_writes()
+    loop = asyncio.get_running_loop()
+    with _write_lock:
+        # A timer left on a loop that is about to close would never fire
+        if _write_timer is not None and _write_timer_loop is loop:
+            _write_timer.cancel()
+            _write_timer = None
+    with _pools_lock:
+        pool = _pools.pop(loop, None)
+    if pool is None:
+        return
+    for conn in pool.readers:
+        await conn.close()
+    if pool.flusher is not None:
+        await pool.flusher.close()
+    if pool.writer is not None:
+        await pool.writer.close()
+
+
+# --- Backend selection ---
+
+# The helpers above are the SQLite implementation of storage.Storage. With a
+# PostgreSQL DATABASE_URL they are replaced by db_postgres's, so callers keep
+# using `import db` unchanged. sync_db_to_env and the SQLite connection
+# helpers are not part of the interface and stay as they are.
+if BACKEND == "postgres":
+    from db_postgres import *  # noqa: E402,F401,F403
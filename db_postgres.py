@@ -0,0 +1,1116 @@
+"""PostgreSQL storage backend, used when DATABASE_URL is a postgresql:// URL.
+
+Implements the storage.Storage helpers on an asyncpg connection pool so several
+bot and API instances can share one database. db.py imports everything in
+__all__ over its own SQLite helpers; nothing else imports this module directly.
+
+Timestamps are stored as UTC text ("YYYY-MM-DD HH:MM:SS") exactly like the
+SQLite schema, so both backends return and compare the same values.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import json
+import asyncio
+import datetime
+import threading
+import time
+import zlib
+from collections.abc import AsyncIterator
+from itertools import groupby
+
+import asyncpg
+
+from storage import EXPORT_TABLES
+from utils.tokens import count_tokens
+
+__all__ = [
+    "init_db", "close_db", "flush_writes", "get_write_stats", "get_settings_cache_stats",
+    "get_config", "get_all_config", "set_config", "set_config_bulk", "sync_env_to_db",
+    "add_message", "get_messages", "iter_messages", "set_token_counts", "get_messages_since",
+    "clear_messages", "list_channels", "rebuild_channel_stats", "search_messages", "rebuild_search_index",
+    "get_wizard_state", "set_wizard_state", "create_session", "validate_session", "delete_session",
+    "add_faq", "get_faqs", "get_faq_by_id", "delete_faq", "increment_faq_usage",
+    "add_command_permission", "remove_command_permission", "get_command_permissions", "get_all_command_permissions",
+    "add_moderation_log", "add_blocklist_term", "remove_blocklist_term", "get_blocklist", "add_audit_log",
+    "set_channel_prompt", "get_channel_prompt", "delete_channel_prompt", "get_all_channel_prompts",
+    "set_channel_provider", "get_channel_provider", "delete_channel_provider", "get_all_channel_providers",
+    "set_retention_policy", "delete_retention_policy", "get_retention_policies",
+    "get_archive_cutoff_id", "archive_messages", "get_archived_messages",
+    "get_cached_response", "set_cached_response", "purge_expired_responses",
+    "iter_table_rows", "import_records",
+]
+
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+
+# Pools are bound to the event loop that created them, so each loop (bot, API
+# thread, one-off asyncio.run calls) gets its own, as with db.py's connections
+POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+
+# Settings tables are cached in memory as in db.py. Writes are announced with
+# NOTIFY so other instances drop their copy; the TTL covers missed notifications.
+SETTINGS_CACHE_TTL_SECONDS = int(os.getenv("DB_SETTINGS_CACHE_TTL_SECONDS", "300"))
+SETTINGS_CHANNEL = "sparksage_settings"
+
+IMPORT_PAUSE_MS = int(os.getenv("DB_IMPORT_PAUSE_MS", "5"))
+
+NOW = "to_char(now() AT TIME ZONE 'utc', 'YYYY-MM-DD HH24:MI:SS')"
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS config (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS conversations (
+    id          BIGSERIAL PRIMARY KEY,
+    channel_id  TEXT NOT NULL,
+    guild_id    TEXT,
+    role        TEXT NOT NULL,
+    author_name TEXT,
+    content     TEXT NOT NULL,
+    provider    TEXT,
+    type        TEXT,
+    token_count INTEGER,
+    created_at  TEXT NOT NULL DEFAULT {NOW},
+    search      TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple', content || ' ' || coalesce(author_name, ''))) STORED
+);
+CREATE INDEX IF NOT EXISTS idx_conv_channel ON conversations(channel_id, id);
+CREATE INDEX IF NOT EXISTS idx_conv_channel_created ON conversations(channel_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_conv_search ON conversations USING GIN (search);
+
+CREATE TABLE IF NOT EXISTS sessions (
+    token      TEXT PRIMARY KEY,
+    user_id    TEXT NOT NULL,
+    created_at TEXT NOT NULL DEFAULT {NOW},
+    expires_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS wizard_state (
+    id           INTEGER PRIMARY KEY CHECK (id = 1),
+    completed    INTEGER NOT NULL DEFAULT 0,
+    current_step INTEGER NOT NULL DEFAULT 0,
+    data         TEXT    NOT NULL DEFAULT '{{}}'
+);
+INSERT INTO wizard_state (id) VALUES (1) ON CONFLICT DO NOTHING;
+
+CREATE TABLE IF NOT EXISTS faqs (
+    id             BIGSERIAL PRIMARY KEY,
+    guild_id       TEXT NOT NULL,
+    question       TEXT NOT NULL,
+    answer         TEXT NOT NULL,
+    match_keywords TEXT NOT NULL,
+    times_used     INTEGER DEFAULT 0,
+    created_by     TEXT,
+    created_at     TEXT DEFAULT {NOW}
+);
+CREATE INDEX IF NOT EXISTS idx_faqs_guild ON faqs(guild_id);
+
+CREATE TABLE IF NOT EXISTS command_permissions (
+    command_name TEXT NOT NULL,
+    guild_id     TEXT NOT NULL,
+    role_id      TEXT NOT NULL,
+    PRIMARY KEY (command_name, guild_id, role_id)
+);
+CREATE INDEX IF NOT EXISTS idx_cmd_perms_guild ON command_permissions(guild_id);
+
+CREATE TABLE IF NOT EXISTS moderation_logs (
+    id         BIGSERIAL PRIMARY KEY,
+    guild_id   TEXT NOT NULL,
+    channel_id TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    author_id  TEXT NOT NULL,
+    reason     TEXT NOT NULL,
+    severity   TEXT NOT NULL,
+    created_at TEXT NOT NULL DEFAULT {NOW}
+);
+CREATE INDEX IF NOT EXISTS idx_modlogs_guild_created ON moderation_logs(guild_id, created_at);
+
+CREATE TABLE IF NOT EXISTS channel_prompts (
+    channel_id    TEXT PRIMARY KEY,
+    guild_id      TEXT NOT NULL,
+    system_prompt TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_channel_prompts_guild ON channel_prompts(guild_id);
+
+CREATE TABLE IF NOT EXISTS channel_providers (
+    channel_id    TEXT PRIMARY KEY,
+    guild_id      TEXT NOT NULL,
+    provider_name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_channel_providers_guild ON channel_providers(guild_id);
+
+CREATE TABLE IF NOT EXISTS response_cache (
+    key        TEXT PRIMARY KEY,
+    provider   TEXT NOT NULL,
+    response   TEXT NOT NULL,
+    created_at TEXT NOT NULL DEFAULT {NOW},
+    expires_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_response_cache_expires ON response_cache(expires_at);
+
+CREATE TABLE IF NOT EXISTS moderation_blocklist (
+    id         BIGSERIAL PRIMARY KEY,
+    guild_id   TEXT NOT NULL,
+    term       TEXT NOT NULL,
+    is_regex   INTEGER NOT NULL DEFAULT 0,
+    created_by TEXT,
+    created_at TEXT NOT NULL DEFAULT {NOW},
+    UNIQUE (guild_id, term)
+);
+
+CREATE TABLE IF NOT EXISTS ai_audit_log (
+    id            BIGSERIAL PRIMARY KEY,
+    request_type  TEXT NOT NULL,
+    channel_id    TEXT,
+    user_name     TEXT,
+    provider      TEXT,
+    input_tokens  INTEGER,
+    output_tokens INTEGER,
+    latency_ms    INTEGER,
+    created_at    TEXT NOT NULL DEFAULT {NOW}
+);
+
+CREATE TABLE IF NOT EXISTS retention_policies (
+    scope        TEXT    NOT NULL,
+    target_id    TEXT    NOT NULL,
+    max_age_days INTEGER NOT NULL DEFAULT 0,
+    max_messages INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (scope, target_id)
+);
+
+CREATE TABLE IF NOT EXISTS conversation_archive (
+    id            BIGSERIAL PRIMARY KEY,
+    channel_id    TEXT    NOT NULL,
+    first_id      BIGINT  NOT NULL,
+    last_id       BIGINT  NOT NULL,
+    first_at      TEXT    NOT NULL,
+    last_at       TEXT    NOT NULL,
+    message_count INTEGER NOT NULL,
+    data          BYTEA   NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_archive_channel_last ON conversation_archive(channel_id, last_id);
+
+CREATE TABLE IF NOT EXISTS channel_stats (
+    channel_id    TEXT PRIMARY KEY,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    last_active   TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_channel_stats_last_active ON channel_stats(last_active);
+
+CREATE TABLE IF NOT EXISTS channel_stat_breakdown (
+    channel_id TEXT    NOT NULL,
+    kind       TEXT    NOT NULL,
+    value      TEXT    NOT NULL,
+    count      INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (channel_id, kind, value)
+);
+
+CREATE TABLE IF NOT EXISTS import_id_map (
+    source     TEXT   NOT NULL,
+    table_name TEXT   NOT NULL,
+    old_id     BIGINT NOT NULL,
+    new_id     BIGINT NOT NULL,
+    PRIMARY KEY (source, table_name, old_id)
+);
+
+CREATE OR REPLACE FUNCTION conversations_stats_insert() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO channel_stats (channel_id, message_count, last_active)
+    VALUES (NEW.channel_id, 1, NEW.created_at)
+    ON CONFLICT (channel_id) DO UPDATE SET
+        message_count = channel_stats.message_count + 1,
+        last_active = GREATEST(channel_stats.last_active, EXCLUDED.last_active);
+    IF NEW.provider IS NOT NULL THEN
+        INSERT INTO channel_stat_breakdown (channel_id, kind, value, count) VALUES (NEW.channel_id, 'provider', NEW.provider, 1)
+        ON CONFLICT (channel_id, kind, value) DO UPDATE SET count = channel_stat_breakdown.count + 1;
+    END IF;
+    IF NEW.type IS NOT NULL THEN
+        INSERT INTO channel_stat_breakdown (channel_id, kind, value, count) VALUES (NEW.channel_id, 'type', NEW.type, 1)
+        ON CONFLICT (channel_id, kind, value) DO UPDATE SET count = channel_stat_breakdown.count + 1;
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION conversations_stats_delete() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE channel_stats SET message_count = message_count - 1 WHERE channel_id = OLD.channel_id;
+    DELETE FROM channel_stats WHERE channel_id = OLD.channel_id AND message_count <= 0;
+    UPDATE channel_stat_breakdown SET count = count - 1
+    WHERE channel_id = OLD.channel_id AND kind = 'provider' AND value = OLD.provider;
+    UPDATE channel_stat_breakdown SET count = count - 1
+    WHERE channel_id = OLD.channel_id AND kind = 'type' AND value = OLD.type;
+    DELETE FROM channel_stat_breakdown WHERE channel_id = OLD.channel_id AND count <= 0;
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE TRIGGER trg_conversations_stats_insert AFTER INSERT ON conversations
+FOR EACH ROW EXECUTE FUNCTION conversations_stats_insert();
+CREATE OR REPLACE TRIGGER trg_conversations_stats_delete AFTER DELETE ON conversations
+FOR EACH ROW EXECUTE FUNCTION conversations_stats_delete();
+"""
+
+
+class _Pool:
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.pool: asyncpg.Pool | None = None
+        self.listener: asyncpg.Connection | None = None
+
+
+_pools: dict[asyncio.AbstractEventLoop, _Pool] = {}
+_pools_lock = threading.Lock()
+# Server PIDs of our own open pool connections, so our own NOTIFYs can be ignored
+_own_pids: set[int] = set()
+
+_SETTINGS_QUERIES = {
+    "config": "SELECT key, value FROM config",
+    "channel_prompts": "SELECT channel_id, system_prompt FROM channel_prompts",
+    "channel_providers": "SELECT channel_id, provider_name FROM channel_providers",
+    "command_permissions": "SELECT command_name, guild_id, role_id FROM command_permissions",
+}
+_settings_lock = threading.Lock()
+_settings: dict[str, tuple[float, dict]] = {}  # table -> (loaded_at, data)
+_settings_generation = dict.fromkeys(_SETTINGS_QUERIES, 0)
+_settings_stats = {table: {"hits": 0, "misses": 0, "invalidations": 0} for table in _SETTINGS_QUERIES}
+
+
+def _state() -> _Pool:
+    loop = asyncio.get_running_loop()
+    with _pools_lock:
+        for stale in [l for l in _pools if l.is_closed()]:
+            del _pools[stale]
+        if loop not in _pools:
+            _pools[loop] = _Pool()
+        return _pools[loop]
+
+
+async def _init_connection(conn: asyncpg.Connection):
+    pid = conn.get_server_pid()
+    _own_pids.add(pid)
+    # Pooled connections are closed when idle too long or the pool closes, and
+    # the server reuses PIDs; a released connection stays open and keeps its PID
+    conn.add_termination_listener(lambda _: _own_pids.discard(pid))
+
+
+def _on_settings_notify(conn, pid: int, channel: str, table: str):
+    if pid not in _own_pids and table in _SETTINGS_QUERIES:
+        _settings_changed(table)
+
+
+async def get_pool() -> asyncpg.Pool:
+    """Return this event loop's connection pool, creating it (and its NOTIFY listener) if needed."""
+    state = _state()
+    if state.pool is None:
+        async with state.lock:
+            if state.pool is None:
+                pool = await asyncpg.create_pool(DATABASE_URL, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE, init=_init_connection)
+                listener = await asyncpg.connect(DATABASE_URL)
+                await listener.add_listener(SETTINGS_CHANNEL, _on_settings_notify)
+                state.pool, state.listener = pool, listener
+    return state.pool
+
+
+def _rowcount(status: str) -> int:
+    """Row count from a command status such as "DELETE 3" or "INSERT 0 1"."""
+    return int(status.split()[-1])
+
+
+async def init_db():
+    """Create tables if they don't exist."""
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            # Instances starting together would otherwise race on CREATE ... IF NOT EXISTS
+            await conn.execute("SELECT pg_advisory_xact_lock(hashtext('sparksage_schema'))")
+            await conn.execute(SCHEMA)
+    with _settings_lock:
+        _settings.clear()
+    for table in _SETTINGS_QUERIES:
+        await _settings_table(table)
+
+
+async def close_db():
+    """Close this event loop's pool and listener."""
+    loop = asyncio.get_running_loop()
+    with _pools_lock:
+        state = _pools.pop(loop, None)
+    if state is None or state.pool is None:
+        return
+    await state.listener.close()
+    await state.pool.close()
+
+
+async def flush_writes():
+    """Writes are committed as they are made; nothing is buffered."""
+
+
+def get_write_stats() -> dict:
+    with _pools_lock:
+        pools = [state.pool for state in _pools.values() if state.pool is not None]
+    return {
+        "backend": "postgres",
+        "pools": len(pools),
+        "connections": sum(pool.get_size() for pool in pools),
+        "idle": sum(pool.get_idle_size() for pool in pools),
+        "max_size": POOL_MAX_SIZE,
+    }
+
+
+# --- Settings cache helpers ---
+
+
+async def _settings_table(table: str) -> dict:
+    """Return the cached contents of a settings table, (re)loading it when missing or expired."""
+    with _settings_lock:
+        entry = _settings.get(table)
+        if entry is not None and time.monotonic() - entry[0] < SETTINGS_CACHE_TTL_SECONDS:
+            _settings_stats[table]["hits"] += 1
+            return entry[1]
+        _settings_stats[table]["misses"] += 1
+        generation = _settings_generation[table]
+
+    rows = await (await get_pool()).fetch(_SETTINGS_QUERIES[table])
+    if table == "command_permissions":
+        data: dict = {}
+        for command_name, guild_id, role_id in rows:
+            data.setdefault((command_name, guild_id), []).append(role_id)
+    else:
+        data = {key: value for key, value in rows}
+
+    with _settings_lock:
+        if _settings_generation[table] == generation:
+            _settings[table] = (time.monotonic(), data)
+    return data
+
+
+def _settings_changed(table: str, update=None):
+    """Apply a committed write to this process's cached copy (see db._settings_changed)."""
+    with _settings_lock:
+        _settings_generation[table] += 1
+        _settings_stats[table]["invalidations"] += 1
+        entry = _settings.pop(table, None)
+        if entry is not None and update is not None:
+            data = dict(entry[1])
+            update(data)
+            _settings[table] = (entry[0], data)
+
+
+async def _announce_settings_change(conn: asyncpg.Connection, table: str, update=None):
+    """Update this process's cache and tell other instances to drop theirs."""
+    _settings_changed(table, update)
+    await conn.execute("SELECT pg_notify($1, $2)", SETTINGS_CHANNEL, table)
+
+
+def get_settings_cache_stats() -> dict:
+    with _settings_lock:
+        stats = {}
+        for table, counts in _settings_stats.items():
+            lookups = counts["hits"] + counts["misses"]
+            entry = _settings.get(table)
+            stats[table] = {
+                **counts,
+                "hit_rate": round(counts["hits"] / lookups, 3) if lookups else None,
+                "items": len(entry[1]) if entry else None,
+            }
+    return {**stats, "ttl_seconds": SETTINGS_CACHE_TTL_SECONDS}
+
+
+# --- Config helpers ---
+
+
+async def get_config(key: str, default: str | None = None) -> str | None:
+    """Get a config value from the database."""
+    return (await _settings_table("config")).get(key, default)
+
+
+async def get_all_config() -> dict[str, str]:
+    """Return all config key-value pairs."""
+    return dict(await _settings_table("config"))
+
+
+async def set_config(key: str, value: str):
+    """Set a config value in the database."""
+    async with (await get_pool()).acquire() as conn:
+        await conn.execute(
+            "INSERT INTO config (key, value) VALUES ($1, $2) ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value",
+            key, value,
+        )
+        await _announce_settings_change(conn, "config", lambda data: data.update({key: value}))
+
+
+async def set_config_bulk(data: dict[str, str]):
+    """Set multiple config values at once."""
+    async with (await get_pool()).acquire() as conn:
+        async with conn.transaction():
+            await conn.executemany(
+                "INSERT INTO config (key, value) VALUES ($1, $2) ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value",
+                list(data.items()),
+            )
+        await _announce_settings_change(conn, "config", lambda cached: cached.update(data))
+
+
+async def sync_env_to_db():
+    """Seed the DB config table from current environment / .env values."""
+    import config as cfg
+
+    env_keys = {
+        "DISCORD_TOKEN": cfg.DISCORD_TOKEN or "",
+        "AI_PROVIDER": cfg.AI_PROVIDER,
+        "GEMINI_API_KEY": cfg.GEMINI_API_KEY or "",
+        "GEMINI_MODEL": cfg.GEMINI_MODEL,
+        "GROQ_API_KEY": cfg.GROQ_API_KEY or "",
+        "GROQ_MODEL": cfg.GROQ_MODEL,
+        "OPENROUTER_API_KEY": cfg.OPENROUTER_API_KEY or "",
+        "OPENROUTER_MODEL": cfg.OPENROUTER_MODEL,
+        "ANTHROPIC_API_KEY": cfg.ANTHROPIC_API_KEY or "",
+        "ANTHROPIC_MODEL": cfg.ANTHROPIC_MODEL,
+        "OPENAI_API_KEY": cfg.OPENAI_API_KEY or "",
+        "OPENAI_MODEL": cfg.OPENAI_MODEL,
+        "BOT_PREFIX": cfg.BOT_PREFIX,
+        "MAX_TOKENS": str(cfg.MAX_TOKENS),
+        "SYSTEM_PROMPT": cfg.SYSTEM_PROMPT,
+    }
+    # Only insert keys that don't already exist in DB (don't overwrite user edits)
+    async with (await get_pool()).acquire() as conn:
+        await conn.executemany(
+            "INSERT INTO config (key, value) VALUES ($1, $2) ON CONFLICT (key) DO NOTHING",
+            list(env_keys.items()),
+        )
+        await _announce_settings_change(conn, "config")
+
+
+# --- Conversation helpers ---
+
+
+async def add_message(channel_id: str, role: str, author_name: str | None, content: str, provider: str | None = None, type: str | None = None, guild_id: str | None = None):
+    """Add a message to conversation history."""
+    await (await get_pool()).execute(
+        "INSERT INTO conversations (channel_id, guild_id, role, author_name, content, provider, type, token_count) VALUES ($1, $2, $3, $4, $5, $6, $7, $8)",
+        channel_id, guild_id, role, author_name, content, provider, type, count_tokens(content),
+    )
+
+
+async def get_messages(channel_id: str, limit: int = 20, before_id: int | None = None, after_id: int | None = None) -> list[dict]:
+    """Get a page of a channel's messages, oldest first (keyset pagination, see db.get_messages)."""
+    newest_first = after_id is None or before_id is not None
+    rows = await (await get_pool()).fetch(
+        "SELECT id, role, author_name, content, provider, type, token_count, created_at FROM conversations "
+        "WHERE channel_id = $1 AND id > $2 AND id < $3 "
+        f"ORDER BY id {'DESC' if newest_first else 'ASC'} LIMIT $4",
+        channel_id, after_id if after_id is not None else -1, before_id if before_id is not None else 2**63 - 1, limit,
+    )
+    rows = [dict(row) for row in rows]
+    return rows[::-1] if newest_first else rows
+
+
+async def iter_messages(channel_id: str, after_id: int = 0, batch_size: int = 1000) -> AsyncIterator[dict]:
+    """Yield every message in a channel after after_id, oldest first, one keyset page at a time."""
+    while True:
+        page = await get_messages(channel_id, limit=batch_size, after_id=after_id)
+        for message in page:
+            yield message
+        if len(page) < batch_size:
+            return
+        after_id = page[-1]["id"]
+
+
+async def set_token_counts(counts: list[tuple[int, int]]):
+    """Cache token counts for existing conversation rows, as (id, token_count) pairs."""
+    if not counts:
+        return
+    await (await get_pool()).executemany(
+        "UPDATE conversations SET token_count = $1 WHERE id = $2",
+        [(count, message_id) for message_id, count in counts],
+    )
+
+
+async def get_messages_since(channel_id: str, since_datetime: datetime.datetime) -> list[dict]:
+    """Get messages for a channel since a specific datetime."""
+    rows = await (await get_pool()).fetch(
+        "SELECT role, author_name, content, provider, created_at FROM conversations WHERE channel_id = $1 AND created_at >= $2 ORDER BY created_at ASC",
+        channel_id, since_datetime.isoformat(),
+    )
+    return [dict(row) for row in rows]
+
+
+async def clear_messages(channel_id: str):
+    """Delete all messages for a channel, including archived ones."""
+    async with (await get_pool()).acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("DELETE FROM conversations WHERE channel_id = $1", channel_id)
+            await conn.execute("DELETE FROM conversation_archive WHERE channel_id = $1", channel_id)
+
+
+async def list_channels() -> list[dict]:
+    """List all channels with message counts and per-provider / per-type breakdowns."""
+    pool = await get_pool()
+    rows = await pool.fetch("SELECT channel_id, message_count, last_active FROM channel_stats ORDER BY last_active DESC")
+    channels = {row["channel_id"]: {**dict(row), "providers": {}, "types": {}} for row in rows}
+    for row in await pool.fetch("SELECT channel_id, kind, value, count FROM channel_stat_breakdown"):
+        channel = channels.get(row["channel_id"])
+        if channel is not None:
+            channel["providers" if row["kind"] == "provider" else "types"][row["value"]] = row["count"]
+    return list(channels.values())
+
+
+async def rebuild_channel_stats() -> int:
+    """Recompute channel_stats and channel_stat_breakdown from conversations. Returns the channel count."""
+    async with (await get_pool()).acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("DELETE FROM channel_stats")
+            await conn.execute("DELETE FROM channel_stat_breakdown")
+            await conn.execute(
+                "INSERT INTO channel_stats (channel_id, message_count, last_active) "
+                "SELECT channel_id, COUNT(*), MAX(created_at) FROM conversations GROUP BY channel_id"
+            )
+            for kind in ("provider", "type"):
+                await conn.execute(
+                    f"INSERT INTO channel_stat_breakdown (channel_id, kind, value, count) "
+                    f"SELECT channel_id, '{kind}', {kind}, COUNT(*) FROM conversations "
+                    f"GROUP BY channel_id, {kind} HAVING {kind} IS NOT NULL"
+                )
+        return await conn.fetchval("SELECT COUNT(*) FROM channel_stats")
+
+
+# --- Search helpers ---
+
+
+def _tsquery(query: str) -> str:
+    """Turn free text into a to_tsquery() string: every word must match, a trailing * matches a prefix.
+
+    Only word characters are kept, so user input can't inject tsquery
+    operators; a word with punctuation inside ("foo-bar") becomes a phrase.
+    """
+    terms = []
+    for word in query.split():
+        quoted = [f"'{part}'" for part in re.findall(r"\w+", word)]
+        if quoted:
+            if word.endswith("*"):
+                quoted[-1] += ":*"
+            terms.append(" <-> ".join(quoted))
+    return " & ".join(terms)
+
+
+async def search_messages(
+    query: str,
+    channel_id: str | None = None,
+    guild_id: str | None = None,
+    provider: str | None = None,
+    type: str | None = None,
+    since: str | None = None,
+    until: str | None = None,
+    sort: str = "rank",
+    after_score: float | None = None,
+    after_id: int | None = None,
+    limit: int = 20,
+) -> list[dict]:
+    """Full-text search over conversation history (see db.search_messages).
+
+    score is the negated ts_rank, so lower is better as with SQLite's bm25 and
+    the same (score, id) cursor works for both backends.
+    """
+    expression = _tsquery(query)
+    if not expression:
+        return []
+
+    params: list = [expression]
+    where = ["c.search @@ q"]
+
+    def param(value) -> str:
+        params.append(value)
+        return f"${len(params)}"
+
+    for column, value in (("channel_id", channel_id), ("guild_id", guild_id), ("provider", provider), ("type", type)):
+        if value is not None:
+            where.append(f"c.{column} = {param(value)}")
+    if since is not None:
+        where.append(f"c.created_at >= {param(since)}")
+    if until is not None:
+        where.append(f"c.created_at < {param(until)}")
+
+    if sort == "recent":
+        if after_id is not None:
+            where.append(f"c.id < {param(after_id)}")
+        order = "c.id DESC"
+    else:
+        if after_score is not None and after_id is not None:
+            score, last_id = param(after_score), param(after_id)
+            where.append(f"(-ts_rank(c.search, q) > {score} OR (-ts_rank(c.search, q) = {score} AND c.id < {last_id}))")
+        order = "score, c.id DESC"
+
+    rows = await (await get_pool()).fetch(
+        "SELECT c.id, c.channel_id, c.guild_id, c.role, c.author_name, c.provider, c.type, c.created_at, "
+        "ts_headline('simple', c.content, q, 'StartSel=[, StopSel=], MaxWords=16, MinWords=4, MaxFragments=1, FragmentDelimiter=…') AS snippet, "
+        "-ts_rank(c.search, q) AS score "
+        "FROM conversations c, to_tsquery('simple', $1) q "
+        f"WHERE {' AND '.join(where)} ORDER BY {order} LIMIT {param(limit)}",
+        *params,
+    )
+    return [dict(row) for row in rows]
+
+
+async def rebuild_search_index():
+    """Rebuild the GIN index over conversations.search (the tsvector column itself is always current)."""
+    await (await get_pool()).execute("REINDEX INDEX idx_conv_search")
+
+
+# --- Wizard helpers ---
+
+
+async def get_wizard_state() -> dict:
+    """Get the wizard state."""
+    row = await (await get_pool()).fetchrow("SELECT completed, current_step, data FROM wizard_state WHERE id = 1")
+    return {
+        "completed": bool(row["completed"]),
+        "current_step": row["current_step"],
+        "data": json.loads(row["data"]),
+    }
+
+
+async def set_wizard_state(completed: bool | None = None, current_step: int | None = None, data: dict | None = None):
+    """Update wizard state fields."""
+    updates = []
+    params = []
+    if completed is not None:
+        params.append(int(completed))
+        updates.append(f"completed = ${len(params)}")
+    if current_step is not None:
+        params.append(current_step)
+        updates.append(f"current_step = ${len(params)}")
+    if data is not None:
+        params.append(json.dumps(data))
+        updates.append(f"data = ${len(params)}")
+    if updates:
+        await (await get_pool()).execute(f"UPDATE wizard_state SET {', '.join(updates)} WHERE id = 1", *params)
+
+
+# --- Session helpers ---
+
+
+async def create_session(token: str, user_id: str, expires_at: str):
+    """Store a session token."""
+    await (await get_pool()).execute(
+        "INSERT INTO sessions (token, user_id, expires_at) VALUES ($1, $2, $3)",
+        token, user_id, expires_at,
+    )
+
+
+async def validate_session(token: str) -> dict | None:
+    """Validate a session token, return session data or None."""
+    row = await (await get_pool()).fetchrow(
+        f"SELECT user_id, expires_at FROM sessions WHERE token = $1 AND expires_at > {NOW}",
+        token,
+    )
+    return dict(row) if row else None
+
+
+async def delete_session(token: str):
+    """Delete a session."""
+    await (await get_pool()).execute("DELETE FROM sessions WHERE token = $1", token)
+
+
+# --- FAQ helpers ---
+
+async def add_faq(guild_id: str, question: str, answer: str, match_keywords: str, created_by: str | None = None) -> int:
+    return await (await get_pool()).fetchval(
+        "INSERT INTO faqs (guild_id, question, answer, match_keywords, created_by) VALUES ($1, $2, $3, $4, $5) RETURNING id",
+        guild_id, question, answer, match_keywords, created_by,
+    )
+
+async def get_faqs(guild_id: str | None = None) -> list[dict]:
+    pool = await get_pool()
+    if guild_id:
+        rows = await pool.fetch(
+            "SELECT id, guild_id, question, answer, match_keywords, times_used, created_by, created_at FROM faqs WHERE guild_id = $1",
+            guild_id,
+        )
+    else:
+        rows = await pool.fetch(
+            "SELECT id, guild_id, question, answer, match_keywords, times_used, created_by, created_at FROM faqs",
+        )
+    return [dict(row) for row in rows]
+
+async def get_faq_by_id(faq_id: int) -> dict | None:
+    row = await (await get_pool()).fetchrow(
+        "SELECT id, guild_id, question, answer, match_keywords, times_used, created_by, created_at FROM faqs WHERE id = $1",
+        faq_id,
+    )
+    return dict(row) if row else None
+
+async def delete_faq(faq_id: int):
+    await (await get_pool()).execute("DELETE FROM faqs WHERE id = $1", faq_id)
+
+async def increment_faq_usage(faq_id: int):
+    await (await get_pool()).execute("UPDATE faqs SET times_used = times_used + 1 WHERE id = $1", faq_id)
+
+
+# --- Command Permissions helpers ---
+
+async def add_command_permission(command_name: str, guild_id: str, role_id: str):
+    async with (await get_pool()).acquire() as conn:
+        await conn.execute(
+            "INSERT INTO command_permissions (command_name, guild_id, role_id) VALUES ($1, $2, $3) ON CONFLICT DO NOTHING",
+            command_name, guild_id, role_id,
+        )
+
+        def update(data):
+            role_ids = data.get((command_name, guild_id), [])
+            if role_id not in role_ids:
+                data[(command_name, guild_id)] = role_ids + [role_id]
+        await _announce_settings_change(conn, "command_permissions", update)
+
+async def remove_command_permission(command_name: str, guild_id: str, role_id: str):
+    async with (await get_pool()).acquire() as conn:
+        await conn.execute(
+            "DELETE FROM command_permissions WHERE command_name = $1 AND guild_id = $2 AND role_id = $3",
+            command_name, guild_id, role_id,
+        )
+
+        def update(data):
+            role_ids = [r for r in data.get((command_name, guild_id), []) if r != role_id]
+            if role_ids:
+                data[(command_name, guild_id)] = role_ids
+            else:
+                data.pop((command_name, guild_id), None)
+        await _announce_settings_change(conn, "command_permissions", update)
+
+async def get_command_permissions(command_name: str, guild_id: str) -> list[str]:
+    return list((await _settings_table("command_permissions")).get((command_name, guild_id), []))
+
+async def get_all_command_permissions(guild_id: str | None = None) -> list[dict]:
+    pool = await get_pool()
+    if guild_id:
+        rows = await pool.fetch(
+            "SELECT command_name, guild_id, role_id FROM command_permissions WHERE guild_id = $1",
+            guild_id,
+        )
+    else:
+        rows = await pool.fetch("SELECT command_name, guild_id, role_id FROM command_permissions")
+    return [dict(row) for row in rows]
+
+
+# --- Moderation helpers ---
+
+async def add_moderation_log(guild_id: str, channel_id: str, message_id: str, author_id: str, reason: str, severity: str):
+    """Add an entry to the moderation log."""
+    await (await get_pool()).execute(
+        "INSERT INTO moderation_logs (guild_id, channel_id, message_id, author_id, reason, severity) VALUES ($1, $2, $3, $4, $5, $6)",
+        guild_id, channel_id, message_id, author_id, reason, severity,
+    )
+
+async def add_blocklist_term(guild_id: str, term: str, is_regex: bool = False, created_by: str | None = None) -> bool:
+    """Add a term (or regex) to a guild's moderation blocklist. Returns False if it already exists."""
+    status = await (await get_pool()).execute(
+        "INSERT INTO moderation_blocklist (guild_id, term, is_regex, created_by) VALUES ($1, $2, $3, $4) ON CONFLICT DO NOTHING",
+        guild_id, term, int(is_regex), created_by,
+    )
+    return _rowcount(status) > 0
+
+async def remove_blocklist_term(guild_id: str, term: str) -> bool:
+    """Remove a term from a guild's moderation blocklist. Returns False if it wasn't there."""
+    status = await (await get_pool()).execute(
+        "DELETE FROM moderation_blocklist WHERE guild_id = $1 AND term = $2",
+        guild_id, term,
+    )
+    return _rowcount(status) > 0
+
+async def get_blocklist(guild_id: str) -> list[dict]:
+    """Return a guild's moderation blocklist entries."""
+    rows = await (await get_pool()).fetch(
+        "SELECT term, is_regex, created_by, created_at FROM moderation_blocklist WHERE guild_id = $1 ORDER BY term",
+        guild_id,
+    )
+    return [dict(row) for row in rows]
+
+
+# --- AI audit log helpers ---
+
+async def add_audit_log(request_type: str, channel_id: str | None, user_name: str | None, provider: str | None, input_tokens: int, output_tokens: int, latency_ms: int):
+    """Record one stateless AI call (metadata only, no message content)."""
+    await (await get_pool()).execute(
+        "INSERT INTO ai_audit_log (request_type, channel_id, user_name, provider, input_tokens, output_tokens, latency_ms) VALUES ($1, $2, $3, $4, $5, $6, $7)",
+        request_type, channel_id, user_name, provider, input_tokens, output_tokens, latency_ms,
+    )
+
+
+# --- Channel Prompt helpers ---
+
+async def set_channel_prompt(channel_id: str, guild_id: str, system_prompt: str):
+    """Set a custom system prompt for a channel."""
+    async with (await get_pool()).acquire() as conn:
+        await conn.execute(
+            "INSERT INTO channel_prompts (channel_id, guild_id, system_prompt) VALUES ($1, $2, $3) ON CONFLICT (channel_id) DO UPDATE SET system_prompt = EXCLUDED.system_prompt",
+            channel_id, guild_id, system_prompt,
+        )
+        await _announce_settings_change(conn, "channel_prompts", lambda data: data.update({channel_id: system_prompt}))
+
+async def get_channel_prompt(channel_id: str) -> str | None:
+    """Get the custom system prompt for a channel."""
+    return (await _settings_table("channel_prompts")).get(channel_id)
+
+async def delete_channel_prompt(channel_id: str):
+    """Delete the custom system prompt for a channel."""
+    async with (await get_pool()).acquire() as conn:
+        await conn.execute("DELETE FROM channel_prompts WHERE channel_id = $1", channel_id)
+        await _announce_settings_change(conn, "channel_prompts", lambda data: data.pop(channel_id, None))
+
+async def get_all_channel_prompts(guild_id: str | None = None) -> list[dict]:
+    """Get all custom system prompts for a guild, or all prompts if guild_id is None."""
+    pool = await get_pool()
+    if guild_id:
+        rows = await pool.fetch("SELECT channel_id, guild_id, system_prompt FROM channel_prompts WHERE guild_id = $1", guild_id)
+    else:
+        rows = await pool.fetch("SELECT channel_id, guild_id, system_prompt FROM channel_prompts")
+    return [dict(row) for row in rows]
+
+
+# --- Channel Provider helpers ---
+
+async def set_channel_provider(channel_id: str, guild_id: str, provider_name: str):
+    """Set a custom AI provider for a channel."""
+    async with (await get_pool()).acquire() as conn:
+        await conn.execute(
+            "INSERT INTO channel_providers (channel_id, guild_id, provider_name) VALUES ($1, $2, $3) ON CONFLICT (channel_id) DO UPDATE SET provider_name = EXCLUDED.provider_name",
+            channel_id, guild_id, provider_name,
+        )
+        await _announce_settings_change(conn, "channel_providers", lambda data: data.update({channel_id: provider_name}))
+
+async def get_channel_provider(channel_id: str) -> str | None:
+    """Get the custom AI provider for a channel."""
+    return (await _settings_table("channel_providers")).get(channel_id)
+
+async def delete_channel_provider(channel_id: str):
+    """Delete the custom AI provider for a channel."""
+    async with (await get_pool()).acquire() as conn:
+        await conn.execute("DELETE FROM channel_providers WHERE channel_id = $1", channel_id)
+        await _announce_settings_change(conn, "channel_providers", lambda data: data.pop(channel_id, None))
+
+async def get_all_channel_providers(guild_id: str | None = None) -> list[dict]:
+    """Get all custom AI providers for a guild, or all providers if guild_id is None."""
+    pool = await get_pool()
+    if guild_id:
+        rows = await pool.fetch("SELECT channel_id, guild_id, provider_name FROM channel_providers WHERE guild_id = $1", guild_id)
+    else:
+        rows = await pool.fetch("SELECT channel_id, guild_id, provider_name FROM channel_providers")
+    return [dict(row) for row in rows]
+
+
+# --- Retention / archive helpers ---
+
+async def set_retention_policy(scope: str, target_id: str, max_age_days: int, max_messages: int):
+    """Set the retention policy for a guild or channel (0 = no limit)."""
+    await (await get_pool()).execute(
+        "INSERT INTO retention_policies (scope, target_id, max_age_days, max_messages) VALUES ($1, $2, $3, $4) "
+        "ON CONFLICT (scope, target_id) DO UPDATE SET max_age_days = EXCLUDED.max_age_days, max_messages = EXCLUDED.max_messages",
+        scope, target_id, max_age_days, max_messages,
+    )
+
+async def delete_retention_policy(scope: str, target_id: str) -> bool:
+    """Remove a guild or channel retention policy. Returns False if there was none."""
+    status = await (await get_pool()).execute(
+        "DELETE FROM retention_policies WHERE scope = $1 AND target_id = $2",
+        scope, target_id,
+    )
+    return _rowcount(status) > 0
+
+async def get_retention_policies() -> list[dict]:
+    """Return all guild and channel retention policies."""
+    rows = await (await get_pool()).fetch("SELECT scope, target_id, max_age_days, max_messages FROM retention_policies")
+    return [dict(row) for row in rows]
+
+async def get_archive_cutoff_id(channel_id: str, max_age_days: int = 0, max_messages: int = 0) -> int | None:
+    """Return the highest conversation id in a channel that falls outside retention, or None."""
+    pool = await get_pool()
+    cutoff = None
+    if max_messages > 0:
+        cutoff = await pool.fetchval(
+            "SELECT id FROM conversations WHERE channel_id = $1 ORDER BY id DESC LIMIT 1 OFFSET $2",
+            channel_id, max_messages,
+        )
+    if max_age_days > 0:
+        aged = await pool.fetchval(
+            "SELECT MAX(id) FROM conversations WHERE channel_id = $1 "
+            "AND created_at < to_char(now() AT TIME ZONE 'utc' - make_interval(days => $2), 'YYYY-MM-DD HH24:MI:SS')",
+            channel_id, int(max_age_days),
+        )
+        if aged is not None:
+            cutoff = max(cutoff or 0, aged)
+    return cutoff
+
+async def archive_messages(channel_id: str, up_to_id: int, batch_size: int = 500) -> int:
+    """Move the oldest batch of a channel's messages with id <= up_to_id into the archive.
+
+    One short transaction per call; returns the number of rows moved (0 when done).
+    """
+    async with (await get_pool()).acquire() as conn:
+        async with conn.transaction():
+            # Another instance archiving the same channel waits here, then moves the next batch
+            await conn.execute("SELECT pg_advisory_xact_lock(hashtext('sparksage_archive:' || $1))", channel_id)
+            rows = await conn.fetch(
+                "SELECT id, role, author_name, content, provider, type, token_count, created_at FROM conversations "
+                "WHERE channel_id = $1 AND id <= $2 ORDER BY id LIMIT $3",
+                channel_id, up_to_id, batch_size,
+            )
+            rows = [dict(row) for row in rows]
+            if not rows:
+                return 0
+
+            data = zlib.compress(json.dumps(rows, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+            first, last = rows[0], rows[-1]
+            await conn.execute(
+                "INSERT INTO conversation_archive (channel_id, first_id, last_id, first_at, last_at, message_count, data) VALUES ($1, $2, $3, $4, $5, $6, $7)",
+                channel_id, first["id"], last["id"], first["created_at"], last["created_at"], len(rows), data,
+            )
+            await conn.execute(
+                "DELETE FROM conversations WHERE channel_id = $1 AND id BETWEEN $2 AND $3",
+                channel_id, first["id"], last["id"],
+            )
+    return len(rows)
+
+async def get_archived_messages(channel_id: str, before_id: int | None = None, limit: int = 100) -> list[dict]:
+    """Return up to `limit` archived messages older than before_id, oldest first."""
+    if limit <= 0:
+        return []
+    # Every archive row holds at least one message, so `limit` rows always suffice
+    rows = await (await get_pool()).fetch(
+        "SELECT data FROM conversation_archive WHERE channel_id = $1 AND first_id < $2 ORDER BY last_id DESC LIMIT $3",
+        channel_id, before_id if before_id is not None else 2**63 - 1, limit,
+    )
+    messages: list[dict] = []
+    for row in rows:
+        if len(messages) >= limit:
+            break
+        batch = json.loads(zlib.decompress(row["data"]))
+        if before_id is not None:
+            batch = [m for m in batch if m["id"] < before_id]
+        messages[:0] = batch
+    return messages[-limit:]
+
+
+# --- Response cache helpers ---
+
+async def get_cached_response(key: str) -> dict | None:
+    """Get an unexpired cached AI response by key."""
+    row = await (await get_pool()).fetchrow(
+        f"SELECT provider, response FROM response_cache WHERE key = $1 AND expires_at > {NOW}",
+        key,
+    )
+    return dict(row) if row else None
+
+async def set_cached_response(key: str, provider: str, response: str, ttl_seconds: int):
+    """Store an AI response in the cache for ttl_seconds."""
+    await (await get_pool()).execute(
+        "INSERT INTO response_cache (key, provider, response, expires_at) "
+        "VALUES ($1, $2, $3, to_char(now() AT TIME ZONE 'utc' + make_interval(secs => $4), 'YYYY-MM-DD HH24:MI:SS')) "
+        "ON CONFLICT (key) DO UPDATE SET provider = EXCLUDED.provider, response = EXCLUDED.response, "
+        "created_at = EXCLUDED.created_at, expires_at = EXCLUDED.expires_at",
+        key, provider, response, float(ttl_seconds),
+    )
+
+async def purge_expired_responses() -> int:
+    """Delete expired cache entries. Returns the number of rows removed."""
+    status = await (await get_pool()).execute(f"DELETE FROM response_cache WHERE expires_at <= {NOW}")
+    return _rowcount(status)
+
+
+# --- Export / import helpers ---
+
+async def iter_table_rows(table: str, batch_size: int = 1000) -> AsyncIterator[dict]:
+    """Yield every row of an EXPORT_TABLES table in key order, one keyset page at a time."""
+    key, columns = EXPORT_TABLES[table]
+    pool = await get_pool()
+    after = None
+    while True:
+        where = f"WHERE ({', '.join(key)}) > ({', '.join(f'${i}' for i in range(1, len(key) + 1))}) " if after else ""
+        rows = await pool.fetch(
+            f"SELECT {', '.join(columns)} FROM {table} {where}ORDER BY {', '.join(key)} LIMIT ${len(after or ()) + 1}",
+            *(after or ()), batch_size,
+        )
+        rows = [dict(row) for row in rows]
+        for row in rows:
+            yield row
+        if len(rows) < batch_size:
+            return
+        after = tuple(rows[-1][column] for column in key)
+
+
+def _placeholders(count: int) -> str:
+    return ", ".join(f"${i}" for i in range(1, count + 1))
+
+
+async def _import_batch(conn: asyncpg.Connection, source: str, batch: list[tuple[str, dict]], counts: dict):
+    async with conn.transaction():
+        for table, group in groupby(batch, key=lambda record: record[0]):
+            key, columns = EXPORT_TABLES[table]
+            rows = [row for _, row in group]
+            stats = counts.setdefault(table, {"imported": 0, "skipped": 0})
+
+            if key == ("id",):
+                loaded = {
+                    record["old_id"] for record in await conn.fetch(
+                        "SELECT old_id FROM import_id_map WHERE source = $1 AND table_name = $2 AND old_id = ANY($3::bigint[])",
+                        source, table, [row["id"] for row in rows],
+                    )
+                }
+                fresh = []
+                for row in rows:
+                    if row["id"] not in loaded:
+                        loaded.add(row["id"])
+                        fresh.append(row)
+                stats["skipped"] += len(rows) - len(fresh)
+                if not fresh:
+                    continue
+
+                new_ids = [
+                    record[0] for record in await conn.fetch(
+                        "SELECT nextval(pg_get_serial_sequence($1, 'id')) FROM generate_series(1, $2)",
+                        table, len(fresh),
+                    )
+                ]
+                await conn.executemany(
+                    f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({_placeholders(len(columns))})",
+                    [(new_id, *(row.get(column) for column in columns[1:])) for new_id, row in zip(new_ids, fresh)],
+                )
+                await conn.executemany(
+                    "INSERT INTO import_id_map (source, table_name, old_id, new_id) VALUES ($1, $2, $3, $4)",
+                    [(source, table, row["id"], new_id) for new_id, row in zip(new_ids, fresh)],
+                )
+                stats["imported"] += len(fresh)
+            else:
+                values = [column for column in columns if column not in key]
+                action = f"UPDATE SET {', '.join(f'{c} = EXCLUDED.{c}' for c in values)}" if values else "NOTHING"
+                await conn.executemany(
+                    f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({_placeholders(len(columns))}) "
+                    f"ON CONFLICT ({', '.join(key)}) DO {action}",
+                    [tuple(row.get(column) for column in columns) for row in rows],
+                )
+                stats["imported"] += len(rows)
+
+
+async def import_records(source: str, records: AsyncIterator[tuple[str, dict]], batch_size: int = 500) -> dict[str, dict[str, int]]:
+    """Load exported (table, row) records, batch_size rows per transaction (see db.import_records)."""
+    counts: dict[str, dict[str, int]] = {}
+    async with (await get_pool()).acquire() as conn:
+        try:
+            batch: list[tuple[str, dict]] = []
+            async for table, row in records:
+                if table not in EXPORT_TABLES:
+                    raise ValueError(f"unknown table in import: {table}")
+                batch.append((table, row))
+                if len(batch) >= batch_size:
+                    await _import_batch(conn, source, batch, counts)
+                    batch = []
+                    await asyncio.sleep(IMPORT_PAUSE_MS / 1000)
+            if batch:
+                await _import_batch(conn, source, batch, counts)
+        finally:
+            for table in counts:
+                if table in _SETTINGS_QUERIES:
+                    await _announce_settings_change(conn, table)
+    return counts
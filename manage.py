@@ -0,0 +1,90 @@
+"""Maintenance commands for the SparkSage database.
+
+    python manage.py rebuild-stats    # recompute channel_stats from conversations
+    python manage.py rebuild-search   # rebuild the conversations_fts full-text index
+    python manage.py export FILE      # write conversations, FAQs and settings as gzip NDJSON
+    python manage.py import FILE      # load an export (rerunning the same file is a no-op)
+"""
+
+import argparse
+import asyncio
+import sys
+
+import config  # noqa: F401  (loads .env so DATABASE_PATH is set before db is imported)
+import db
+from storage import EXPORT_TABLES
+from utils import backup
+
+
+async def _rebuild_stats():
+    await db.init_db()
+    try:
+        channels = await db.rebuild_channel_stats()
+        print(f"Rebuilt stats for {channels} channel(s)")
+    finally:
+        await db.close_db()
+
+
+async def _rebuild_search():
+    await db.init_db()
+    try:
+        await db.rebuild_search_index()
+        print("Rebuilt the conversation search index")
+    finally:
+        await db.close_db()
+
+
+async def _export(path: str, tables: list[str] | None):
+    await db.init_db()
+    try:
+        out = sys.stdout.buffer if path == "-" else open(path, "wb")
+        try:
+            async for chunk in backup.export_gzip(tables):
+                out.write(chunk)
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+    finally:
+        await db.close_db()
+
+
+async def _import(path: str, batch_size: int):
+    async def chunks():
+        with (sys.stdin.buffer if path == "-" else open(path, "rb")) as f:
+            while chunk := f.read(backup.CHUNK_BYTES):
+                yield chunk
+
+    await db.init_db()
+    try:
+        result = await backup.import_lines(backup.read_lines(chunks()), batch_size)
+    finally:
+        await db.close_db()
+    for table, counts in result["tables"].items():
+        print(f"{table}: {counts['imported']} imported, {counts['skipped']} already present")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SparkSage maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("rebuild-stats", help="Recompute per-channel statistics from conversation history")
+    commands.add_parser("rebuild-search", help="Rebuild the full-text search index over conversation history")
+    export_parser = commands.add_parser("export", help="Export conversations, FAQs and settings as gzip NDJSON")
+    export_parser.add_argument("file", help="Output file, or - for stdout")
+    export_parser.add_argument("--tables", nargs="+", choices=list(EXPORT_TABLES), help="Only export these tables")
+    import_parser = commands.add_parser("import", help="Import an export file")
+    import_parser.add_argument("file", help="Export file (gzip or plain NDJSON), or - for stdin")
+    import_parser.add_argument("--batch-size", type=int, default=500, help="Rows per transaction (default: 500)")
+    args = parser.parse_args()
+
+    if args.command == "rebuild-stats":
+        asyncio.run(_rebuild_stats())
+    elif args.command == "rebuild-search":
+        asyncio.run(_rebuild_search())
+    elif args.command == "export":
+        asyncio.run(_export(args.file, args.tables))
+    elif args.command == "import":
+        asyncio.run(_import(args.file, args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,53 @@
 from __future__ import annotations
 
+import asyncio
+import importlib.util
 import time
-from openai import OpenAI
+from collections.abc import AsyncIterator, Awaitable, Callable
+from typing import TypeVar
+import httpx
+from openai import AsyncOpenAI
 import config
+from utils.provider_health import tracker as health
+from utils.response_cache import cache as response_cache, make_key as make_cache_key
+from utils.scheduler import QueueTimeout, Ticket, scheduler
+from utils.singleflight import make_key as make_flight_key, singleflight
+from utils.tokens import MESSAGE_OVERHEAD, count_tokens
 import discord
 from discord import app_commands
 
+T = TypeVar("T")
 
-def _create_client(provider_name: str) -> OpenAI | None:
-    """Create an OpenAI-compatible client for the given provider."""
+
+def _create_http_client() -> httpx.AsyncClient:
+    """Create the pooled HTTP transport shared by all provider clients.
+
+    HTTP/2 is used when enabled and the optional h2 package is installed. Pool
+    and timeout settings are read once, at startup.
+    """
+    http2 = config.HTTP2_ENABLED and importlib.util.find_spec("h2") is not None
+    return httpx.AsyncClient(
+        http2=http2,
+        follow_redirects=True,
+        limits=httpx.Limits(
+            max_connections=config.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=config.HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(config.HTTP_READ_TIMEOUT, connect=config.HTTP_CONNECT_TIMEOUT),
+    )
+
+
+# One connection pool for every provider; it outlives reload_clients()
+_http_client = _create_http_client()
+
+
+def _create_client(provider_name: str, shared: bool = True) -> AsyncOpenAI | None:
+    """Create an async OpenAI-compatible client for the given provider.
+
+    Shared clients ride on the pooled _http_client; pass shared=False for a
+    client with its own connections (it must be closed by the caller).
+    """
     provider = config.PROVIDERS.get(provider_name)
     if not provider or not provider["api_key"]:
         return None
@@ -17,10 +56,14 @@ def _create_client(provider_name: str) -> OpenAI | None:
     if provider_name == "anthropic":
         extra_headers["anthropic-version"] = "2023-06-01"
 
-    return OpenAI(
+    return AsyncOpenAI(
         base_url=provider["base_url"],
         api_key=provider["api_key"],
         default_headers=extra_headers or None,
+        http_client=_http_client if shared else None,
+        # _race() and the health tracker handle 429/5xx: falling back (and
+        # counting the failure) beats the SDK retrying the same provider
+        max_retries=0,
     )
 
 
@@ -34,7 +77,7 @@ def _build_fallback_order() -> list[str]:
     return order
 
 
-def _build_clients() -> dict[str, OpenAI]:
+def _build_clients() -> dict[str, AsyncOpenAI]:
     """Build clients for all configured providers."""
     clients = {}
     for name in set([config.AI_PROVIDER] + config.FREE_FALLBACK_CHAIN + list(config.PROVIDERS.keys())):
@@ -45,17 +88,33 @@ def _build_clients() -> dict[str, OpenAI]:
 
 
 # Pre-build clients for all configured providers
-_clients: dict[str, OpenAI] = _build_clients()
+_clients: dict[str, AsyncOpenAI] = _build_clients()
 FALLBACK_ORDER = _build_fallback_order()
 
 
 def reload_clients():
-    """Rebuild all clients and fallback order from current config."""
+    """Rebuild all clients and fallback order from current config.
+
+    The rebuilt clients keep using the shared HTTP transport, so pooled
+    connections survive a config save.
+    """
     global _clients, FALLBACK_ORDER
     _clients = _build_clients()
     FALLBACK_ORDER = _build_fallback_order()
 
 
+async def warm_up():
+    """Open pooled connections to every configured provider ahead of the first request."""
+
+    async def connect(name: str):
+        try:
+            await _http_client.head(config.PROVIDERS[name]["base_url"], timeout=config.HTTP_CONNECT_TIMEOUT)
+        except Exception as e:
+            print(f"Warm-up: could not reach {config.PROVIDERS[name]['name']}: {e}")
+
+    await asyncio.gather(*(connect(name) for name in _clients))
+
+
 def get_available_providers() -> list[str]:
     """Return list of provider names that have valid API keys configured."""
     return [name for name in FALLBACK_ORDER if name in _clients]
@@ -69,26 +128,26 @@ async def provider_autocomplete(interaction: discord.Interaction, current: str)
     return choices
 
 
-def test_provider(name: str) -> dict:
+async def test_provider(name: str) -> dict:
     """Test a provider with a minimal API call. Returns {success, latency_ms, error}."""
     provider = config.PROVIDERS.get(name)
     if not provider:
         return {"success": False, "latency_ms": 0, "error": f"Unknown provider: {name}"}
 
-    client = _clients.get(name)
+    # Always use a short-lived client: this is called from the dashboard's event
+    # loop, and the shared clients' connection pools belong to the bot's loop.
+    client = _create_client(name, shared=False)
     if not client:
-        # Try creating a fresh client in case config was just updated
-        client = _create_client(name)
-        if not client:
-            return {"success": False, "latency_ms": 0, "error": "No API key configured"}
+        return {"success": False, "latency_ms": 0, "error": "No API key configured"}
 
+    start = time.time()
     try:
-        start = time.time()
-        response = client.chat.completions.create(
-            model=provider["model"],
-            max_tokens=10,
-            messages=[{"role": "user", "content": "Hi"}],
-        )
+        async with client:
+            await client.chat.completions.create(
+                model=provider["model"],
+                max_tokens=10,
+                messages=[{"role": "user", "content": "Hi"}],
+            )
         latency = int((time.time() - start) * 1000)
         return {"success": True, "latency_ms": latency, "error": None}
     except Exception as e:
@@ -96,44 +155,287 @@ def test_provider(name: str) -> dict:
         return {"success": False, "latency_ms": latency, "error": str(e)}
 
 
-def chat(messages: list[dict], system_prompt: str, primary_provider: str | None = None) -> tuple[str, str]:
-    """Send messages to AI and return (response_text, provider_name).
-
-    Tries the primary_provider first if specified, then falls back through configured providers.
-    Raises RuntimeError if all providers fail.
-    """
-    errors = []
-    
-    # Determine the order of providers to try
+def _providers_to_try(primary_provider: str | None = None) -> list[str]:
+    """Return the configured provider names to try, in health-adjusted order, for a single request."""
     providers_to_try = []
     if primary_provider and primary_provider in _clients:
         providers_to_try.append(primary_provider)
-    
+
     for p_name in FALLBACK_ORDER:
-        if p_name not in providers_to_try:
+        if p_name not in providers_to_try and p_name in _clients:
             providers_to_try.append(p_name)
+    return health.order(providers_to_try, pinned=primary_provider)
 
-    for provider_name in providers_to_try:
-        client = _clients.get(provider_name)
-        if not client:
-            continue
 
-        provider = config.PROVIDERS[provider_name]
+def get_live_order() -> list[str]:
+    """Return the fallback chain in the order requests are currently routed."""
+    return health.order(get_available_providers())
+
+
+def get_health() -> dict[str, dict]:
+    """Return live health stats for every configured provider."""
+    return health.snapshot(get_available_providers())
+
+
+# --- Hedging ---
+
+
+def _hedge_delay(provider_name: str, streaming: bool = False) -> float:
+    """Seconds to wait on a provider before hedging to the next one.
+
+    Uses the HEDGE_PERCENTILE of the provider's recent latencies once enough
+    samples exist, otherwise the static HEDGE_DELAY_MS.
+    """
+    provider_health = health.get(provider_name)
+    if provider_health.sample_count(streaming) < config.HEDGE_MIN_SAMPLES:
+        return config.HEDGE_DELAY_MS / 1000
+    return provider_health.latency(config.HEDGE_PERCENTILE, streaming)
+
+
+def _should_hedge(request_type: str) -> bool:
+    return config.HEDGE_ENABLED and request_type in config.HEDGE_REQUEST_TYPES
+
+
+async def _race(
+    candidates: list[str],
+    attempt: Callable[[str], Awaitable[T]],
+    request_type: str,
+    tokens: int,
+    streaming: bool = False,
+    discard: Callable[[T], Awaitable[None]] | None = None,
+) -> tuple[T, str, Ticket]:
+    """Run attempt() against candidates in fallback order and return (result, provider_name, ticket).
+
+    Each attempt first waits for a scheduler slot on its provider (see
+    utils.scheduler). A failure, or a queue wait over SCHEDULER_MAX_WAIT,
+    immediately moves on to the next candidate. For request types listed in
+    HEDGE_REQUEST_TYPES, if the in-flight provider hasn't answered within its
+    hedge delay the next candidate is started in parallel (at most one hedge per
+    request); the first success wins and the loser is cancelled. Raises
+    RuntimeError if every candidate fails.
+
+    The winner's scheduler ticket is released before returning unless
+    streaming, in which case the caller must release it when the stream ends.
+    """
+    errors = []
+    remaining = list(candidates)
+    pending: dict[asyncio.Task, tuple[str, float]] = {}
+    hedge = _should_hedge(request_type)
+    hedged = False
+    # When every circuit is open, try them anyway rather than failing outright
+    skip_tripped = any(health.get(name).available() for name in candidates)
+
+    async def run(name: str):
+        ticket = await scheduler.acquire(name, request_type, tokens)
         try:
-            response = client.chat.completions.create(
-                model=provider["model"],
-                max_tokens=config.MAX_TOKENS,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    *messages,
-                ],
-            )
-            text = response.choices[0].message.content
-            return text, provider_name
+            started = time.monotonic()
+            result = await attempt(name)
+            return result, time.monotonic() - started, ticket
+        except BaseException:
+            ticket.release()
+            raise
 
-        except Exception as e:
-            errors.append(f"{provider['name']}: {e}")
-            continue
+    def launch() -> bool:
+        while remaining:
+            name = remaining.pop(0)
+            provider_health = health.get(name)
+            # The circuit may have tripped since the order was computed
+            if skip_tripped and not provider_health.available():
+                errors.append(f"{config.PROVIDERS[name]['name']}: circuit open")
+                continue
+            provider_health.begin()
+            pending[asyncio.ensure_future(run(name))] = (name, time.monotonic())
+            return True
+        return False
+
+    launch()
+    try:
+        while pending:
+            timeout = None
+            if hedge and not hedged and remaining and len(pending) == 1:
+                name, started = next(iter(pending.values()))
+                timeout = max(0.0, _hedge_delay(name, streaming) - (time.monotonic() - started))
+
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                hedged = launch()
+                continue
+
+            winner = None
+            for task in done:
+                name, _ = pending.pop(task)
+                error = task.exception()
+                if isinstance(error, QueueTimeout):
+                    # Not the provider's fault; don't count it against its health
+                    health.get(name).release()
+                    errors.append(f"{config.PROVIDERS[name]['name']}: {error}")
+                    continue
+                if error is not None:
+                    health.get(name).record_failure(error)
+                    errors.append(f"{config.PROVIDERS[name]['name']}: {error}")
+                    continue
+                result, elapsed, ticket = task.result()
+                health.get(name).record_success(elapsed, streaming)
+                if winner is None:
+                    winner = (result, name, ticket)
+                    if not streaming:
+                        ticket.release()
+                    continue
+                if discard is not None:
+                    await discard(result)
+                ticket.release()
+            if winner is not None:
+                return winner
+            if not pending:
+                launch()
+    finally:
+        for task, (name, _) in pending.items():
+            task.cancel()
+            health.get(name).release()
 
     error_details = "\n".join(errors)
     raise RuntimeError(f"All providers failed:\n{error_details}")
+
+
+def _estimate_tokens(system_prompt: str, messages: list[dict]) -> int:
+    """Prompt tokens plus the MAX_TOKENS reply, for the scheduler's tokens-per-minute buckets."""
+    prompt = count_tokens(system_prompt) + sum(count_tokens(m["content"]) + MESSAGE_OVERHEAD for m in messages)
+    return prompt + config.MAX_TOKENS
+
+
+# --- Chat ---
+
+
+def _cache_key(provider_name: str, system_prompt: str, messages: list[dict]) -> str:
+    provider = config.PROVIDERS[provider_name]
+    return make_cache_key(provider_name, provider["model"], system_prompt, messages, config.MAX_TOKENS)
+
+
+def get_cache_stats() -> dict:
+    """Return response cache hit/miss counters."""
+    return response_cache.snapshot()
+
+
+def get_scheduler_stats() -> dict[str, dict]:
+    """Return per-provider in-flight counts, queue depth and queue wait times."""
+    return scheduler.snapshot()
+
+
+def get_singleflight_stats() -> dict:
+    """Return how many chat() calls went upstream vs. shared an in-flight call."""
+    return singleflight.snapshot()
+
+
+async def chat(messages: list[dict], system_prompt: str, primary_provider: str | None = None, request_type: str = "chat") -> tuple[str, str]:
+    """Send messages to AI and return (response_text, provider_name).
+
+    Tries the primary_provider first if specified, then falls back through configured providers.
+    request_type sets the scheduling priority, and whether the request is hedged
+    or cached (see _race() and utils.response_cache). Concurrent identical
+    requests share a single upstream call when SINGLEFLIGHT_ENABLED. The key
+    covers the full message list, so SparkSageBot.ask_ai() calls (whose
+    history ends with each caller's own stored message) are effectively never
+    merged; the stateless ask_once() paths (moderation, translation, code
+    review) are the ones that coalesce.
+    Raises RuntimeError if all providers fail.
+    """
+    if not config.SINGLEFLIGHT_ENABLED:
+        return await _chat(messages, system_prompt, primary_provider, request_type)
+
+    key = make_flight_key(primary_provider, request_type, system_prompt, messages, config.MAX_TOKENS)
+    return await singleflight.do(key, lambda: _chat(messages, system_prompt, primary_provider, request_type))
+
+
+async def _chat(messages: list[dict], system_prompt: str, primary_provider: str | None, request_type: str) -> tuple[str, str]:
+
+    async def attempt(provider_name: str) -> str:
+        provider = config.PROVIDERS[provider_name]
+        response = await _clients[provider_name].chat.completions.create(
+            model=provider["model"],
+            max_tokens=config.MAX_TOKENS,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                *messages,
+            ],
+        )
+        return response.choices[0].message.content
+
+    candidates = _providers_to_try(primary_provider)
+    tokens = _estimate_tokens(system_prompt, messages)
+    if not response_cache.enabled_for(request_type):
+        text, provider_name, _ = await _race(candidates, attempt, request_type, tokens)
+        return text, provider_name
+
+    keys = {name: _cache_key(name, system_prompt, messages) for name in candidates}
+    cached = await response_cache.get(list(keys.values()), request_type)
+    if cached:
+        return cached
+    text, provider_name, _ = await _race(candidates, attempt, request_type, tokens)
+    await response_cache.set(keys[provider_name], provider_name, text)
+    return text, provider_name
+
+
+async def chat_stream(
+    messages: list[dict], system_prompt: str, primary_provider: str | None = None, request_type: str = "chat"
+) -> AsyncIterator[tuple[str, str]]:
+    """Stream a response from AI, yielding (text_delta, provider_name) as tokens arrive.
+
+    Falls back (and hedges) like chat(), racing on time-to-first-token. Once output
+    has been yielded a mid-stream failure is raised as a RuntimeError, since the
+    caller may already have shown the partial text.
+    """
+
+    async def attempt(provider_name: str):
+        provider = config.PROVIDERS[provider_name]
+        stream = await _clients[provider_name].chat.completions.create(
+            model=provider["model"],
+            max_tokens=config.MAX_TOKENS,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                *messages,
+            ],
+            stream=True,
+        )
+        chunks = stream.__aiter__()
+        try:
+            async for chunk in chunks:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    return stream, chunks, delta
+        except BaseException:
+            await stream.close()
+            raise
+        await stream.close()
+        raise RuntimeError("empty response")
+
+    async def discard(result):
+        await result[0].close()
+
+    candidates = _providers_to_try(primary_provider)
+    use_cache = response_cache.enabled_for(request_type)
+    if use_cache:
+        keys = {name: _cache_key(name, system_prompt, messages) for name in candidates}
+        cached = await response_cache.get(list(keys.values()), request_type)
+        if cached:
+            yield cached
+            return
+
+    (stream, chunks, first), provider_name, ticket = await _race(
+        candidates, attempt, request_type, _estimate_tokens(system_prompt, messages), streaming=True, discard=discard
+    )
+    parts = [first]
+    try:
+        yield first, provider_name
+        async for chunk in chunks:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                parts.append(delta)
+                yield delta, provider_name
+        if use_cache:
+            await response_cache.set(keys[provider_name], provider_name, "".join(parts))
+    except Exception as e:
+        health.get(provider_name).record_failure(e)
+        raise RuntimeError(f"{config.PROVIDERS[provider_name]['name']} stream interrupted: {e}") from e
+    finally:
+        ticket.release()
+        await stream.close()
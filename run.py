@@ -20,6 +20,8 @@ async def _init_database():
     import db
     await db.init_db()
     await db.sync_env_to_db()
+    # Connections are per event loop; this one ends when asyncio.run() returns
+    await db.close_db()
 
 
 def main():
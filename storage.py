@@ -0,0 +1,108 @@
+"""The storage interface shared by the SQLite (db.py) and PostgreSQL (db_postgres.py) backends.
+
+Callers always `import db`. When DATABASE_URL is a postgresql:// URL, db.py
+replaces its helpers with db_postgres's, so every name below resolves to the
+configured backend. Backends are plain modules and satisfy Storage
+structurally; tests/test_storage.py checks both against it and runs the same
+behaviour tests on each.
+"""
+
+from __future__ import annotations
+
+import datetime
+from collections.abc import AsyncIterator
+from typing import Protocol
+
+# Tables covered by export / import: table -> (key columns, exported columns).
+# Rows of tables keyed by "id" get new ids on import, recorded in import_id_map;
+# the rest are upserted on their natural key.
+EXPORT_TABLES: dict[str, tuple[tuple[str, ...], tuple[str, ...]]] = {
+    "conversations": (("id",), ("id", "channel_id", "guild_id", "role", "author_name", "content", "provider", "type", "token_count", "created_at")),
+    "faqs": (("id",), ("id", "guild_id", "question", "answer", "match_keywords", "times_used", "created_by", "created_at")),
+    "command_permissions": (("command_name", "guild_id", "role_id"), ("command_name", "guild_id", "role_id")),
+    "channel_prompts": (("channel_id",), ("channel_id", "guild_id", "system_prompt")),
+    "channel_providers": (("channel_id",), ("channel_id", "guild_id", "provider_name")),
+    "moderation_logs": (("id",), ("id", "guild_id", "channel_id", "message_id", "author_id", "reason", "severity", "created_at")),
+}
+
+
+class Storage(Protocol):
+    # --- Lifecycle ---
+    async def init_db(self) -> None: ...
+    async def close_db(self) -> None: ...
+    async def flush_writes(self) -> None: ...
+    def get_write_stats(self) -> dict: ...
+    def get_settings_cache_stats(self) -> dict: ...
+
+    # --- Config ---
+    async def get_config(self, key: str, default: str | None = None) -> str | None: ...
+    async def get_all_config(self) -> dict[str, str]: ...
+    async def set_config(self, key: str, value: str) -> None: ...
+    async def set_config_bulk(self, data: dict[str, str]) -> None: ...
+    async def sync_env_to_db(self) -> None: ...
+
+    # --- Conversations ---
+    async def add_message(self, channel_id: str, role: str, author_name: str | None, content: str, provider: str | None = None, type: str | None = None, guild_id: str | None = None) -> None: ...
+    async def get_messages(self, channel_id: str, limit: int = 20, before_id: int | None = None, after_id: int | None = None) -> list[dict]: ...
+    def iter_messages(self, channel_id: str, after_id: int = 0, batch_size: int = 1000) -> AsyncIterator[dict]: ...
+    async def set_token_counts(self, counts: list[tuple[int, int]]) -> None: ...
+    async def get_messages_since(self, channel_id: str, since_datetime: datetime.datetime) -> list[dict]: ...
+    async def clear_messages(self, channel_id: str) -> None: ...
+    async def list_channels(self) -> list[dict]: ...
+    async def rebuild_channel_stats(self) -> int: ...
+    async def search_messages(self, query: str, channel_id: str | None = None, guild_id: str | None = None, provider: str | None = None, type: str | None = None, since: str | None = None, until: str | None = None, sort: str = "rank", after_score: float | None = None, after_id: int | None = None, limit: int = 20) -> list[dict]: ...
+    async def rebuild_search_index(self) -> None: ...
+
+    # --- Wizard and sessions ---
+    async def get_wizard_state(self) -> dict: ...
+    async def set_wizard_state(self, completed: bool | None = None, current_step: int | None = None, data: dict | None = None) -> None: ...
+    async def create_session(self, token: str, user_id: str, expires_at: str) -> None: ...
+    async def validate_session(self, token: str) -> dict | None: ...
+    async def delete_session(self, token: str) -> None: ...
+
+    # --- FAQs ---
+    async def add_faq(self, guild_id: str, question: str, answer: str, match_keywords: str, created_by: str | None = None) -> int: ...
+    async def get_faqs(self, guild_id: str | None = None) -> list[dict]: ...
+    async def get_faq_by_id(self, faq_id: int) -> dict | None: ...
+    async def delete_faq(self, faq_id: int) -> None: ...
+    async def increment_faq_usage(self, faq_id: int) -> None: ...
+
+    # --- Command permissions ---
+    async def add_command_permission(self, command_name: str, guild_id: str, role_id: str) -> None: ...
+    async def remove_command_permission(self, command_name: str, guild_id: str, role_id: str) -> None: ...
+    async def get_command_permissions(self, command_name: str, guild_id: str) -> list[str]: ...
+    async def get_all_command_permissions(self, guild_id: str | None = None) -> list[dict]: ...
+
+    # --- Moderation ---
+    async def add_moderation_log(self, guild_id: str, channel_id: str, message_id: str, author_id: str, reason: str, severity: str) -> None: ...
+    async def add_blocklist_term(self, guild_id: str, term: str, is_regex: bool = False, created_by: str | None = None) -> bool: ...
+    async def remove_blocklist_term(self, guild_id: str, term: str) -> bool: ...
+    async def get_blocklist(self, guild_id: str) -> list[dict]: ...
+    async def add_audit_log(self, request_type: str, channel_id: str | None, user_name: str | None, provider: str | None, input_tokens: int, output_tokens: int, latency_ms: int) -> None: ...
+
+    # --- Channel prompts and providers ---
+    async def set_channel_prompt(self, channel_id: str, guild_id: str, system_prompt: str) -> None: ...
+    async def get_channel_prompt(self, channel_id: str) -> str | None: ...
+    async def delete_channel_prompt(self, channel_id: str) -> None: ...
+    async def get_all_channel_prompts(self, guild_id: str | None = None) -> list[dict]: ...
+    async def set_channel_provider(self, channel_id: str, guild_id: str, provider_name: str) -> None: ...
+    async def get_channel_provider(self, channel_id: str) -> str | None: ...
+    async def delete_channel_provider(self, channel_id: str) -> None: ...
+    async def get_all_channel_providers(self, guild_id: str | None = None) -> list[dict]: ...
+
+    # --- Retention and archive ---
+    async def set_retention_policy(self, scope: str, target_id: str, max_age_days: int, max_messages: int) -> None: ...
+    async def delete_retention_policy(self, scope: str, target_id: str) -> bool: ...
+    async def get_retention_policies(self) -> list[dict]: ...
+    async def get_archive_cutoff_id(self, channel_id: str, max_age_days: int = 0, max_messages: int = 0) -> int | None: ...
+    async def archive_messages(self, channel_id: str, up_to_id: int, batch_size: int = 500) -> int: ...
+    async def get_archived_messages(self, channel_id: str, before_id: int | None = None, limit: int = 100) -> list[dict]: ...
+
+    # --- Response cache ---
+    async def get_cached_response(self, key: str) -> dict | None: ...
+    async def set_cached_response(self, key: str, provider: str, response: str, ttl_seconds: int) -> None: ...
+    async def purge_expired_responses(self) -> int: ...
+
+    # --- Export / import ---
+    def iter_table_rows(self, table: str, batch_size: int = 1000) -> AsyncIterator[dict]: ...
+    async def import_records(self, source: str, records: AsyncIterator[tuple[str, dict]], batch_size: int = 500) -> dict[str, dict[str, int]]: ...
@@ -0,0 +1,53 @@
+"""utils.backup.read_lines: line splitting and bounded memory on hostile input."""
+
+import asyncio
+import gzip
+import tracemalloc
+import zlib
+
+import pytest
+
+from utils import backup
+
+
+async def chunked(data: bytes, size: int):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def read(data: bytes, size: int = 7) -> list[str]:
+    async def main():
+        return [line async for line in backup.read_lines(chunked(data, size))]
+    return asyncio.run(main())
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_lines_are_split_across_chunk_boundaries(compress):
+    text = "first line\n\nsecond — line\n   \nthird"
+    data = text.encode("utf-8")
+    if compress:
+        data = gzip.compress(data)
+    assert read(data) == ["first line", "second — line", "third"]
+
+
+def gzip_bomb(size: int, fill: bytes) -> bytes:
+    compressor = zlib.compressobj(9, wbits=31)
+    block = fill * (1024 * 1024 // len(fill))
+    parts = [compressor.compress(block) for _ in range(size // len(block))]
+    return b"".join(parts) + compressor.flush()
+
+
+def test_gzip_bomb_with_one_huge_line_is_rejected_in_bounded_memory(monkeypatch):
+    monkeypatch.setattr(backup, "MAX_LINE_BYTES", 1024 * 1024)
+    bomb = gzip_bomb(64 * 1024 * 1024, b"a")
+    assert len(bomb) < 1024 * 1024
+
+    tracemalloc.start()
+    try:
+        with pytest.raises(ValueError, match="line longer than"):
+            read(bomb, size=len(bomb))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < 16 * 1024 * 1024
+
@@ -0,0 +1,99 @@
+"""providers._race: fallback, hedging and loser cancellation with fake providers."""
+
+import asyncio
+import time
+
+import pytest
+
+import config
+import providers
+from utils.provider_health import HealthTracker
+from utils.scheduler import Scheduler
+
+
+@pytest.fixture(autouse=True)
+def fake_providers(monkeypatch):
+    monkeypatch.setattr(config, "PROVIDERS", {name: {"name": name.upper()} for name in ("a", "b", "c")})
+    monkeypatch.setattr(config, "HEDGE_ENABLED", True)
+    monkeypatch.setattr(config, "HEDGE_REQUEST_TYPES", ["chat"])
+    monkeypatch.setattr(config, "HEDGE_DELAY_MS", 50)
+    monkeypatch.setattr(config, "SCHEDULER_MAX_WAIT", 5)
+    monkeypatch.setattr(providers, "health", HealthTracker())
+    monkeypatch.setattr(providers, "scheduler", Scheduler())
+
+
+class FakeProviders:
+    """attempt() for _race: each provider sleeps for its delay, then answers or raises."""
+
+    def __init__(self, **behaviour):
+        self.behaviour = behaviour  # name -> (delay_seconds, error or None)
+        self.started: list[str] = []
+        self.cancelled: list[str] = []
+
+    async def __call__(self, name: str) -> str:
+        self.started.append(name)
+        delay, error = self.behaviour[name]
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled.append(name)
+            raise
+        if error is not None:
+            raise error
+        return f"answer from {name}"
+
+
+def race(fake, request_type="chat", candidates=("a", "b", "c")):
+    async def main():
+        started = time.monotonic()
+        try:
+            result, name, _ = await providers._race(list(candidates), fake, request_type, tokens=10)
+            return result, name, time.monotonic() - started
+        finally:
+            # Let cancelled losers observe their cancellation
+            await asyncio.sleep(0.01)
+            for name in candidates:
+                assert providers.scheduler.gate(name).in_flight == 0, f"{name} still holds a slot"
+    return asyncio.run(main())
+
+
+def test_slow_primary_is_hedged_and_cancelled():
+    fake = FakeProviders(a=(2.0, None), b=(0.01, None), c=(0.01, None))
+    result, name, elapsed = race(fake)
+    assert (result, name) == ("answer from b", "b")
+    assert elapsed < 1.0
+    assert fake.started == ["a", "b"]
+    assert fake.cancelled == ["a"]
+
+
+def test_no_hedge_for_other_request_types():
+    fake = FakeProviders(a=(0.2, None), b=(0.01, None), c=(0.01, None))
+    result, name, _ = race(fake, request_type="digest")
+    assert name == "a"
+    assert fake.started == ["a"]
+
+
+def test_failing_primary_falls_back_without_waiting_for_the_hedge_delay(monkeypatch):
+    monkeypatch.setattr(config, "HEDGE_DELAY_MS", 10_000)
+    fake = FakeProviders(a=(0, RuntimeError("boom")), b=(0.01, None), c=(0.01, None))
+    result, name, elapsed = race(fake)
+    assert name == "b"
+    assert elapsed < 1.0
+    assert fake.started == ["a", "b"]
+
+
+def test_falls_back_after_both_racers_fail():
+    # a is hedged by b; both fail, so the chain moves on to c
+    fake = FakeProviders(a=(0.2, RuntimeError("a down")), b=(0.05, RuntimeError("b down")), c=(0.01, None))
+    result, name, _ = race(fake)
+    assert name == "c"
+    assert fake.started == ["a", "b", "c"]
+    assert fake.cancelled == []
+
+
+def test_raises_when_every_provider_fails():
+    fake = FakeProviders(a=(0, RuntimeError("a down")), b=(0, RuntimeError("b down")), c=(0, RuntimeError("c down")))
+    with pytest.raises(RuntimeError) as excinfo:
+        race(fake)
+    message = str(excinfo.value)
+    assert "A: a down" in message and "B: b down" in message and "C: c down" in message
@@ -0,0 +1,238 @@
+"""utils.moderation: verdict parsing, micro-batching and the overflow policies of the work queue."""
+
+import asyncio
+import gc
+import json
+
+import pytest
+
+import config
+from utils import moderation
+from utils.moderation import ModerationBatcher, ModerationQueue, parse_verdicts
+
+
+def verdict(id=None, flagged=False):
+    item = {"flagged": flagged, "reason": "r", "severity": "low"}
+    if id is not None:
+        item["id"] = id
+    return item
+
+
+def test_verdicts_are_mapped_by_id():
+    response = json.dumps([verdict(3, True), verdict(1), verdict(2)])
+    verdicts = parse_verdicts(response, 3)
+    assert [v["id"] for v in verdicts] == [1, 2, 3]
+    assert verdicts[2]["flagged"] is True
+
+
+def test_verdicts_without_usable_ids_fall_back_to_position():
+    response = json.dumps([verdict(), verdict(99, True), verdict("2")])
+    verdicts = parse_verdicts(response, 3)
+    assert verdicts[0]["flagged"] is False
+    assert verdicts[1]["id"] == 99
+    assert verdicts[2]["id"] == "2"
+
+
+def test_missing_and_duplicate_verdicts():
+    response = json.dumps([verdict(2, True), verdict(2), "junk"])
+    # The first verdict for an id wins; later duplicates are ignored
+    assert parse_verdicts(response, 3) == [None, verdict(2, True), None]
+
+
+def test_code_fences_prose_and_lone_objects():
+    fenced = "```json\n" + json.dumps([verdict(1, True)]) + "\n```"
+    assert parse_verdicts(fenced, 1) == [verdict(1, True)]
+    assert parse_verdicts("Here you go: " + json.dumps([verdict(1)]) + " Thanks!", 1) == [verdict(1)]
+    assert parse_verdicts(json.dumps(verdict(flagged=True)), 1) == [verdict(flagged=True)]
+    with pytest.raises(ValueError):
+        parse_verdicts("I cannot help with that.", 2)
+
+
+class FakeClassifier:
+    def __init__(self):
+        self.batches: list[list[str]] = []
+
+    async def __call__(self, contents):
+        self.batches.append(contents)
+        await asyncio.sleep(0)
+        return [{"flagged": content.startswith("bad"), "content": content} for content in contents]
+
+
+def test_full_batch_flushes_immediately(monkeypatch):
+    monkeypatch.setattr(config, "MODERATION_BATCH_SIZE", 3)
+    monkeypatch.setattr(config, "MODERATION_BATCH_WINDOW_MS", 10_000)
+
+    async def main():
+        classify = FakeClassifier()
+        batcher = ModerationBatcher(classify)
+        contents = ["a", "bad b", "c", "d", "e", "f"]
+        results = await asyncio.wait_for(asyncio.gather(*(batcher.submit(c) for c in contents)), 1)
+        return classify.batches, results, batcher.snapshot()
+
+    batches, results, snapshot = asyncio.run(main())
+    assert batches == [["a", "bad b", "c"], ["d", "e", "f"]]
+    # Every caller gets its own message's verdict
+    assert [r["content"] for r in results] == ["a", "bad b", "c", "d", "e", "f"]
+    assert [r["flagged"] for r in results] == [False, True, False, False, False, False]
+    assert snapshot["batches"] == 2 and snapshot["avg_fill_ratio"] == 1.0 and snapshot["pending"] == 0
+
+
+def test_partial_batch_flushes_after_the_window(monkeypatch):
+    monkeypatch.setattr(config, "MODERATION_BATCH_SIZE", 10)
+    monkeypatch.setattr(config, "MODERATION_BATCH_WINDOW_MS", 50)
+
+    async def main():
+        classify = FakeClassifier()
+        batcher = ModerationBatcher(classify)
+        tasks = [asyncio.ensure_future(batcher.submit(c)) for c in ("a", "b")]
+        await asyncio.sleep(0.01)
+        assert classify.batches == []
+        results = await asyncio.wait_for(asyncio.gather(*tasks), 1)
+        return classify.batches, results
+
+    batches, results = asyncio.run(main())
+    assert batches == [["a", "b"]]
+    assert [r["content"] for r in results] == ["a", "b"]
+
+
+def test_classifier_errors_reach_every_caller(monkeypatch):
+    monkeypatch.setattr(config, "MODERATION_BATCH_SIZE", 2)
+
+    async def fail(contents):
+        raise RuntimeError("provider down")
+
+    async def main():
+        batcher = ModerationBatcher(fail)
+        results = await asyncio.gather(batcher.submit("a"), batcher.submit("b"), return_exceptions=True)
+        return results, batcher.stats["errors"]
+
+    results, errors = asyncio.run(main())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert errors == 1
+
+
+def test_running_batches_survive_garbage_collection(monkeypatch):
+    monkeypatch.setattr(config, "MODERATION_BATCH_SIZE", 1)
+
+    async def main():
+        release = asyncio.Event()
+
+        async def slow(contents):
+            await release.wait()
+            return [{"flagged": False}]
+
+        batcher = ModerationBatcher(slow)
+        task = asyncio.ensure_future(batcher.submit("a"))
+        await asyncio.sleep(0)
+        gc.collect()
+        release.set()
+        return await asyncio.wait_for(task, 1), len(batcher._tasks)
+
+    result, running = asyncio.run(main())
+    assert result == {"flagged": False}
+    assert running == 0
+
+
+def fill_queue(monkeypatch, policy, local_handler=None):
+    """Start a one-slot queue whose single worker is stuck on "busy", then fill the slot."""
+    monkeypatch.setattr(config, "MODERATION_QUEUE_SIZE", 1)
+    monkeypatch.setattr(config, "MODERATION_WORKERS", 1)
+    monkeypatch.setattr(config, "MODERATION_OVERFLOW_POLICY", policy)
+    handled = []
+    release = asyncio.Event()
+
+    async def handler(item):
+        handled.append(item)
+        await release.wait()
+
+    queue = ModerationQueue()
+    queue.start(handler, local_handler)
+    return queue, handled, release
+
+
+def test_overflow_drop(monkeypatch):
+    async def main():
+        queue, handled, release = fill_queue(monkeypatch, "drop")
+        assert queue.offer("busy") == "queued"
+        await asyncio.sleep(0)
+        assert queue.offer("waiting") == "queued"
+        assert queue.offer("overflow") == "dropped"
+        release.set()
+        await asyncio.sleep(0.01)
+        await queue.stop()
+        return handled, queue.stats
+
+    handled, stats = asyncio.run(main())
+    assert handled == ["busy", "waiting"]
+    assert stats["dropped"] == 1 and stats["processed"] == 2
+
+
+def test_overflow_sample_evicts_the_oldest(monkeypatch):
+    monkeypatch.setattr(config, "MODERATION_OVERFLOW_SAMPLE_RATE", 0.5)
+    rolls = iter([0.9, 0.1])
+    monkeypatch.setattr(moderation.random, "random", lambda: next(rolls))
+
+    async def main():
+        queue, handled, release = fill_queue(monkeypatch, "sample")
+        queue.offer("busy")
+        await asyncio.sleep(0)
+        queue.offer("oldest")
+        assert queue.offer("unlucky") == "dropped"
+        assert queue.offer("sampled") == "sampled"
+        release.set()
+        await asyncio.sleep(0.01)
+        await queue.stop()
+        return handled, queue.stats
+
+    handled, stats = asyncio.run(main())
+    assert handled == ["busy", "sampled"]
+    assert stats["sampled"] == 1 and stats["dropped"] == 2
+
+
+def test_overflow_local_only_is_tracked_and_bounded(monkeypatch):
+    async def main():
+        local_release = asyncio.Event()
+        local = []
+
+        async def local_handler(item):
+            local.append(item)
+            await local_release.wait()
+
+        queue, handled, release = fill_queue(monkeypatch, "local_only", local_handler)
+        queue.offer("busy")
+        await asyncio.sleep(0)
+        queue.offer("waiting")
+        assert queue.offer("local 1") == "local_only"
+        # MODERATION_WORKERS (1) local-only checks are already running
+        assert queue.offer("local 2") == "dropped"
+        await asyncio.sleep(0)
+        assert queue.snapshot()["local_in_flight"] == 1
+
+        local_release.set()
+        await asyncio.sleep(0.01)
+        assert queue.snapshot()["local_in_flight"] == 0
+        assert queue.offer("local 3") == "local_only"
+        await asyncio.sleep(0.01)
+        release.set()
+        await asyncio.sleep(0.01)
+        await queue.stop()
+        return handled, local, queue.stats
+
+    handled, local, stats = asyncio.run(main())
+    assert handled == ["busy", "waiting"]
+    assert local == ["local 1", "local 3"]
+    assert stats["local_only"] == 2 and stats["dropped"] == 1 and stats["processed"] == 4
+
+
+def test_overflow_local_only_without_a_local_handler_drops(monkeypatch):
+    async def main():
+        queue, _, release = fill_queue(monkeypatch, "local_only")
+        queue.offer("busy")
+        await asyncio.sleep(0)
+        queue.offer("waiting")
+        result = queue.offer("overflow")
+        release.set()
+        await queue.stop()
+        return result
+
+    assert asyncio.run(main()) == "dropped"
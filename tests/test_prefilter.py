@@ -0,0 +1,58 @@
+"""Band placement of utils.prefilter on a small labeled sample set."""
+
+import asyncio
+
+import pytest
+
+import config
+from utils.prefilter import BANDS, Prefilter
+
+CLEAN = [
+    "hey everyone, good morning!",
+    "can someone help me set up the bot in my server?",
+    "thanks, that fixed it",
+    "what time is the event tonight?",
+    "I think you are right about the config",
+    "free pizza in the break room after the meeting",
+    "lol that meme is great",
+]
+
+ABUSIVE = [
+    "kill yourself",
+    "kys",
+    "go die",
+    "fuck you",
+    "you are an idiot",
+    "ur such a loser",
+    "shut up you stupid bitch",
+    "nobody likes you, you worthless moron",
+    "free nitro claim now http://discord.gift.ru/abc",
+]
+
+# Severe enough to be flagged without the AI at the default sensitivity and above
+SEVERE = ["kill yourself", "kys", "hope you die, kill yourself"]
+
+
+def check(content, sensitivity, monkeypatch):
+    monkeypatch.setattr(config, "MODERATION_SENSITIVITY", sensitivity)
+    return asyncio.run(Prefilter().check(content))
+
+
+@pytest.mark.parametrize("sensitivity", list(BANDS))
+@pytest.mark.parametrize("content", CLEAN)
+def test_clean_samples_skip_the_ai(content, sensitivity, monkeypatch):
+    assert check(content, sensitivity, monkeypatch).decision == "clean"
+
+
+@pytest.mark.parametrize("sensitivity", list(BANDS))
+@pytest.mark.parametrize("content", ABUSIVE)
+def test_abusive_samples_are_never_cleared_locally(content, sensitivity, monkeypatch):
+    result = check(content, sensitivity, monkeypatch)
+    assert result.decision in ("escalate", "flag"), result
+    assert result.score >= BANDS[sensitivity][0]
+
+
+@pytest.mark.parametrize("sensitivity", ["medium", "high"])
+@pytest.mark.parametrize("content", SEVERE)
+def test_severe_samples_are_flagged_locally(content, sensitivity, monkeypatch):
+    assert check(content, sensitivity, monkeypatch).decision == "flag"
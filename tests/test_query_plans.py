@@ -0,0 +1,210 @@
+"""Query-plan regression tests for db.py.
+
+Every helper in db.py is run against a scratch database while a trace callback
+records the SQL it executes. The database's sqlite_stat1 is then rewritten to
+describe multi-million-row tables, and each recorded statement is run through
+EXPLAIN QUERY PLAN on a fresh connection. A plain "SCAN <table>" (a full table
+scan without an index) fails the test unless the statement has no WHERE clause,
+i.e. it lists a whole table by design.
+"""
+
+import asyncio
+import datetime
+import inspect
+import re
+import sqlite3
+
+import pytest
+
+import db
+from storage import EXPORT_TABLES
+
+pytestmark = pytest.mark.skipif(db.BACKEND != "sqlite", reason="query plans are checked for the SQLite backend")
+
+FIXTURE_ROWS = 5_000_000
+
+# Helpers that run no SQL of their own (connection management, .env export)
+NOT_QUERIES = {"get_db", "get_read_db", "close_db", "flush_writes", "sync_db_to_env"}
+
+# "--" marks statements SQLite runs internally, e.g. FTS5 shadow-table lookups
+SKIP_PREFIXES = ("--", "PRAGMA", "BEGIN", "COMMIT", "ROLLBACK", "CREATE", "ANALYZE", "SAVEPOINT", "RELEASE")
+
+
+async def _exercise_helpers(statements: list[str]) -> set[str]:
+    """Call every db.py helper once, recording the SQL each one executes."""
+    await db.init_db()
+    conn = await db.get_db()
+    await conn.set_trace_callback(statements.append)
+
+    called = set()
+
+    async def call(name, *args, **kwargs):
+        called.add(name)
+        return await getattr(db, name)(*args, **kwargs)
+
+    called.add("init_db")
+    await call("get_config", "AI_PROVIDER")
+    await call("get_all_config")
+    await call("set_config", "AI_PROVIDER", "gemini")
+    await call("set_config_bulk", {"MAX_TOKENS": "1024"})
+    await call("sync_env_to_db")
+
+    await call("add_message", "100", "user", "alice", "hello")
+    await call("add_message", "100", "assistant", "bot", "hi", provider="gemini")
+    messages = await call("get_messages", "100", limit=20)
+    await call("get_messages", "100", limit=20, before_id=messages[-1]["id"])
+    await call("get_messages", "100", limit=20, after_id=messages[0]["id"])
+    await call("set_token_counts", [(messages[0]["id"], 2)])
+    await call("get_messages_since", "100", datetime.datetime(2000, 1, 1))
+    await call("list_channels")
+    await call("rebuild_channel_stats")
+    await call("search_messages", "hello", channel_id="100", since="2000-01-01")
+    await call("search_messages", "hel*", guild_id="1", provider="gemini", type="chat")
+    await call("search_messages", "hello", after_score=-1.0, after_id=messages[-1]["id"])
+    await call("search_messages", "hello", sort="recent", after_id=messages[-1]["id"], until="2999-01-01")
+    await call("rebuild_search_index")
+    await call("clear_messages", "100")
+
+    await call("get_wizard_state")
+    await call("set_wizard_state", completed=False, current_step=1, data={})
+
+    await call("create_session", "token", "user", "2999-01-01 00:00:00")
+    await call("validate_session", "token")
+    await call("delete_session", "token")
+
+    faq_id = await call("add_faq", "1", "q", "a", "k")
+    await call("get_faqs", "1")
+    await call("get_faqs")
+    await call("get_faq_by_id", faq_id)
+    await call("increment_faq_usage", faq_id)
+    await call("delete_faq", faq_id)
+
+    await call("add_command_permission", "ask", "1", "2")
+    await call("get_command_permissions", "ask", "1")
+    await call("get_all_command_permissions", "1")
+    await call("get_all_command_permissions")
+    await call("remove_command_permission", "ask", "1", "2")
+
+    await call("add_moderation_log", "1", "100", "5", "6", "spam", "low")
+    await call("add_blocklist_term", "1", "spam")
+    await call("get_blocklist", "1")
+    await call("remove_blocklist_term", "1", "spam")
+    await call("add_audit_log", "translation", "100", "alice", "gemini", 10, 5, 120)
+
+    await call("set_channel_prompt", "100", "1", "prompt")
+    await call("get_channel_prompt", "100")
+    await call("get_all_channel_prompts", "1")
+    await call("get_all_channel_prompts")
+    await call("delete_channel_prompt", "100")
+
+    await call("set_channel_provider", "100", "1", "gemini")
+    await call("get_channel_provider", "100")
+    await call("get_all_channel_providers", "1")
+    await call("get_all_channel_providers")
+    await call("delete_channel_provider", "100")
+
+    await call("set_retention_policy", "guild", "1", 30, 1000)
+    await call("get_retention_policies")
+    await call("delete_retention_policy", "guild", "1")
+    await call("add_message", "200", "user", "alice", "old")
+    await call("add_message", "200", "user", "alice", "new")
+    cutoff = await call("get_archive_cutoff_id", "200", max_age_days=30, max_messages=1)
+    await call("archive_messages", "200", cutoff, batch_size=100)
+    await call("get_archived_messages", "200", before_id=cutoff + 1)
+
+    await call("set_cached_response", "key", "gemini", "response", 60)
+    await call("get_cached_response", "key")
+    await call("purge_expired_responses")
+
+    # Two rows per exported table, so every keyset page after the first runs
+    await call("add_message", "300", "user", "alice", "export me")
+    await call("add_message", "300", "user", "alice", "export me too")
+    await call("add_faq", "1", "q2", "a2", "k2")
+    await call("add_command_permission", "review", "1", "3")
+    await call("set_channel_prompt", "300", "1", "prompt")
+    await call("set_channel_prompt", "301", "1", "prompt")
+    await call("set_channel_provider", "300", "1", "gemini")
+    await call("set_channel_provider", "301", "1", "groq")
+    await call("add_moderation_log", "1", "300", "7", "8", "spam", "low")
+    records = [(table, row) for table in EXPORT_TABLES async for row in db.iter_table_rows(table, batch_size=1)]
+
+    async def replay():
+        for record in records:
+            yield record
+
+    await call("import_records", "export", replay(), batch_size=5)
+
+    await db.flush_writes()
+    await conn.set_trace_callback(None)
+    return called
+
+
+async def _traced_run(statements: list[str]) -> set[str]:
+    try:
+        return await _exercise_helpers(statements)
+    finally:
+        # Always close, or the connection's worker thread keeps the process alive
+        await db.close_db()
+
+
+def _fake_stats(path: str):
+    """Rewrite sqlite_stat1 so the planner sees FIXTURE_ROWS rows in every table."""
+    conn = sqlite3.connect(path)
+    conn.execute("ANALYZE")
+    conn.execute("DELETE FROM sqlite_stat1")
+    tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+    for table in tables:
+        conn.execute("INSERT INTO sqlite_stat1 (tbl, idx, stat) VALUES (?, NULL, ?)", (table, str(FIXTURE_ROWS)))
+        for _, index, unique, *_ in conn.execute(f"PRAGMA index_list({table})").fetchall():
+            width = len(conn.execute(f"PRAGMA index_info({index})").fetchall())
+            # Unique keys match one row; a leading non-unique column matches ~1000
+            per_column = ["1"] * width if unique else ["1000"] + ["1"] * (width - 1)
+            conn.execute(
+                "INSERT INTO sqlite_stat1 (tbl, idx, stat) VALUES (?, ?, ?)",
+                (table, index, " ".join([str(FIXTURE_ROWS)] + per_column)),
+            )
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture(scope="module")
+def traced(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("plans") / "plans.db")
+    original_path, original_readers = db.DATABASE_PATH, db.READER_COUNT
+    # Readers off, so every statement runs on the traced writer connection
+    db.DATABASE_PATH, db.READER_COUNT = path, 0
+    statements: list[str] = []
+    try:
+        called = asyncio.run(_traced_run(statements))
+    finally:
+        db.DATABASE_PATH, db.READER_COUNT = original_path, original_readers
+    _fake_stats(path)
+    return path, statements, called
+
+
+def test_every_helper_is_exercised(traced):
+    _, _, called = traced
+    helpers = {
+        name for name, fn in inspect.getmembers(db, inspect.iscoroutinefunction)
+        if fn.__module__ == db.__name__ and not name.startswith("_")
+    }
+    assert helpers - NOT_QUERIES - called == set()
+
+
+def test_no_full_table_scans(traced):
+    path, statements, _ = traced
+    conn = sqlite3.connect(path)
+    failures = []
+    seen = set()
+    for sql in statements:
+        sql = " ".join(sql.split())
+        if sql in seen or sql.upper().startswith(SKIP_PREFIXES) or " WHERE " not in sql.upper():
+            continue
+        seen.add(sql)
+        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+        scans = [step for step in plan if re.fullmatch(r"SCAN \w+", step)]
+        if scans:
+            failures.append(f"{sql}\n    -> {'; '.join(plan)}")
+    conn.close()
+    assert seen, "no statements were traced"
+    assert not failures, "full table scans:\n" + "\n".join(failures)
@@ -0,0 +1,150 @@
+"""utils.scheduler: priority ordering, RPM/TPM buckets and slot release."""
+
+import asyncio
+
+import pytest
+
+import config
+from utils.scheduler import ProviderGate, QueueTimeout, TokenBucket, priority_for
+
+
+@pytest.fixture(autouse=True)
+def limits(monkeypatch):
+    monkeypatch.setattr(config, "PROVIDERS", {"p": {"name": "P"}})
+    monkeypatch.setattr(config, "PROVIDER_MAX_CONCURRENCY", 1)
+    monkeypatch.setattr(config, "SCHEDULER_MAX_WAIT", 5)
+
+
+def test_waiters_are_granted_by_priority_then_arrival():
+    async def main():
+        gate = ProviderGate("p")
+        first = await gate.acquire(priority_for("chat"), 1)
+        order = []
+
+        async def wait(label, request_type):
+            ticket = await gate.acquire(priority_for(request_type), 1)
+            order.append(label)
+            ticket.release()
+
+        tasks = [
+            asyncio.ensure_future(wait("digest", "digest")),
+            asyncio.ensure_future(wait("translate", "translation")),
+            asyncio.ensure_future(wait("chat 1", "chat")),
+            asyncio.ensure_future(wait("chat 2", "chat")),
+        ]
+        await asyncio.sleep(0.01)
+        assert gate.snapshot()["queued"] == {"interactive": 2, "tools": 1, "background": 1}
+        first.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(main()) == ["chat 1", "chat 2", "translate", "digest"]
+
+
+def test_token_bucket_refills_over_time():
+    bucket = TokenBucket(60)  # one unit per second
+    bucket.take(60)
+    assert bucket.wait_time(1) == pytest.approx(1.0, abs=0.05)
+    bucket._updated -= 0.5
+    assert bucket.wait_time(1) == pytest.approx(0.5, abs=0.05)
+    # Requests larger than the bucket wait for a full bucket rather than forever
+    assert bucket.wait_time(1000) == pytest.approx(59.5, abs=0.1)
+
+
+@pytest.mark.parametrize("limit", ["rpm", "tpm"])
+def test_empty_bucket_blocks_until_it_refills(limit, monkeypatch):
+    monkeypatch.setattr(config, "PROVIDER_MAX_CONCURRENCY", 10)
+    # Either way the empty bucket needs about 0.1s to refill enough
+    rate, amount = (6000, 10) if limit == "tpm" else (600, 1)
+    monkeypatch.setattr(config, "PROVIDERS", {"p": {"name": "P", limit: rate}})
+
+    async def main():
+        gate = ProviderGate("p")
+        gate._sync_limits()
+        bucket = gate._tokens if limit == "tpm" else gate._requests
+        bucket.take(rate)
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        ticket = await gate.acquire(0, amount)
+        ticket.release()
+        return loop.time() - started, gate.snapshot()
+
+    waited, snapshot = asyncio.run(main())
+    assert 0.05 <= waited < 1.0
+    assert snapshot["granted"] == 1 and snapshot["in_flight"] == 0
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    async def main():
+        gate = ProviderGate("p")
+        held = await gate.acquire(0, 1)
+        cancelled = asyncio.ensure_future(gate.acquire(0, 1))
+        after = asyncio.ensure_future(gate.acquire(1, 1))
+        await asyncio.sleep(0.01)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        held.release()
+        ticket = await asyncio.wait_for(after, 1)
+        assert gate.in_flight == 1
+        ticket.release()
+        ticket.release()  # releasing twice is harmless
+        return gate.in_flight, cancelled.cancelled()
+
+    assert asyncio.run(main()) == (0, True)
+
+
+def test_cancel_after_grant_does_not_leak_the_slot():
+    async def main():
+        gate = ProviderGate("p")
+        held = await gate.acquire(0, 1)
+        waiter = asyncio.ensure_future(gate.acquire(0, 1))
+        await asyncio.sleep(0.01)
+        # Grant the slot and cancel the waiter before it wakes up to take it
+        held.release()
+        waiter.cancel()
+        await asyncio.sleep(0.01)
+        if not waiter.cancelled():
+            # Some Python versions let the grant win over the cancellation;
+            # the caller then owns the ticket
+            waiter.result().release()
+        return gate.in_flight
+
+    assert asyncio.run(main()) == 0
+
+
+def test_queue_timeout(monkeypatch):
+    monkeypatch.setattr(config, "SCHEDULER_MAX_WAIT", 0.05)
+
+    async def main():
+        gate = ProviderGate("p")
+        held = await gate.acquire(0, 1)
+        with pytest.raises(QueueTimeout):
+            await gate.acquire(0, 1)
+        held.release()
+        # The timed-out waiter must not be granted the freed slot
+        ticket = await gate.acquire(0, 1)
+        ticket.release()
+        return gate.in_flight, gate.snapshot()
+
+    in_flight, snapshot = asyncio.run(main())
+    assert in_flight == 0
+    assert snapshot["timeouts"] == 1 and snapshot["granted"] == 2 and snapshot["queue_depth"] == 0
+
+
+
+@pytest.mark.parametrize("limit", [0, -3])
+def test_non_positive_concurrency_is_treated_as_one(limit, monkeypatch):
+    monkeypatch.setattr(config, "PROVIDER_MAX_CONCURRENCY", limit)
+    monkeypatch.setattr(config, "SCHEDULER_MAX_WAIT", 0.05)
+
+    async def main():
+        gate = ProviderGate("p")
+        ticket = await gate.acquire(0, 1)
+        # A second request still waits for the first one's slot
+        with pytest.raises(QueueTimeout):
+            await gate.acquire(0, 1)
+        ticket.release()
+        return gate.snapshot()["max_in_flight"], gate.in_flight
+
+    assert asyncio.run(main()) == (1, 0)
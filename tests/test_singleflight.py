@@ -0,0 +1,50 @@
+"""Request coalescing: identical concurrent ask_once() calls share one upstream call."""
+
+import asyncio
+
+import pytest
+
+import config
+import providers
+from bot import bot
+from utils.singleflight import SingleFlight
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    monkeypatch.setattr(config, "SINGLEFLIGHT_ENABLED", True)
+    monkeypatch.setattr(config, "AI_AUDIT_LOG", False)
+    monkeypatch.setattr(providers, "singleflight", SingleFlight())
+    calls = []
+
+    async def fake_chat(messages, system_prompt, primary_provider, request_type):
+        calls.append(messages[-1]["content"])
+        await asyncio.sleep(0.02)
+        return f"reply to {messages[-1]['content']}", "fake"
+    monkeypatch.setattr(providers, "_chat", fake_chat)
+    return calls
+
+
+def test_identical_requests_share_one_upstream_call(upstream):
+    async def main():
+        return await asyncio.gather(
+            bot.ask_once("same text", "Translate.", "translation", user_name="alice"),
+            bot.ask_once("same text", "Translate.", "translation", user_name="bob"),
+        )
+
+    results = asyncio.run(main())
+    assert upstream == ["same text"]
+    assert results == [("reply to same text", "fake")] * 2
+    assert providers.get_singleflight_stats()["shared"] == 1
+
+
+def test_different_requests_are_not_merged(upstream):
+    async def main():
+        return await asyncio.gather(
+            bot.ask_once("one", "Translate.", "translation"),
+            bot.ask_once("two", "Translate.", "translation"),
+            bot.ask_once("one", "Review.", "code_review"),
+        )
+
+    asyncio.run(main())
+    assert sorted(upstream) == ["one", "one", "two"]
@@ -0,0 +1,328 @@
+"""Behaviour tests shared by both storage backends.
+
+Every test runs once per backend. SQLite uses a scratch file. PostgreSQL runs
+when SPARKSAGE_TEST_DATABASE_URL points at a disposable database (all its
+tables are truncated before each test) and is skipped otherwise, e.g.
+
+    SPARKSAGE_TEST_DATABASE_URL=postgresql://postgres@localhost/sparksage_test python -m pytest tests
+"""
+
+import asyncio
+import datetime
+import inspect
+import os
+
+import pytest
+
+import db
+import storage
+
+TEST_DATABASE_URL = os.getenv("SPARKSAGE_TEST_DATABASE_URL", "")
+
+
+async def _reset_postgres(backend):
+    await backend.init_db()
+    try:
+        pool = await backend.get_pool()
+        tables = [row["tablename"] for row in await pool.fetch("SELECT tablename FROM pg_tables WHERE schemaname = current_schema()")]
+        await pool.execute(f"TRUNCATE {', '.join(tables)} RESTART IDENTITY")
+    finally:
+        await backend.close_db()
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def backend(request, tmp_path, monkeypatch):
+    if request.param == "sqlite":
+        if db.BACKEND != "sqlite":
+            pytest.skip("db is configured for PostgreSQL")
+        monkeypatch.setattr(db, "DATABASE_PATH", str(tmp_path / "storage.db"))
+        return db
+
+    if not TEST_DATABASE_URL:
+        pytest.skip("SPARKSAGE_TEST_DATABASE_URL is not set")
+    pytest.importorskip("asyncpg")
+    import db_postgres
+    monkeypatch.setattr(db_postgres, "DATABASE_URL", TEST_DATABASE_URL)
+    asyncio.run(_reset_postgres(db_postgres))
+    return db_postgres
+
+
+def run(backend, scenario):
+    """Run scenario(backend) on a freshly initialized database."""
+    async def main():
+        await backend.init_db()
+        try:
+            return await scenario(backend)
+        finally:
+            await backend.close_db()
+    return asyncio.run(main())
+
+
+def test_backend_implements_storage_interface(backend):
+    for name, expected in inspect.getmembers(storage.Storage, inspect.isfunction):
+        if name.startswith("_"):
+            continue
+        actual = getattr(backend, name, None)
+        assert actual is not None, f"{name} is missing"
+        assert list(inspect.signature(actual).parameters) == list(inspect.signature(expected).parameters)[1:], name
+
+
+def test_config(backend):
+    async def scenario(db):
+        await db.set_config("AI_PROVIDER", "groq")
+        await db.set_config_bulk({"MAX_TOKENS": "512", "BOT_PREFIX": "?"})
+        assert await db.get_config("AI_PROVIDER") == "groq"
+        assert await db.get_config("MISSING", "fallback") == "fallback"
+        # Seeding from the environment never overwrites stored values
+        await db.sync_env_to_db()
+        config = await db.get_all_config()
+        assert config["AI_PROVIDER"] == "groq" and config["MAX_TOKENS"] == "512"
+        assert "GEMINI_MODEL" in config
+    run(backend, scenario)
+
+
+def test_messages_are_paged_oldest_first(backend):
+    async def scenario(db):
+        for i in range(5):
+            await db.add_message("100", "user", "alice", f"message {i}", type="chat", guild_id="1")
+        newest = await db.get_messages("100", limit=2)
+        assert [m["content"] for m in newest] == ["message 3", "message 4"]
+        older = await db.get_messages("100", limit=2, before_id=newest[0]["id"])
+        assert [m["content"] for m in older] == ["message 1", "message 2"]
+        after = await db.get_messages("100", limit=2, after_id=older[0]["id"])
+        assert [m["content"] for m in after] == ["message 2", "message 3"]
+        assert [m["content"] async for m in db.iter_messages("100", batch_size=2)] == [f"message {i}" for i in range(5)]
+
+        await db.set_token_counts([(newest[-1]["id"], 42)])
+        assert (await db.get_messages("100", limit=1))[0]["token_count"] == 42
+        since = await db.get_messages_since("100", datetime.datetime(2000, 1, 1))
+        assert len(since) == 5
+    run(backend, scenario)
+
+
+def test_channel_stats_follow_inserts_and_deletes(backend):
+    async def scenario(db):
+        await db.add_message("100", "user", "alice", "hi", type="chat")
+        await db.add_message("100", "assistant", "bot", "hello", provider="gemini", type="chat")
+        await db.add_message("200", "user", "bob", "hey")
+        channels = {c["channel_id"]: c for c in await db.list_channels()}
+        assert channels["100"]["message_count"] == 2
+        assert channels["100"]["providers"] == {"gemini": 1}
+        assert channels["100"]["types"] == {"chat": 2}
+
+        await db.clear_messages("100")
+        assert [c["channel_id"] for c in await db.list_channels()] == ["200"]
+        assert await db.get_messages("100") == []
+        assert await db.rebuild_channel_stats() == 1
+    run(backend, scenario)
+
+
+def test_search(backend):
+    async def scenario(db):
+        for i in range(6):
+            await db.add_message("100", "user", "alice", f"the quick brown fox number {i}", guild_id="1")
+        await db.add_message("200", "assistant", "bot", "a lazy brown dog", provider="gemini", guild_id="2")
+        await db.flush_writes()
+
+        assert {r["channel_id"] for r in await db.search_messages("brown")} == {"100", "200"}
+        assert [r["channel_id"] for r in await db.search_messages("brown", guild_id="2")] == ["200"]
+        assert [r["channel_id"] for r in await db.search_messages("brown", provider="gemini")] == ["200"]
+        assert len(await db.search_messages("qui*")) == 6
+        assert "[dog]" in (await db.search_messages("dog"))[0]["snippet"]
+        # Operators and punctuation are searched literally rather than raising
+        assert await db.search_messages('fox" OR (NEAR') == []
+        assert await db.search_messages("  ") == []
+
+        seen, cursor = [], (None, None)
+        while page := await db.search_messages("fox", limit=4, after_score=cursor[0], after_id=cursor[1]):
+            seen += [r["id"] for r in page]
+            cursor = (page[-1]["score"], page[-1]["id"])
+        assert sorted(seen) == sorted(set(seen)) and len(seen) == 6
+
+        recent = await db.search_messages("fox", sort="recent", limit=4)
+        assert [r["id"] for r in recent] == sorted((r["id"] for r in recent), reverse=True)
+        rest = await db.search_messages("fox", sort="recent", limit=4, after_id=recent[-1]["id"])
+        assert len(rest) == 2
+
+        await db.clear_messages("200")
+        assert await db.search_messages("dog") == []
+        await db.rebuild_search_index()
+        assert len(await db.search_messages("fox")) == 6
+    run(backend, scenario)
+
+
+def test_wizard_and_sessions(backend):
+    async def scenario(db):
+        assert (await db.get_wizard_state())["completed"] is False
+        await db.set_wizard_state(completed=True, current_step=3, data={"a": 1})
+        assert await db.get_wizard_state() == {"completed": True, "current_step": 3, "data": {"a": 1}}
+
+        await db.create_session("live", "admin", "2999-01-01 00:00:00")
+        await db.create_session("expired", "admin", "2000-01-01 00:00:00")
+        assert (await db.validate_session("live"))["user_id"] == "admin"
+        assert await db.validate_session("expired") is None
+        await db.delete_session("live")
+        assert await db.validate_session("live") is None
+    run(backend, scenario)
+
+
+def test_faqs(backend):
+    async def scenario(db):
+        faq_id = await db.add_faq("1", "How?", "Like this.", "how,help", created_by="alice")
+        await db.add_faq("2", "Why?", "Because.", "why")
+        assert [f["question"] for f in await db.get_faqs("1")] == ["How?"]
+        assert len(await db.get_faqs()) == 2
+        await db.increment_faq_usage(faq_id)
+        await db.flush_writes()
+        assert (await db.get_faq_by_id(faq_id))["times_used"] == 1
+        await db.delete_faq(faq_id)
+        assert await db.get_faq_by_id(faq_id) is None
+    run(backend, scenario)
+
+
+def test_command_permissions(backend):
+    async def scenario(db):
+        await db.add_command_permission("ask", "1", "10")
+        await db.add_command_permission("ask", "1", "10")
+        await db.add_command_permission("ask", "1", "11")
+        await db.add_command_permission("review", "2", "20")
+        assert sorted(await db.get_command_permissions("ask", "1")) == ["10", "11"]
+        assert len(await db.get_all_command_permissions("1")) == 2
+        assert len(await db.get_all_command_permissions()) == 3
+        await db.remove_command_permission("ask", "1", "10")
+        assert await db.get_command_permissions("ask", "1") == ["11"]
+        assert await db.get_command_permissions("ask", "2") == []
+    run(backend, scenario)
+
+
+def test_moderation(backend):
+    async def scenario(db):
+        await db.add_moderation_log("1", "100", "5", "6", "spam", "low")
+        await db.add_audit_log("translation", "100", "alice", "gemini", 10, 5, 120)
+        assert await db.add_blocklist_term("1", "scam", created_by="mod") is True
+        assert await db.add_blocklist_term("1", "scam") is False
+        await db.add_blocklist_term("1", r"free\s+nitro", is_regex=True)
+        blocklist = await db.get_blocklist("1")
+        assert [(b["term"], bool(b["is_regex"])) for b in blocklist] == [(r"free\s+nitro", True), ("scam", False)]
+        assert await db.remove_blocklist_term("1", "scam") is True
+        assert await db.remove_blocklist_term("1", "scam") is False
+        assert await db.get_blocklist("2") == []
+    run(backend, scenario)
+
+
+def test_channel_prompts_and_providers(backend):
+    async def scenario(db):
+        await db.set_channel_prompt("100", "1", "Be brief.")
+        await db.set_channel_prompt("100", "1", "Be thorough.")
+        await db.set_channel_prompt("200", "2", "Be kind.")
+        assert await db.get_channel_prompt("100") == "Be thorough."
+        assert [p["channel_id"] for p in await db.get_all_channel_prompts("1")] == ["100"]
+        assert len(await db.get_all_channel_prompts()) == 2
+        await db.delete_channel_prompt("100")
+        assert await db.get_channel_prompt("100") is None
+
+        await db.set_channel_provider("100", "1", "groq")
+        assert await db.get_channel_provider("100") == "groq"
+        assert [p["provider_name"] for p in await db.get_all_channel_providers("1")] == ["groq"]
+        assert len(await db.get_all_channel_providers()) == 1
+        await db.delete_channel_provider("100")
+        assert await db.get_channel_provider("100") is None
+    run(backend, scenario)
+
+
+def test_retention_and_archive(backend):
+    async def scenario(db):
+        await db.set_retention_policy("guild", "1", 30, 100)
+        await db.set_retention_policy("guild", "1", 7, 0)
+        assert await db.get_retention_policies() == [{"scope": "guild", "target_id": "1", "max_age_days": 7, "max_messages": 0}]
+        assert await db.delete_retention_policy("guild", "1") is True
+        assert await db.delete_retention_policy("guild", "1") is False
+
+        for i in range(5):
+            await db.add_message("100", "user", "alice", f"message {i}")
+        assert await db.get_archive_cutoff_id("100") is None
+        cutoff = await db.get_archive_cutoff_id("100", max_messages=2)
+        assert await db.archive_messages("100", cutoff, batch_size=2) == 2
+        assert await db.archive_messages("100", cutoff, batch_size=2) == 1
+        assert await db.archive_messages("100", cutoff, batch_size=2) == 0
+
+        assert [m["content"] for m in await db.get_messages("100")] == ["message 3", "message 4"]
+        assert (await db.list_channels())[0]["message_count"] == 2
+        archived = await db.get_archived_messages("100")
+        assert [m["content"] for m in archived] == ["message 0", "message 1", "message 2"]
+        older = await db.get_archived_messages("100", before_id=archived[-1]["id"], limit=1)
+        assert [m["content"] for m in older] == ["message 1"]
+    run(backend, scenario)
+
+
+def test_response_cache(backend):
+    async def scenario(db):
+        await db.set_cached_response("live", "gemini", "cached", 60)
+        await db.set_cached_response("stale", "gemini", "old", 0)
+        assert await db.get_cached_response("live") == {"provider": "gemini", "response": "cached"}
+        assert await db.get_cached_response("stale") is None
+        assert await db.purge_expired_responses() == 1
+    run(backend, scenario)
+
+
+def test_export_import_round_trip(backend):
+    async def scenario(db):
+        await db.add_message("100", "user", "alice", "first", guild_id="1")
+        await db.add_message("100", "assistant", "bot", "second", provider="gemini")
+        await db.add_faq("1", "How?", "Like this.", "how")
+        await db.add_command_permission("ask", "1", "10")
+        await db.set_channel_prompt("100", "1", "Be brief.")
+        await db.set_channel_provider("100", "1", "groq")
+        await db.add_moderation_log("1", "100", "5", "6", "spam", "low")
+
+        records = [(table, row) for table in storage.EXPORT_TABLES async for row in db.iter_table_rows(table, batch_size=1)]
+        assert [table for table, _ in records].count("conversations") == 2
+
+        async def replay(changed_prompt=None):
+            for table, row in records:
+                if table == "channel_prompts" and changed_prompt:
+                    row = {**row, "system_prompt": changed_prompt}
+                yield table, row
+
+        counts = await db.import_records("export-1", replay("Be thorough."), batch_size=3)
+        assert counts["conversations"] == {"imported": 2, "skipped": 0}
+        # Rows keyed by id were copied under new ids; the rest were upserted
+        messages = await db.get_messages("100")
+        assert [m["content"] for m in messages] == ["first", "second", "first", "second"]
+        assert len({m["id"] for m in messages}) == 4
+        assert len(await db.get_faqs("1")) == 2
+        assert await db.get_command_permissions("ask", "1") == ["10"]
+        assert await db.get_channel_prompt("100") == "Be thorough."
+        assert (await db.list_channels())[0]["message_count"] == 4
+        assert len(await db.search_messages("first")) == 2
+
+        # Importing the same export again changes nothing
+        counts = await db.import_records("export-1", replay(), batch_size=3)
+        assert counts["conversations"] == {"imported": 0, "skipped": 2}
+        assert counts["faqs"] == {"imported": 0, "skipped": 1}
+        assert len(await db.get_messages("100")) == 4
+
+        async def bad():
+            yield "sessions", {"token": "x"}
+        with pytest.raises(ValueError):
+            await db.import_records("export-2", bad())
+    run(backend, scenario)
+
+
+def test_postgres_forgets_closed_connections(backend):
+    if backend is db:
+        pytest.skip("PostgreSQL only")
+
+    async def main():
+        await backend.init_db()
+        pool = await backend.get_pool()
+        async with pool.acquire() as conn:
+            pid = conn.get_server_pid()
+        # Released connections stay open, and their NOTIFYs are still ours
+        assert pid in backend._own_pids
+        await backend.close_db()
+        await asyncio.sleep(0)
+        return pid
+
+    pid = asyncio.run(main())
+    assert pid not in backend._own_pids
@@ -0,0 +1,38 @@
+"""utils.tokens falls back to the character estimate when the tokenizer can't load."""
+
+import asyncio
+
+from utils import tokens
+
+
+class OfflineTiktoken:
+    def __init__(self):
+        self.calls = 0
+
+    def get_encoding(self, name):
+        self.calls += 1
+        raise ConnectionError("could not download cl100k_base")
+
+
+def test_failed_tokenizer_load_falls_back_to_the_estimate_once(monkeypatch):
+    offline = OfflineTiktoken()
+    monkeypatch.setattr(tokens, "tiktoken", offline)
+    monkeypatch.setattr(tokens, "_encoding", None)
+    monkeypatch.setattr(tokens, "_encoding_error", None)
+
+    asyncio.run(tokens.load_encoding())
+    assert tokens.count_tokens("x" * 10) == 3
+    assert tokens.count_tokens("hello") == 2
+    assert tokens.truncate("word " * 100, 10).endswith(tokens.TRUNCATION_MARKER)
+    # The failure is remembered rather than retried on every call
+    assert offline.calls == 1
+
+
+def test_estimate_while_another_thread_is_loading(monkeypatch):
+    monkeypatch.setattr(tokens, "tiktoken", OfflineTiktoken())
+    monkeypatch.setattr(tokens, "_encoding", None)
+    monkeypatch.setattr(tokens, "_encoding_error", None)
+
+    with tokens._encoding_lock:
+        assert tokens.count_tokens("x" * 8) == 2
+    assert tokens.tiktoken.calls == 0
@@ -0,0 +1,130 @@
+"""Failure handling of db.py's write-behind buffer (SQLite only)."""
+
+import asyncio
+import sqlite3
+
+import pytest
+
+import db
+
+pytestmark = pytest.mark.skipif(db.BACKEND != "sqlite", reason="db is configured for PostgreSQL")
+
+
+@pytest.fixture(autouse=True)
+def scratch_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DATABASE_PATH", str(tmp_path / "writes.db"))
+    monkeypatch.setattr(db, "_write_stats", {"rows": 0, "flushes": 0, "errors": 0, "dropped": 0})
+    monkeypatch.setattr(db, "_write_retry_ms", 0)
+
+
+def run(scenario):
+    async def main():
+        await db.init_db()
+        try:
+            return await scenario()
+        finally:
+            await db.close_db()
+    return asyncio.run(main())
+
+
+def test_bad_row_is_dropped_without_losing_its_neighbours():
+    async def scenario():
+        await db.add_message("1", "user", "alice", "before")
+        # moderation_logs.reason is NOT NULL
+        await db.add_moderation_log("9", "1", "100", "200", None, "high")
+        await db.add_message("1", "user", "alice", "after")
+        await db.flush_writes()
+
+        await db.add_message("1", "user", "alice", "later")
+        await db.flush_writes()
+
+        messages = [m["content"] for m in await db.get_messages("1")]
+        assert messages == ["before", "after", "later"]
+        stats = db.get_write_stats()
+        assert (stats["rows"], stats["dropped"], stats["errors"], stats["pending"]) == (3, 1, 0, 0)
+    run(scenario)
+
+
+def test_transient_failure_is_rolled_back_and_retried(monkeypatch):
+    monkeypatch.setattr(db, "WRITE_FLUSH_MS", 10)
+    monkeypatch.setattr(db, "BUSY_TIMEOUT_MS", 0)
+
+    async def scenario():
+        await db.add_message("1", "user", "alice", "hello")
+        blocker = sqlite3.connect(db.DATABASE_PATH)
+        blocker.execute("BEGIN IMMEDIATE")
+        try:
+            await db.flush_writes()
+            assert db.get_write_stats()["errors"] == 1
+            assert db.get_write_stats()["pending"] == 1
+        finally:
+            blocker.rollback()
+            blocker.close()
+
+        # The backoff timer retries without any further writes
+        for _ in range(50):
+            await asyncio.sleep(0.02)
+            if db.get_write_stats()["pending"] == 0 and not db._write_tasks:
+                break
+        assert db.get_write_stats()["pending"] == 0
+        await db.add_message("1", "user", "alice", "world")
+        await db.flush_writes()
+
+        assert [m["content"] for m in await db.get_messages("1")] == ["hello", "world"]
+        assert db.get_write_stats()["rows"] == 2
+    run(scenario)
+
+
+class FailingFlushConnection:
+    """Wraps the flush connection: during the second statement group of the first
+    flush another helper commits a write, then the group fails as if the database
+    were locked."""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self.groups = 0
+        self.interleaved = None
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    async def executemany(self, sql, params):
+        self.groups += 1
+        if self.groups == 2:
+            self.interleaved = asyncio.ensure_future(db.set_config("INTERLEAVED", "yes"))
+            await asyncio.sleep(0.05)
+            raise sqlite3.OperationalError("database is locked")
+        return await self._conn.executemany(sql, params)
+
+
+def test_interleaved_commit_neither_loses_nor_duplicates_rows(monkeypatch):
+    monkeypatch.setattr(db, "WRITE_FLUSH_MS", 10)
+    real = db._get_flush_db
+    wrapped = {}
+
+    async def flaky():
+        conn = await real()
+        wrapped.setdefault(id(conn), FailingFlushConnection(conn))
+        return wrapped[id(conn)]
+    monkeypatch.setattr(db, "_get_flush_db", flaky)
+
+    async def scenario():
+        await db.add_message("1", "user", "alice", "hello")
+        await db.add_moderation_log("9", "1", "100", "200", "spam", "low")
+        await db.flush_writes()
+        assert db.get_write_stats()["errors"] == 1
+        for _ in range(50):
+            await asyncio.sleep(0.02)
+            if db.get_write_stats()["pending"] == 0 and not db._write_tasks:
+                break
+
+        await next(iter(wrapped.values())).interleaved
+        # The helper's commit landed on its own; the failed group commit did not
+        conn = await db.get_read_db()
+        cursor = await conn.execute("SELECT COUNT(*) FROM conversations")
+        messages = (await cursor.fetchone())[0]
+        cursor = await conn.execute("SELECT COUNT(*) FROM moderation_logs")
+        logs = (await cursor.fetchone())[0]
+        return messages, logs, await db.get_config("INTERLEAVED")
+
+    assert run(scenario) == (1, 1, "yes")
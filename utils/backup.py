@@ -0,0 +1,138 @@
+"""Streaming export / import of conversations, FAQs and per-guild settings as gzip NDJSON.
+
+An export is a header line followed by one line per row:
+
+    {"format": "sparksage-export", "version": 1, "export_id": "...", "created_at": "..."}
+    {"table": "conversations", "row": {"id": 1, "channel_id": "...", ...}}
+
+Both directions work one page / batch at a time, so memory use stays flat no
+matter how large the history is. The global config table is not exported: it
+holds the bot token and provider API keys.
+"""
+
+from __future__ import annotations
+
+import datetime
+import json
+import uuid
+import zlib
+from collections.abc import AsyncIterable, AsyncIterator, Iterator
+
+import db
+from storage import EXPORT_TABLES
+
+FORMAT = "sparksage-export"
+VERSION = 1
+CHUNK_BYTES = 64 * 1024
+# Longest row line accepted on import; generous for conversation content
+MAX_LINE_BYTES = 16 * 1024 * 1024
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+async def export_lines(tables: list[str] | None = None) -> AsyncIterator[str]:
+    """Yield the export's header and row lines."""
+    header = {
+        "format": FORMAT,
+        "version": VERSION,
+        "export_id": uuid.uuid4().hex,
+        "created_at": datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    yield json.dumps(header) + "\n"
+    for table in tables or EXPORT_TABLES:
+        async for row in db.iter_table_rows(table):
+            yield json.dumps({"table": table, "row": row}, ensure_ascii=False) + "\n"
+
+
+async def export_gzip(tables: list[str] | None = None) -> AsyncIterator[bytes]:
+    """Yield the export gzip-compressed, in chunks as the compressor fills."""
+    compressor = zlib.compressobj(wbits=31)  # 31 = gzip container
+    async for line in export_lines(tables):
+        data = compressor.compress(line.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class _LineSplitter:
+    """Split a byte stream into lines as it arrives, holding at most one partial line."""
+
+    def __init__(self):
+        self._parts: list[bytes] = []
+        self._size = 0
+
+    def _append(self, piece: bytes):
+        self._size += len(piece)
+        if self._size > MAX_LINE_BYTES:
+            raise ValueError(f"line longer than {MAX_LINE_BYTES} bytes")
+        if piece:
+            self._parts.append(piece)
+
+    def _take(self) -> str | None:
+        line = b"".join(self._parts)
+        self._parts, self._size = [], 0
+        return line.decode("utf-8") if line.strip() else None
+
+    def feed(self, data: bytes) -> Iterator[str]:
+        start = 0
+        while (end := data.find(b"\n", start)) != -1:
+            self._append(data[start:end])
+            if (line := self._take()) is not None:
+                yield line
+            start = end + 1
+        self._append(data[start:])
+
+    def finish(self) -> Iterator[str]:
+        if (line := self._take()) is not None:
+            yield line
+
+
+async def read_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[str]:
+    """Split a byte stream, gzip-compressed or plain, into non-empty lines.
+
+    Gzip input is inflated at most CHUNK_BYTES at a time and split straight
+    away, so a highly compressible upload can't balloon in memory. Raises
+    ValueError for a line over MAX_LINE_BYTES.
+    """
+    decompressor = None
+    splitter = _LineSplitter()
+    first = True
+    async for chunk in chunks:
+        if first:
+            decompressor = zlib.decompressobj(wbits=31) if chunk.startswith(GZIP_MAGIC) else None
+            first = False
+        if decompressor is None:
+            for line in splitter.feed(chunk):
+                yield line
+            continue
+        data = chunk
+        while data:
+            for line in splitter.feed(decompressor.decompress(data, CHUNK_BYTES)):
+                yield line
+            data = decompressor.unconsumed_tail
+    if decompressor is not None:
+        for line in splitter.feed(decompressor.flush()):
+            yield line
+    for line in splitter.finish():
+        yield line
+
+
+async def import_lines(lines: AsyncIterator[str], batch_size: int = 500) -> dict:
+    """Load an export's lines into the database. Raises ValueError for anything that isn't one.
+
+    Importing the same export again is a no-op, so an import that failed
+    part-way can simply be rerun.
+    """
+    first = await anext(lines, None)
+    header = json.loads(first) if first else {}
+    if not isinstance(header, dict) or header.get("format") != FORMAT or not header.get("export_id"):
+        raise ValueError("not a SparkSage export")
+    if header.get("version") != VERSION:
+        raise ValueError(f"unsupported export version {header.get('version')}")
+
+    async def records():
+        async for line in lines:
+            record = json.loads(line)
+            yield record["table"], record["row"]
+
+    counts = await db.import_records(header["export_id"], records(), batch_size)
+    return {"export_id": header["export_id"], "tables": counts}
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import config
+from utils import tokens
+
+
+def build_context(rows: list[dict], system_prompt: str, provider_name: str | None) -> tuple[list[dict], list[tuple[int, int]]]:
+    """Pick the conversation history that fits the provider's token budget.
+
+    rows are conversation rows (oldest first) with id, role, content and an
+    optional cached token_count. The budget is CONTEXT_TOKEN_BUDGET minus the
+    system prompt and the MAX_TOKENS reserved for the reply. Messages are taken
+    newest to oldest until the budget is spent; any single message above
+    CONTEXT_MAX_MESSAGE_TOKENS is truncated, and the newest message is always
+    kept (truncated to what is left if necessary).
+
+    Returns (messages, computed_counts), where computed_counts lists
+    (row_id, token_count) for rows whose count was missing so the caller can
+    cache it.
+    """
+    budget = (
+        config.CONTEXT_TOKEN_BUDGET
+        - tokens.for_provider(tokens.count_tokens(system_prompt) + tokens.MESSAGE_OVERHEAD, provider_name)
+        - config.MAX_TOKENS
+    )
+    selected = []
+    computed = []
+
+    for row in reversed(rows):
+        count = row.get("token_count")
+        if count is None:
+            count = tokens.count_tokens(row["content"])
+            if row.get("id") is not None:
+                computed.append((row["id"], count))
+
+        content = row["content"]
+        if count > config.CONTEXT_MAX_MESSAGE_TOKENS:
+            content = tokens.truncate(content, config.CONTEXT_MAX_MESSAGE_TOKENS)
+            count = tokens.count_tokens(content)
+
+        cost = tokens.for_provider(count + tokens.MESSAGE_OVERHEAD, provider_name)
+        if cost > budget:
+            if selected:
+                break
+            # Always send the newest message, cut down to whatever budget remains
+            remaining = int(budget / tokens.provider_ratio(provider_name)) - tokens.MESSAGE_OVERHEAD
+            content = tokens.truncate(content, max(1, remaining))
+            cost = budget
+        selected.append({"role": row["role"], "content": content})
+        budget -= cost
+
+    selected.reverse()
+    return selected, computed
@@ -0,0 +1,299 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+import unicodedata
+from collections import OrderedDict, deque
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+import config
+
+# How many recent batches / verdicts the fill and latency metrics are computed over
+METRICS_WINDOW = 500
+
+ZERO_WIDTH_RE = re.compile("[\u200b-\u200f\u2060-\u2064\ufeff\u00ad\u034f]")
+URL_RE = re.compile(r"(?:https?://|www\.)([^\s/?#]+)([^\s?#]*)\S*", re.IGNORECASE)
+
+SYSTEM_PROMPT = (
+    "You are a moderation AI. Analyze messages for problematic content and respond only with JSON."
+)
+
+
+def build_prompt(contents: list[str]) -> str:
+    """Build one moderation prompt covering every message in the batch."""
+    lines = "\n".join(f"{i}. {json.dumps(content, ensure_ascii=False)}" for i, content in enumerate(contents, 1))
+    return (
+        "Rate each of the following messages for toxicity, spam, and rule violations. "
+        "Respond with a JSON array containing one object per message, in the same order: "
+        "[{\"id\": int, \"flagged\": bool, \"reason\": \"str\", \"severity\": \"low\"|\"medium\"|\"high\"}]\n\n"
+        f"Messages:\n{lines}"
+    )
+
+
+def parse_verdicts(response: str, count: int) -> list[dict | None]:
+    """Map a JSON array of verdicts back onto the batch, by "id" where given, else by position.
+
+    Messages the model left out come back as None. Raises ValueError if the
+    response contains no usable JSON.
+    """
+    text = response.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        text = text.rsplit("```", 1)[0].strip()
+
+    start, end = text.find("["), text.rfind("]")
+    if start != -1 and end > start:
+        parsed = json.loads(text[start:end + 1])
+    else:
+        parsed = json.loads(text)
+        # A lone object is acceptable for a batch of one
+        parsed = parsed.get("verdicts", [parsed]) if isinstance(parsed, dict) else parsed
+    if not isinstance(parsed, list):
+        raise ValueError("moderation response is not a JSON array")
+
+    verdicts: list[dict | None] = [None] * count
+    for position, item in enumerate(parsed):
+        if not isinstance(item, dict):
+            continue
+        index = item.get("id")
+        index = index - 1 if isinstance(index, int) and 1 <= index <= count else position
+        if index < count and verdicts[index] is None:
+            verdicts[index] = item
+    return verdicts
+
+
+def content_key(content: str) -> str:
+    """Hash a message's normalized content for the verdict cache.
+
+    Normalizes Unicode (NFKC), case, zero-width characters and whitespace, and
+    reduces URLs to host and path so tracking parameters don't defeat the cache.
+    """
+    text = ZERO_WIDTH_RE.sub("", unicodedata.normalize("NFKC", content)).casefold()
+    text = URL_RE.sub(lambda m: f"<{m.group(1)}{m.group(2).rstrip('/')}>", text)
+    text = " ".join(text.split())
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class VerdictCache:
+    """Bounded LRU of moderation verdicts by content_key(), each kept for MODERATION_CACHE_TTL_SECONDS."""
+
+    def __init__(self):
+        self._items: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def get(self, key: str) -> dict | None:
+        entry = self._items.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._items.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[1]
+        if entry is not None:
+            del self._items[key]
+        self.stats["misses"] += 1
+        return None
+
+    def set(self, key: str, verdict: dict):
+        self._items[key] = (time.monotonic() + config.MODERATION_CACHE_TTL_SECONDS, verdict)
+        self._items.move_to_end(key)
+        while len(self._items) > max(0, config.MODERATION_CACHE_ITEMS):
+            self._items.popitem(last=False)
+
+    def snapshot(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else None,
+            "items": len(self._items),
+        }
+
+
+class ModerationBatcher:
+    """Collect messages for up to MODERATION_BATCH_WINDOW_MS or MODERATION_BATCH_SIZE items,
+    then classify them with a single AI call.
+
+    `classify` takes the batch's message contents and returns one verdict (or
+    None) per message; the Moderation cog binds it on load. Callers await
+    submit() and get their own message's verdict back.
+    """
+
+    def __init__(self, classify: Callable[[list[str]], Awaitable[list[dict | None]]] | None = None):
+        self.classify = classify
+        self._pending: list[tuple[str, asyncio.Future, float]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        # Strong references to running batches, so none is garbage-collected mid-call
+        self._tasks: set[asyncio.Task] = set()
+        self._fills: deque[int] = deque(maxlen=METRICS_WINDOW)
+        self._latencies: deque[float] = deque(maxlen=METRICS_WINDOW)
+        self.stats = {"batches": 0, "messages": 0, "errors": 0, "missing": 0}
+
+    async def submit(self, content: str) -> dict | None:
+        """Queue a message for classification and wait for its verdict."""
+        if self.classify is None:
+            raise RuntimeError("moderation batcher has no classifier bound")
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((content, future, time.monotonic()))
+        if len(self._pending) >= max(1, config.MODERATION_BATCH_SIZE):
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                max(0, config.MODERATION_BATCH_WINDOW_MS) / 1000, self._flush
+            )
+        return await asyncio.shield(future)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        size = max(1, config.MODERATION_BATCH_SIZE)
+        while self._pending:
+            batch, self._pending = self._pending[:size], self._pending[size:]
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list[tuple[str, asyncio.Future, float]]):
+        self.stats["batches"] += 1
+        self.stats["messages"] += len(batch)
+        self._fills.append(len(batch))
+        try:
+            verdicts = await self.classify([content for content, _, _ in batch])
+        except Exception as e:
+            self.stats["errors"] += 1
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        verdicts = list(verdicts) + [None] * (len(batch) - len(verdicts))
+        now = time.monotonic()
+        for (_, future, queued_at), verdict in zip(batch, verdicts):
+            if verdict is None:
+                self.stats["missing"] += 1
+            self._latencies.append(now - queued_at)
+            if not future.done():
+                future.set_result(verdict)
+
+    def snapshot(self) -> dict:
+        fills = list(self._fills)
+        latencies = sorted(self._latencies)
+        size = max(1, config.MODERATION_BATCH_SIZE)
+        return {
+            **self.stats,
+            "pending": len(self._pending),
+            "batch_size": size,
+            "window_ms": config.MODERATION_BATCH_WINDOW_MS,
+            "avg_fill": round(sum(fills) / len(fills), 2) if fills else None,
+            "avg_fill_ratio": round(sum(fills) / len(fills) / size, 3) if fills else None,
+            "p50_latency_ms": int(latencies[len(latencies) // 2] * 1000) if latencies else None,
+            "p95_latency_ms": int(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000) if latencies else None,
+        }
+
+
+class ModerationQueue:
+    """Bounded work queue drained by MODERATION_WORKERS background workers.
+
+    on_message hands messages to offer() and moves on; workers run the
+    moderation handler off the hot path. Each worker has at most one check in
+    flight, so the worker count also caps how full a moderation batch can get.
+    When the queue is full, MODERATION_OVERFLOW_POLICY decides what happens:
+    "drop" discards the message, "sample" admits it with probability
+    MODERATION_OVERFLOW_SAMPLE_RATE by evicting the oldest queued message, and
+    "local_only" runs local_handler (the pre-filter only) on it instead. At
+    most MODERATION_WORKERS local-only checks run at once; beyond that,
+    overflow is dropped.
+    """
+
+    def __init__(self):
+        self.handler: Callable[[Any], Awaitable[None]] | None = None
+        self.local_handler: Callable[[Any], Awaitable[None]] | None = None
+        self._queue: asyncio.Queue | None = None
+        self._workers: list[asyncio.Task] = []
+        self._local: set[asyncio.Task] = set()
+        self._waits: deque[float] = deque(maxlen=METRICS_WINDOW)
+        self.stats = {"enqueued": 0, "processed": 0, "failed": 0, "dropped": 0, "sampled": 0, "local_only": 0}
+
+    def start(self, handler: Callable[[Any], Awaitable[None]], local_handler: Callable[[Any], Awaitable[None]] | None = None):
+        """Create the queue and spawn the workers (sizes are read here)."""
+        self.handler = handler
+        self.local_handler = local_handler
+        self._queue = asyncio.Queue(maxsize=max(1, config.MODERATION_QUEUE_SIZE))
+        self._workers = [asyncio.ensure_future(self._worker()) for _ in range(max(1, config.MODERATION_WORKERS))]
+
+    async def stop(self):
+        tasks = self._workers + list(self._local)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+
+    def offer(self, item) -> str:
+        """Queue an item without waiting. Returns "queued", "sampled", "dropped" or "local_only"."""
+        if self._queue is None:
+            self.stats["dropped"] += 1
+            return "dropped"
+        try:
+            self._queue.put_nowait((time.monotonic(), item))
+            self.stats["enqueued"] += 1
+            return "queued"
+        except asyncio.QueueFull:
+            pass
+
+        policy = config.MODERATION_OVERFLOW_POLICY
+        if policy == "local_only" and self.local_handler is not None and len(self._local) < max(1, config.MODERATION_WORKERS):
+            task = asyncio.ensure_future(self._run(self.local_handler, item))
+            self._local.add(task)
+            task.add_done_callback(self._local.discard)
+            self.stats["local_only"] += 1
+            return "local_only"
+        if policy == "sample" and random.random() < config.MODERATION_OVERFLOW_SAMPLE_RATE:
+            self._queue.get_nowait()
+            self._queue.task_done()
+            self._queue.put_nowait((time.monotonic(), item))
+            self.stats["dropped"] += 1
+            self.stats["sampled"] += 1
+            self.stats["enqueued"] += 1
+            return "sampled"
+        self.stats["dropped"] += 1
+        return "dropped"
+
+    async def _run(self, handler: Callable[[Any], Awaitable[None]], item):
+        try:
+            await handler(item)
+            self.stats["processed"] += 1
+        except Exception as e:
+            self.stats["failed"] += 1
+            print(f"Moderation worker error: {e}")
+
+    async def _worker(self):
+        queue = self._queue
+        while True:
+            queued_at, item = await queue.get()
+            self._waits.append(time.monotonic() - queued_at)
+            try:
+                await self._run(self.handler, item)
+            finally:
+                queue.task_done()
+
+    def snapshot(self) -> dict:
+        waits = sorted(self._waits)
+        return {
+            **self.stats,
+            "depth": self._queue.qsize() if self._queue else 0,
+            "max_size": self._queue.maxsize if self._queue else config.MODERATION_QUEUE_SIZE,
+            "workers": len(self._workers),
+            "local_in_flight": len(self._local),
+            "overflow_policy": config.MODERATION_OVERFLOW_POLICY,
+            "p95_wait_ms": int(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000) if waits else None,
+        }
+
+
+batcher = ModerationBatcher()
+queue = ModerationQueue()
+verdicts = VerdictCache()
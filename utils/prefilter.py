@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+
+import config
+import db as database
+
+# (clean_below, flag_at) score thresholds per MODERATION_SENSITIVITY. Messages
+# scoring below clean_below with no signal at all skip the AI, those at or
+# above flag_at are flagged locally, and everything else is sent to the
+# moderation AI.
+BANDS = {
+    "low": (0.4, 0.95),
+    "medium": (0.25, 0.9),
+    "high": (0.1, 0.8),
+}
+
+URL_RE = re.compile(r"https?://\S+|www\.\S+", re.IGNORECASE)
+WORD_RE = re.compile(r"[a-z0-9']+")
+REPEAT_CHAR_RE = re.compile(r"(.)\1{9,}")
+
+# Built-in rules: (pattern, score, reason)
+RULES = [
+    (re.compile(r"(discord\.gg|discord(app)?\.com/invite)/\w+", re.IGNORECASE), 0.5, "server invite link"),
+    (re.compile(r"free\s+(discord\s+)?nitro", re.IGNORECASE), 0.7, "nitro scam wording"),
+    (re.compile(r"(steam|discord)[\w-]*\.(gift|ru|xyz|click)\b", re.IGNORECASE), 0.8, "lookalike gift domain"),
+    (re.compile(r"\b(bit\.ly|tinyurl\.com|t\.co|cutt\.ly|grabify\.link)/", re.IGNORECASE), 0.3, "shortened link"),
+    (re.compile(r"\b(kill|hang|shoot)\s+(yo)?urs(elf|elves)\b|\bkys\b", re.IGNORECASE), 0.9, "self-harm encouragement"),
+    (re.compile(r"\b(go|just|pls|please)\s+(die|drown)\b|\bhope\s+(you|u)\s+die\b", re.IGNORECASE), 0.7, "telling someone to die"),
+    (re.compile(r"\bf+u+c*k+\s+(you|u|off)\b|\bstfu\b", re.IGNORECASE), 0.5, "profanity aimed at someone"),
+    (re.compile(
+        r"\b(you|u|ur|you'?re|you\s+are|u\s+r)\s+(an?\s+|such\s+an?\s+|so\s+|a\s+fucking\s+)?"
+        r"(idiot|moron|stupid|dumb|loser|worthless|pathetic|trash|garbage|retard\w*|bitch|asshole|cunt)\b",
+        re.IGNORECASE,
+    ), 0.6, "insult aimed at someone"),
+]
+
+# Small bundled linear classifier: per-word weights summed with BIAS and passed
+# through a logistic function. Words are matched lowercased; each counts once.
+# Any word weighing SIGNAL_WEIGHT or more keeps a message from being cleared
+# locally, however low its score.
+BIAS = -3.5
+SIGNAL_WEIGHT = 1.0
+WEIGHTS = {
+    # Harassment / toxicity
+    "idiot": 2.0, "moron": 2.0, "stupid": 1.5, "dumb": 1.2, "loser": 1.5, "trash": 1.0,
+    "pathetic": 1.2, "worthless": 1.8, "ugly": 1.0, "hate": 1.0, "shut": 0.6, "kill": 1.5,
+    "die": 1.2, "kys": 4.0, "fuck": 1.5, "fucking": 1.5, "shit": 0.8, "bitch": 2.0,
+    "bastard": 1.8, "ass": 0.6, "asshole": 2.0, "cunt": 2.5, "you": 0.3, "your": 0.2,
+    "yourself": 0.5, "retard": 2.5, "retarded": 2.5, "stfu": 2.0, "dick": 1.5, "whore": 2.5,
+    "slut": 2.5, "garbage": 1.0,
+    # Spam / scams
+    "free": 0.6, "nitro": 1.5, "giveaway": 1.0, "airdrop": 1.5, "crypto": 0.8, "claim": 1.0,
+    "click": 0.8, "gift": 0.6, "winner": 1.0, "prize": 0.8, "invest": 0.8, "profit": 0.8,
+    "guaranteed": 1.0, "subscribe": 0.6, "promo": 0.6, "discount": 0.5, "dm": 0.4,
+    # Adult content
+    "nsfw": 1.0, "porn": 2.0, "nude": 2.0, "nudes": 2.5, "onlyfans": 2.0, "sexy": 1.0,
+}
+
+
+@dataclass
+class PrefilterResult:
+    score: float
+    decision: str  # "clean", "flag" or "escalate"
+    reasons: list[str] = field(default_factory=list)
+
+
+def classify_text(content: str) -> float:
+    """Probability-like toxicity/spam score from the bundled word weights."""
+    words = set(WORD_RE.findall(content.lower()))
+    z = BIAS + sum(WEIGHTS.get(word, 0.0) for word in words)
+    return 1 / (1 + math.exp(-z))
+
+
+def signal_words(content: str) -> list[str]:
+    """Words in content weighing at least SIGNAL_WEIGHT, heaviest first."""
+    words = set(WORD_RE.findall(content.lower()))
+    return sorted((word for word in words if WEIGHTS.get(word, 0.0) >= SIGNAL_WEIGHT), key=lambda word: (-WEIGHTS[word], word))
+
+
+def heuristics(content: str, mentions: int = 0, mention_everyone: bool = False) -> list[tuple[float, str]]:
+    """Score link, mention, caps and repetition patterns. Returns (score, reason) pairs."""
+    signals = []
+
+    links = len(URL_RE.findall(content))
+    if links >= 3:
+        signals.append((0.6, f"{links} links"))
+    elif links == 2:
+        signals.append((0.3, "2 links"))
+    elif links == 1:
+        signals.append((0.1, "link"))
+
+    if mention_everyone:
+        signals.append((0.4, "@everyone/@here mention"))
+    if mentions >= 5:
+        signals.append((0.6, f"{mentions} mentions"))
+    elif mentions >= 3:
+        signals.append((0.3, f"{mentions} mentions"))
+
+    letters = [c for c in content if c.isalpha()]
+    if len(letters) >= 12 and sum(c.isupper() for c in letters) / len(letters) > 0.7:
+        signals.append((0.3, "mostly caps"))
+
+    if REPEAT_CHAR_RE.search(content):
+        signals.append((0.3, "repeated characters"))
+    words = WORD_RE.findall(content.lower())
+    if len(words) >= 5:
+        word, count = Counter(words).most_common(1)[0]
+        if count >= 5 and count / len(words) > 0.5:
+            signals.append((0.4, f"repeated word \"{word}\""))
+
+    for pattern, score, reason in RULES:
+        if pattern.search(content):
+            signals.append((score, reason))
+
+    return signals
+
+
+class Prefilter:
+    """First-stage local moderation scorer in front of the moderation AI.
+
+    Combines the guild blocklist (an instant flag), built-in regex rules,
+    heuristics and the bundled word classifier into one score in [0, 1], then
+    buckets it with the BANDS for the current MODERATION_SENSITIVITY. Only
+    messages that trip no rule, heuristic or signal word can be cleared
+    without the AI.
+    """
+
+    def __init__(self):
+        self._blocklists: dict[str, list[tuple[str, re.Pattern]]] = {}
+        self.stats = {"clean": 0, "flag": 0, "escalate": 0, "blocklist_hits": 0}
+
+    def invalidate(self, guild_id: str):
+        """Drop a guild's cached blocklist after it changes."""
+        self._blocklists.pop(guild_id, None)
+
+    async def _blocklist(self, guild_id: str) -> list[tuple[str, re.Pattern]]:
+        if guild_id not in self._blocklists:
+            entries = []
+            for row in await database.get_blocklist(guild_id):
+                term = row["term"]
+                try:
+                    pattern = term if row["is_regex"] else rf"(?<!\w){re.escape(term)}(?!\w)"
+                    entries.append((term, re.compile(pattern, re.IGNORECASE)))
+                except re.error as e:
+                    print(f"Skipping invalid blocklist regex {term!r}: {e}")
+            self._blocklists[guild_id] = entries
+        return self._blocklists[guild_id]
+
+    async def check(
+        self,
+        content: str,
+        guild_id: str | None = None,
+        mentions: int = 0,
+        mention_everyone: bool = False,
+    ) -> PrefilterResult:
+        if guild_id:
+            for term, pattern in await self._blocklist(guild_id):
+                if pattern.search(content):
+                    self.stats["blocklist_hits"] += 1
+                    self.stats["flag"] += 1
+                    return PrefilterResult(1.0, "flag", [f"blocklisted term \"{term}\""])
+
+        signals = heuristics(content, mentions, mention_everyone)
+        words = signal_words(content)
+        suspicious = bool(signals or words)
+        signals.append((classify_text(content), "toxic or spam wording" + (f" ({', '.join(words)})" if words else "")))
+
+        # Noisy-OR: each signal independently raises the chance the message is bad
+        clean = 1.0
+        for score, _ in signals:
+            clean *= 1 - score
+        score = 1 - clean
+
+        clean_below, flag_at = BANDS.get(config.MODERATION_SENSITIVITY, BANDS["medium"])
+        if score < clean_below and not suspicious:
+            decision = "clean"
+        elif score >= flag_at:
+            decision = "flag"
+        else:
+            decision = "escalate"
+        self.stats[decision] += 1
+        reasons = [reason for signal, reason in sorted(signals, reverse=True) if signal >= 0.1]
+        return PrefilterResult(round(score, 3), decision, reasons)
+
+    def snapshot(self) -> dict:
+        checked = self.stats["clean"] + self.stats["flag"] + self.stats["escalate"]
+        return {
+            **self.stats,
+            "checked": checked,
+            "escalation_rate": round(self.stats["escalate"] / checked, 3) if checked else None,
+            "sensitivity": config.MODERATION_SENSITIVITY,
+        }
+
+
+prefilter = Prefilter()
@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import math
+import threading
+import time
+from collections import deque
+
+import config
+
+LATENCY_WINDOW = 200
+
+
+def _status_code(error: BaseException) -> int | None:
+    """Best-effort HTTP status of a provider error (openai.APIStatusError carries one)."""
+    return getattr(error, "status_code", None)
+
+
+def _percentile(samples, p: float) -> float | None:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+class ProviderHealth:
+    """Rolling success/latency stats and circuit breaker state for one provider.
+
+    The circuit opens after CIRCUIT_FAILURE_THRESHOLD consecutive failures, or
+    after CIRCUIT_BURST_THRESHOLD rate-limit/server errors (429, 5xx, timeouts)
+    within CIRCUIT_BURST_WINDOW seconds. While open the provider is skipped; after
+    CIRCUIT_COOLDOWN_SECONDS a single trial request is let through (half-open),
+    and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._latencies: dict[bool, deque[float]] = {
+            False: deque(maxlen=LATENCY_WINDOW),
+            True: deque(maxlen=LATENCY_WINDOW),
+        }
+        self._outcomes: deque[bool] = deque(maxlen=config.HEALTH_WINDOW)
+        self._bursts: deque[float] = deque()
+        self._consecutive_failures = 0
+        self._open_until: float | None = None
+        self._trial_in_flight = False
+        self.last_error: str | None = None
+
+    @property
+    def state(self) -> str:
+        if self._open_until is None:
+            return "closed"
+        if time.monotonic() < self._open_until:
+            return "open"
+        return "half_open"
+
+    def available(self) -> bool:
+        """Whether a request may be routed to this provider right now."""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial_in_flight:
+            return True
+        return False
+
+    def begin(self):
+        """Note that a request is starting; claims the trial slot when half-open."""
+        if self.state == "half_open":
+            self._trial_in_flight = True
+
+    def record_success(self, latency: float, streaming: bool = False):
+        self._latencies[streaming].append(latency)
+        self._outcomes.append(True)
+        self._consecutive_failures = 0
+        self._open_until = None
+        self._trial_in_flight = False
+
+    def record_failure(self, error: BaseException):
+        now = time.monotonic()
+        self._outcomes.append(False)
+        self._consecutive_failures += 1
+        self.last_error = str(error)[:200]
+
+        status = _status_code(error)
+        if status is None or status == 429 or status >= 500:
+            self._bursts.append(now)
+        while self._bursts and now - self._bursts[0] > config.CIRCUIT_BURST_WINDOW:
+            self._bursts.popleft()
+
+        if (
+            self.state == "half_open"
+            or self._consecutive_failures >= config.CIRCUIT_FAILURE_THRESHOLD
+            or len(self._bursts) >= config.CIRCUIT_BURST_THRESHOLD
+        ):
+            self._open_until = now + config.CIRCUIT_COOLDOWN_SECONDS
+            self._bursts.clear()
+        self._trial_in_flight = False
+
+    def release(self):
+        """Release a trial slot for a request that ended without an outcome (e.g. a cancelled hedge)."""
+        self._trial_in_flight = False
+
+    def latency(self, p: float, streaming: bool = False) -> float | None:
+        return _percentile(self._latencies[streaming], p)
+
+    def sample_count(self, streaming: bool = False) -> int:
+        return len(self._latencies[streaming])
+
+    @property
+    def success_rate(self) -> float | None:
+        if not self._outcomes:
+            return None
+        return sum(self._outcomes) / len(self._outcomes)
+
+    def score(self) -> float | None:
+        """Expected seconds to a successful answer (p50 / success rate); lower is better."""
+        p50 = self.latency(50)
+        rate = self.success_rate
+        if p50 is None or rate is None or len(self._outcomes) < config.HEALTH_MIN_SAMPLES:
+            return None
+        return p50 / max(rate, 0.05)
+
+    def snapshot(self) -> dict:
+        def ms(value: float | None) -> int | None:
+            return None if value is None else int(value * 1000)
+
+        remaining = None
+        if self.state == "open":
+            remaining = int(self._open_until - time.monotonic())
+        score = self.score()
+        return {
+            "state": self.state,
+            "success_rate": None if self.success_rate is None else round(self.success_rate, 3),
+            "requests": len(self._outcomes),
+            "p50_ms": ms(self.latency(50)),
+            "p95_ms": ms(self.latency(95)),
+            "recent_errors": len(self._bursts),
+            "consecutive_failures": self._consecutive_failures,
+            "cooldown_remaining_s": remaining,
+            "score": None if score is None else round(score, 3),
+            "last_error": self.last_error,
+        }
+
+
+class HealthTracker:
+    """Health for every provider, plus health-aware ordering of the fallback chain."""
+
+    def __init__(self):
+        self._providers: dict[str, ProviderHealth] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> ProviderHealth:
+        health = self._providers.get(name)
+        if health is None:
+            with self._lock:
+                health = self._providers.setdefault(name, ProviderHealth(name))
+        return health
+
+    def order(self, candidates: list[str], pinned: str | None = None) -> list[str]:
+        """Reorder candidates by live health.
+
+        Providers with an open circuit are skipped, unless every candidate is
+        tripped, in which case the configured order is returned unchanged. The
+        rest are stably sorted by score, bucketed to powers of two so small
+        latency differences don't reshuffle the chain; providers without enough
+        data are scored as if they took HEDGE_DELAY_MS. A pinned provider (a
+        channel override) stays first while it is available.
+        """
+        available = [name for name in candidates if self.get(name).available()]
+        if not available:
+            return list(candidates)
+
+        fallback_score = config.HEDGE_DELAY_MS / 1000
+
+        def key(name: str) -> float:
+            if name == pinned:
+                return -math.inf
+            score = self.get(name).score()
+            if score is None:
+                score = fallback_score
+            return round(math.log2(max(score, 0.001)))
+
+        return sorted(available, key=key)
+
+    def snapshot(self, names: list[str]) -> dict[str, dict]:
+        return {name: self.get(name).snapshot() for name in names}
+
+
+tracker = HealthTracker()
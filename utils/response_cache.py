@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+import config
+import db as database
+
+# Purge expired SQLite rows once every this many stores
+PURGE_EVERY = 200
+
+
+def make_key(provider: str, model: str, system_prompt: str, messages: list[dict], max_tokens: int) -> str:
+    """Hash everything that determines a completion into a cache key."""
+    payload = json.dumps(
+        [provider, model, system_prompt, messages, max_tokens],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Two-tier cache of AI responses: an in-memory LRU in front of the SQLite response_cache table.
+
+    Entries expire after CACHE_TTL_SECONDS in both tiers. Only request types listed
+    in CACHE_REQUEST_TYPES are cached; see providers.chat().
+    """
+
+    def __init__(self):
+        self._memory: OrderedDict[str, tuple[float, str, str]] = OrderedDict()
+        self._stores = 0
+        self.stats = {"memory_hits": 0, "db_hits": 0, "misses": 0, "stores": 0, "errors": 0}
+        self.by_type: dict[str, dict[str, int]] = {}
+
+    def enabled_for(self, request_type: str) -> bool:
+        return config.CACHE_ENABLED and request_type in config.CACHE_REQUEST_TYPES
+
+    def _count(self, request_type: str, outcome: str):
+        self.stats[outcome] += 1
+        counts = self.by_type.setdefault(request_type, {"hits": 0, "misses": 0})
+        counts["misses" if outcome == "misses" else "hits"] += 1
+
+    def _remember(self, key: str, provider: str, response: str):
+        self._memory[key] = (time.monotonic() + config.CACHE_TTL_SECONDS, provider, response)
+        self._memory.move_to_end(key)
+        while len(self._memory) > config.CACHE_MEMORY_ITEMS:
+            self._memory.popitem(last=False)
+
+    async def get(self, keys: list[str], request_type: str) -> tuple[str, str] | None:
+        """Return (response, provider) for the first key that is cached, or None."""
+        now = time.monotonic()
+        for key in keys:
+            entry = self._memory.get(key)
+            if entry is None:
+                continue
+            expires, provider, response = entry
+            if expires <= now:
+                del self._memory[key]
+                continue
+            self._memory.move_to_end(key)
+            self._count(request_type, "memory_hits")
+            return response, provider
+
+        try:
+            for key in keys:
+                row = await database.get_cached_response(key)
+                if row:
+                    self._remember(key, row["provider"], row["response"])
+                    self._count(request_type, "db_hits")
+                    return row["response"], row["provider"]
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"Response cache lookup failed: {e}")
+
+        self._count(request_type, "misses")
+        return None
+
+    async def set(self, key: str, provider: str, response: str):
+        if not response:
+            return
+        self._remember(key, provider, response)
+        self.stats["stores"] += 1
+        try:
+            await database.set_cached_response(key, provider, response, config.CACHE_TTL_SECONDS)
+            self._stores += 1
+            if self._stores % PURGE_EVERY == 0:
+                await database.purge_expired_responses()
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"Response cache store failed: {e}")
+
+    def snapshot(self) -> dict:
+        lookups = self.stats["memory_hits"] + self.stats["db_hits"] + self.stats["misses"]
+        hits = lookups - self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": round(hits / lookups, 3) if lookups else None,
+            "memory_items": len(self._memory),
+            "by_type": self.by_type,
+        }
+
+
+cache = ResponseCache()
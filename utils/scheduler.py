@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+
+import config
+
+# Lower runs first. Interactive traffic, then on-demand tools, then background work.
+PRIORITY_CLASSES = {
+    "chat": 0,
+    "summarize": 1,
+    "code_review": 1,
+    "translation": 1,
+    "moderation_check": 2,
+    "digest": 2,
+}
+DEFAULT_PRIORITY = 1
+PRIORITY_NAMES = {0: "interactive", 1: "tools", 2: "background"}
+
+
+class QueueTimeout(Exception):
+    """Raised when a request waits longer than SCHEDULER_MAX_WAIT for a provider slot."""
+
+
+def priority_for(request_type: str) -> int:
+    return PRIORITY_CLASSES.get(request_type, DEFAULT_PRIORITY)
+
+
+class TokenBucket:
+    """A bucket refilled continuously at `per_minute` units per minute; 0 means unlimited."""
+
+    def __init__(self, per_minute: int):
+        self.per_minute = per_minute
+        self.tokens = float(per_minute)
+        self._updated = time.monotonic()
+
+    def set_rate(self, per_minute: int):
+        if per_minute != self.per_minute:
+            # Start full when a limit is first applied, otherwise keep what's left
+            self.tokens = float(per_minute) if self.per_minute <= 0 else min(self.tokens, float(per_minute))
+            self.per_minute = per_minute
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(float(self.per_minute), self.tokens + (now - self._updated) * self.per_minute / 60)
+        self._updated = now
+
+    def wait_time(self, amount: int) -> float:
+        """Seconds until `amount` units are available (amounts above capacity wait for a full bucket)."""
+        if self.per_minute <= 0:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.per_minute)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60 / self.per_minute
+
+    def take(self, amount: int):
+        if self.per_minute > 0:
+            self.tokens -= min(amount, self.per_minute)
+
+
+class Ticket:
+    """A granted provider slot; release() it when the request (or stream) ends."""
+
+    def __init__(self, gate: ProviderGate):
+        self._gate = gate
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._gate._release()
+
+
+class ProviderGate:
+    """Admission control for one provider: max in-flight requests, RPM/TPM buckets and a priority queue."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.in_flight = 0
+        self._requests = TokenBucket(0)
+        self._tokens = TokenBucket(0)
+        self._waiters: list[tuple[int, int, asyncio.Future, int]] = []
+        self._seq = itertools.count()
+        self._timer: asyncio.TimerHandle | None = None
+        self._waits: deque[float] = deque(maxlen=200)
+        self.timeouts = 0
+        self.granted = 0
+
+    def _sync_limits(self):
+        provider = config.PROVIDERS.get(self.name, {})
+        self._requests.set_rate(provider.get("rpm", 0))
+        self._tokens.set_rate(provider.get("tpm", 0))
+
+    async def acquire(self, priority: int, tokens: int) -> Ticket:
+        self._sync_limits()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future, tokens))
+        queued_at = time.monotonic()
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=config.SCHEDULER_MAX_WAIT or None)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                # Granted at the last moment; hand the slot back
+                Ticket(self).release()
+            future.cancel()
+            self.timeouts += 1
+            raise QueueTimeout(f"waited over {config.SCHEDULER_MAX_WAIT:g}s for a slot") from None
+        except BaseException:
+            if future.done() and not future.cancelled():
+                Ticket(self).release()
+            future.cancel()
+            raise
+        self._waits.append(time.monotonic() - queued_at)
+        return Ticket(self)
+
+    def _release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._waiters and self.in_flight < max(1, config.PROVIDER_MAX_CONCURRENCY):
+            _, _, future, tokens = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            wait = max(self._requests.wait_time(1), self._tokens.wait_time(tokens))
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+            heapq.heappop(self._waiters)
+            self._requests.take(1)
+            self._tokens.take(tokens)
+            self.in_flight += 1
+            self.granted += 1
+            future.set_result(None)
+
+    def snapshot(self) -> dict:
+        queued = {name: 0 for name in PRIORITY_NAMES.values()}
+        for priority, _, future, _ in self._waiters:
+            if not future.done():
+                queued[PRIORITY_NAMES.get(priority, str(priority))] += 1
+        waits = sorted(self._waits)
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": max(1, config.PROVIDER_MAX_CONCURRENCY),
+            "queued": queued,
+            "queue_depth": sum(queued.values()),
+            "avg_wait_ms": int(sum(waits) / len(waits) * 1000) if waits else None,
+            "p95_wait_ms": int(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000) if waits else None,
+            "rpm_limit": self._requests.per_minute or None,
+            "tpm_limit": self._tokens.per_minute or None,
+            "granted": self.granted,
+            "timeouts": self.timeouts,
+        }
+
+
+class Scheduler:
+    """Per-provider admission control in front of providers.chat()."""
+
+    def __init__(self):
+        self._gates: dict[str, ProviderGate] = {}
+
+    def gate(self, name: str) -> ProviderGate:
+        if name not in self._gates:
+            self._gates[name] = ProviderGate(name)
+        return self._gates[name]
+
+    async def acquire(self, name: str, request_type: str, tokens: int) -> Ticket:
+        return await self.gate(name).acquire(priority_for(request_type), tokens)
+
+    def snapshot(self) -> dict[str, dict]:
+        return {name: gate.snapshot() for name, gate in self._gates.items()}
+
+
+scheduler = Scheduler()
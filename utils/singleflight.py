@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+from collections.abc import Awaitable, Callable
+from typing import TypeVar
+
+T = TypeVar("T")
+
+
+def make_key(*parts) -> str:
+    """Hash JSON-serializable request parts into a coalescing key."""
+    payload = json.dumps(parts, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into one upstream call.
+
+    The first caller starts the call as a task; callers arriving while it is in
+    flight await the same task and receive its result (or exception). The task
+    is shielded, so one caller being cancelled doesn't cancel it for the others.
+    """
+
+    def __init__(self):
+        self._calls: dict[str, asyncio.Task] = {}
+        self.stats = {"calls": 0, "shared": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._calls.get(key)
+        if task is not None:
+            self.stats["shared"] += 1
+            return await asyncio.shield(task)
+
+        self.stats["calls"] += 1
+        task = asyncio.ensure_future(fn())
+        self._calls[key] = task
+        task.add_done_callback(lambda _: self._calls.pop(key, None))
+        return await asyncio.shield(task)
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "in_flight": len(self._calls)}
+
+
+singleflight = SingleFlight()
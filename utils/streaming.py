@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import time
+from collections.abc import Awaitable, Callable
+
+import discord
+import config
+
+DISCORD_MESSAGE_LIMIT = 2000
+
+
+class StreamingReply:
+    """Render a streamed AI response into Discord messages as tokens arrive.
+
+    The first message is posted as soon as there is text to show, then edited at
+    most once every ``interval`` seconds. When the text outgrows Discord's message
+    limit the current message is finalized and a new one is started.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[str], Awaitable[discord.Message]],
+        limit: int = DISCORD_MESSAGE_LIMIT,
+        interval: float | None = None,
+    ):
+        self._send = send
+        self._limit = limit
+        self._interval = config.STREAM_EDIT_INTERVAL if interval is None else interval
+        self._current: discord.Message | None = None
+        self._pending = ""  # text belonging to the current (last) message
+        self._shown = ""  # what the current message currently displays
+        self._last_render = 0.0
+        self.content = ""  # the full response received so far
+        self.messages: list[discord.Message] = []
+
+    async def push(self, delta: str):
+        """Append a chunk of response text, rendering it if the throttle allows."""
+        self.content += delta
+        self._pending += delta
+        await self._roll_over()
+        if time.monotonic() - self._last_render >= self._interval:
+            await self._render(self._pending)
+
+    async def finish(self, suffix: str = ""):
+        """Flush any remaining text, appending an optional suffix such as a footer."""
+        self._pending += suffix
+        await self._roll_over()
+        await self._render(self._pending)
+
+    async def _roll_over(self):
+        while len(self._pending) > self._limit:
+            head, self._pending = self._pending[: self._limit], self._pending[self._limit :]
+            await self._render(head)
+            self._current = None
+            self._shown = ""
+
+    async def _render(self, text: str):
+        if not text.strip() or text == self._shown:
+            return
+        if self._current is None:
+            self._current = await self._send(text)
+            self.messages.append(self._current)
+        else:
+            await self._current.edit(content=text)
+        self._shown = text
+        self._last_render = time.monotonic()
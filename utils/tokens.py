@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+
+try:
+    import tiktoken
+except ImportError:  # optional: fall back to a character-based estimate
+    tiktoken = None
+
+# Approximate size of each provider's tokenizer output relative to cl100k_base,
+# which is what count_tokens() measures. Cached counts are stored unscaled.
+PROVIDER_TOKEN_RATIO = {
+    "gemini": 1.0,
+    "groq": 1.1,
+    "openrouter": 1.1,
+    "anthropic": 1.15,
+    "openai": 1.0,
+}
+
+# Per-message framing tokens (role, separators) added by chat templates
+MESSAGE_OVERHEAD = 4
+CHARS_PER_TOKEN = 4
+TRUNCATION_MARKER = "\n…[truncated]"
+
+_encoding = None
+_encoding_error: Exception | None = None
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    """Return the cl100k_base encoding, or None to use the character estimate.
+
+    The first load may download the BPE file. If it fails (e.g. offline), the
+    estimate is used from then on; while another thread is loading it, callers
+    estimate rather than wait.
+    """
+    global _encoding, _encoding_error
+    if _encoding is not None or _encoding_error is not None or tiktoken is None:
+        return _encoding
+    if not _encoding_lock.acquire(blocking=False):
+        return None
+    try:
+        if _encoding is None and _encoding_error is None:
+            try:
+                _encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                _encoding_error = e
+                print(f"Could not load the cl100k_base tokenizer, estimating token counts instead: {e}")
+    finally:
+        _encoding_lock.release()
+    return _encoding
+
+
+async def load_encoding():
+    """Load the tokenizer in a worker thread, so a first-run download doesn't block the event loop."""
+    await asyncio.to_thread(_get_encoding)
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens in text with cl100k_base, or estimate when tiktoken isn't installed."""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def provider_ratio(provider_name: str | None) -> float:
+    return PROVIDER_TOKEN_RATIO.get(provider_name or "", 1.1)
+
+
+def for_provider(tokens: int, provider_name: str | None) -> int:
+    """Scale a count_tokens() result to the given provider's tokenizer."""
+    return int(tokens * provider_ratio(provider_name) + 0.5)
+
+
+def truncate(text: str, max_tokens: int) -> str:
+    """Cut text down to roughly max_tokens (cl100k_base) tokens, marking the cut."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    keep = max(0, max_tokens - count_tokens(TRUNCATION_MARKER))
+    encoding = _get_encoding()
+    if encoding is not None:
+        head = encoding.decode(encoding.encode(text, disallowed_special=())[:keep])
+    else:
+        head = text[: keep * CHARS_PER_TOKEN]
+    return head + TRUNCATION_MARKER